@@ -30,6 +30,8 @@ after modeling.
   like upward continuation, derivatives, etc
 * :mod:`~fatiando.gravmag.imaging`: Imaging methods for potential fields for
   estimating physical property distributions
+* :mod:`~fatiando.gravmag.spectral`: Spectral estimates of the depth to the
+  sources in moving windows
 * :mod:`~fatiando.gravmag.tensor`: Utilities for operating on the gradient
   tensor
 
@@ -0,0 +1,142 @@
+"""
+FFT backends for the transformations in the wavenumber domain.
+
+These functions are used by fatiando.gravmag.transform and
+fatiando.gravmag.imaging and are not meant to be used directly. Select the
+backend with :func:`fatiando.gravmag.transform.set_fft_backend`.
+
+Available backends:
+
+* ``'pyfftw'``: Uses the FFTW library through pyFFTW (if it is installed). The
+  FFTW plans are kept in a cache keyed by the shape of the grid, the type of
+  transform and the number of threads, so they are only created once.
+* ``'scipy'``: Uses ``scipy.fft`` (scipy >= 1.4), which runs in parallel with
+  ``workers`` and keeps its own cache of plans.
+* ``'numpy'``: Uses ``numpy.fft``. Ignores the number of workers.
+
+The default is the first one available in the list above.
+
+All functions take a *workers* argument with the number of threads to use.
+Negative values count from the number of cores (``-1`` uses all cores).
+
+"""
+from __future__ import division, absolute_import
+from collections import OrderedDict
+import multiprocessing
+
+import numpy
+
+try:
+    import pyfftw
+    import pyfftw.builders
+except ImportError:
+    pyfftw = None
+try:
+    import scipy.fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
+
+BACKENDS = [name for name, module in [('pyfftw', pyfftw),
+                                      ('scipy', scipy_fft)]
+            if module is not None] + ['numpy']
+# Maximum number of FFTW plans kept in memory
+PLAN_CACHE_SIZE = 32
+
+_backend = BACKENDS[0]
+_plans = OrderedDict()
+
+
+def set_backend(backend):
+    """
+    Set the backend used for the FFTs.
+
+    Parameters:
+
+    * backend : str
+        One of the names in ``BACKENDS``.
+
+    """
+    global _backend
+    assert backend in BACKENDS, \
+        "Invalid or unavailable FFT backend '{}'. Options are {}.".format(
+            backend, BACKENDS)
+    _backend = backend
+    _plans.clear()
+
+
+def get_backend():
+    """
+    The name of the backend currently used for the FFTs.
+    """
+    return _backend
+
+
+def rfft2(array, workers=1):
+    """
+    2D FFT of a real array (only the non-negative frequencies of the last
+    axis).
+    """
+    array = numpy.asarray(array, dtype=numpy.float64)
+    if _backend == 'pyfftw':
+        return _plan('rfft2', array, workers)(array).copy()
+    if _backend == 'scipy':
+        return scipy_fft.rfft2(array, workers=workers)
+    return numpy.fft.rfft2(array)
+
+
+def irfft2(array, shape, workers=1):
+    """
+    Inverse of :func:`rfft2`. *shape* is the shape of the real output.
+
+    The *array* might be overwritten.
+    """
+    shape = tuple(shape)
+    if _backend == 'pyfftw':
+        return _plan('irfft2', array, workers, shape)(array).copy()
+    if _backend == 'scipy':
+        return scipy_fft.irfft2(array, s=shape, workers=workers,
+                                overwrite_x=True)
+    return numpy.fft.irfft2(array, s=shape)
+
+
+def fft2(array, workers=1):
+    """
+    2D FFT of an array (all frequencies).
+    """
+    if _backend == 'pyfftw':
+        array = numpy.asarray(array, dtype=numpy.complex128)
+        return _plan('fft2', array, workers)(array).copy()
+    if _backend == 'scipy':
+        return scipy_fft.fft2(array, workers=workers)
+    return numpy.fft.fft2(array)
+
+
+def _threads(workers):
+    "Convert the number of workers (possibly negative) to a thread count"
+    if workers is None:
+        return 1
+    if workers < 0:
+        return max(multiprocessing.cpu_count() + 1 + workers, 1)
+    return workers
+
+
+def _plan(kind, array, workers, shape=None):
+    """
+    Get the FFTW plan for this transform from the cache or create a new one.
+    """
+    threads = _threads(workers)
+    key = (kind, array.shape, array.dtype.str, shape, threads)
+    if key in _plans:
+        # Move it to the end to mark it as the most recently used
+        _plans[key] = _plans.pop(key)
+        return _plans[key]
+    template = pyfftw.empty_aligned(array.shape, dtype=array.dtype)
+    if kind == 'irfft2':
+        plan = pyfftw.builders.irfft2(template, s=shape, threads=threads)
+    else:
+        plan = getattr(pyfftw.builders, kind)(template, threads=threads)
+    _plans[key] = plan
+    while len(_plans) > PLAN_CACHE_SIZE:
+        _plans.popitem(last=False)
+    return plan
@@ -12,7 +12,17 @@ the layer. Use :mod:`fatiando.gravmag.sphere` for forward modeling.
   :class:`~fatiando.gravmag.eqlayer.EQLTotalField`: The classic (space domain)
   equivalent layer as formulated in Li and Oldenburg (2010) or
   Oliveira Jr. et al (2012).
-  Doesn't have wavelet compression or other tweaks.
+  Doesn't have wavelet compression or other tweaks. Large layers can be
+  solved without storing the Jacobian or Hessian using ``matrix_free=True``
+  and the Conjugate Gradient method (``config('cg')``).
+  If the data and the layer are on the same regular grid, use ``fft=True`` to
+  calculate the products with the Jacobian using 2D FFTs (the Jacobian is
+  Block-Toeplitz Toeplitz-Block). The fitted layer can upward continue
+  (``upcontinue``) and reduce to the pole (``reduce_to_pole``) the data.
+* :class:`~fatiando.gravmag.eqlayer.WindowedEQL`: A moving window version of
+  the classic equivalent layer. Fits an independent layer on overlapping
+  windows (in parallel) and blends their predictions. Memory use depends only
+  on the size of the windows.
 * :class:`~fatiando.gravmag.eqlayer.PELGravity` and
   :class:`~fatiando.gravmag.eqlayer.PELTotalField`: The polynomial equivalent
   layer of Oliveira Jr. et al (2012). A fast and memory efficient algorithm.
@@ -32,25 +42,133 @@ equivalent layer, Geophysics, 78(1), G1-G13, doi:10.1190/geo2012-0196.1.
 """
 from __future__ import division, absolute_import
 from future.builtins import super, range
+import multiprocessing
 import numpy
 import scipy.sparse
+import scipy.sparse.linalg
 
 from . import sphere as kernel
-from ..utils import dircos, safe_dot
-from ..inversion import Misfit, Smoothness
+from ..constants import G, SI2MGAL, SI2EOTVOS, CM, T2NT
+from ..mesher import PointGrid
+from ..utils import dircos, safe_dot, safe_diagonal, LinearOperatorSum
+from ..inversion import Misfit, Smoothness, Damping
+
+
+# Maximum number of elements in the temporary arrays used to build the kernel
+# matrix of the point sources. Data rows are processed in chunks of this size
+# so that memory use doesn't explode for large layers.
+MAX_CHUNK_SIZE = 2**22
 
 
 class EQLBase(Misfit):
     """
     Base class for the classic equivalent layer.
+
+    Subclasses must implement a ``_kernel(self, x, y, z)`` method that
+    calculates the field of unit volume point sources given the distances
+    ``x = xsource - xdata`` (and so on) as 2d-arrays.
+
+    If ``matrix_free`` is True, the Jacobian and Hessian will be
+    :class:`scipy.sparse.linalg.LinearOperator` objects that compute the
+    kernel of the point sources on the fly whenever a product is needed. The
+    layer is then fitted with the Conjugate Gradient method
+    (``config('cg')``). This is the default for these layers and the
+    ``'linear'`` solver also switches to it, so ``fit()`` works when the
+    layer is combined with regularization.
+
+    If ``fft`` is True, the data must be on a regular grid with the same shape
+    and spacing as the :class:`~fatiando.mesher.PointGrid` layer (at a
+    constant height). The Jacobian is then a Block-Toeplitz Toeplitz-Block
+    (BTTB) matrix and its products with vectors are calculated with 2D FFTs.
     """
 
-    def __init__(self, x, y, z, data, grid):
+    def __init__(self, x, y, z, data, grid, dtype='float64',
+                 matrix_free=False, block_cache=0, fft=False):
         super().__init__(data=data, nparams=len(grid), islinear=True)
         self.x = x
         self.y = y
         self.z = z
         self.grid = grid
+        self.dtype = dtype
+        self.matrix_free = matrix_free
+        self.block_cache = block_cache
+        self.fft = fft
+        if matrix_free or fft:
+            # The Hessian is a LinearOperator and can't be factorized
+            self.config('cg')
+
+    def _kernel_blocks(self, grid, first=0):
+        """
+        Iterate over the sensitivity matrix of the point sources in *grid*.
+
+        The matrix is calculated with array broadcasting in blocks of data
+        rows with at most ``MAX_CHUNK_SIZE`` elements each.
+
+        Parameters:
+
+        * grid : :class:`~fatiando.mesher.PointGrid` or list of spheres
+            The point sources.
+        * first : int
+            Index of the data row where the iteration begins. Must be the start
+            of a block.
+
+        Yields:
+
+        * start, end, block
+            The block of the matrix with data rows from *start* to *end*.
+
+        """
+        sx, sy, sz, volume = _source_arrays(grid)
+        x = numpy.ravel(self.x)
+        y = numpy.ravel(self.y)
+        z = numpy.ravel(self.z*numpy.ones_like(self.x))
+        chunk = max(1, MAX_CHUNK_SIZE//sx.size)
+        for start in range(first, x.size, chunk):
+            end = min(start + chunk, x.size)
+            block = volume*self._kernel(
+                sx - x[start:end, numpy.newaxis],
+                sy - y[start:end, numpy.newaxis],
+                sz - z[start:end, numpy.newaxis])
+            yield start, end, block
+
+    def _kernel_matrix(self, grid):
+        """
+        Calculate the sensitivity matrix of the point sources in *grid*.
+
+        The matrix is stored with the ``dtype`` of the layer.
+        """
+        matrix = numpy.empty((self.ndata, len(grid)), dtype=self.dtype)
+        for start, end, block in self._kernel_blocks(grid):
+            matrix[start:end] = block
+        return matrix
+
+    def jacobian(self, p):
+        """
+        Calculate the Jacobian matrix for a given parameter vector.
+
+        If the layer is ``matrix_free`` or uses the ``fft``, returns a
+        :class:`scipy.sparse.linalg.LinearOperator` instead.
+        """
+        if self.fft:
+            return _BTTBOperator(self)
+        if self.matrix_free:
+            return _KernelOperator(self, self.block_cache)
+        return self._kernel_matrix(self.grid)
+
+    def hessian(self, p):
+        """
+        The Hessian of the misfit function with respect to the parameters.
+
+        See :meth:`fatiando.inversion.misfit.Misfit.hessian`. If the layer is
+        ``matrix_free`` or uses the ``fft``, returns a
+        :class:`scipy.sparse.linalg.LinearOperator` that never forms the
+        matrix. Each product with a vector costs one pass over the kernel
+        blocks (or 4 FFTs).
+        """
+        if not (self.matrix_free or self.fft):
+            return super().hessian(p)
+        hessian = _GaussHessianOperator(self.jacobian(p), self.weights)
+        return LinearOperatorSum([hessian], 2*self.regul_param)
 
     def predicted(self, p):
         """
@@ -70,6 +188,47 @@ class EQLBase(Misfit):
         """
         return safe_dot(self.jacobian(p), p)
 
+    def upcontinue(self, height, p=None):
+        """
+        Upward continue the data using the fitted layer.
+
+        Forward models the layer on the same data points but *height* units
+        higher. With ``fft=True``, this is done with FFTs as well.
+
+        Parameters:
+
+        * height : float
+            How much higher to continue the data (positive upward).
+        * p : 1d-array (optional)
+            The parameter vector of the layer. If not given, will use the value
+            calculated by ``.fit()``.
+
+        Returns:
+
+        * result : 1d-array
+            The upward continued data.
+
+        """
+        if p is None:
+            p = self.p_
+        return self._transformed(z=self.z - height).predicted(p)
+
+    def _transformed(self, **kwargs):
+        """
+        Make a copy of the layer with some of its attributes changed.
+
+        The cached methods of the copy are reset so that its predicted data
+        are calculated with the new attributes.
+        """
+        layer = self.copy()
+        for name in kwargs:
+            setattr(layer, name, kwargs[name])
+        for name in ['predicted', 'jacobian', 'hessian']:
+            meth = getattr(layer, name)
+            if hasattr(meth, 'hard_reset'):
+                meth.hard_reset()
+        return layer
+
 
 class EQLGravity(EQLBase):
     """
@@ -90,25 +249,35 @@ class EQLGravity(EQLBase):
         Which gravitational field is the data. Options are: ``'gz'`` (gravity
         anomaly), ``'gxx'``, ``'gxy'``, ..., ``'gzz'`` (gravity gradient
         tensor). Defaults to ``'gz'``.
+    * dtype : string or numpy dtype
+        The data type of the Jacobian matrix. Use ``'float32'`` to halve the
+        memory used by large layers. Defaults to ``'float64'``.
+    * matrix_free : True or False
+        If True, will never store the Jacobian or Hessian matrices. Products
+        with them are calculated on the fly instead. Use this with
+        ``config('cg')`` for layers that are too large to fit in memory.
+    * block_cache : int
+        Only used if *matrix_free* is True. Maximum number of bytes used to
+        keep blocks of the Jacobian in memory between products. Cached blocks
+        don't have to be recomputed on later iterations. Defaults to 0 (no
+        caching).
+    * fft : True or False
+        If True, calculate the products with the Jacobian with 2D FFTs. The
+        data must be on the same regular grid as the layer and at a constant
+        height (see :class:`~fatiando.gravmag.eqlayer.EQLBase`). Use this with
+        ``config('cg')``. Memory use is proportional to the number of data.
 
     """
 
-    def __init__(self, x, y, z, data, grid, field='gz'):
-        super().__init__(x, y, z, data, grid)
+    def __init__(self, x, y, z, data, grid, field='gz', dtype='float64',
+                 matrix_free=False, block_cache=0, fft=False):
+        super().__init__(x, y, z, data, grid, dtype=dtype,
+                         matrix_free=matrix_free, block_cache=block_cache,
+                         fft=fft)
         self.field = field
 
-    def jacobian(self, p):
-        """
-        Calculate the Jacobian matrix for a given parameter vector.
-        """
-        x = self.x
-        y = self.y
-        z = self.z
-        func = getattr(kernel, self.field)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=numpy.float)
-        for i, c in enumerate(self.grid):
-            jac[:, i] = func(x, y, z, [c], dens=1.)
-        return jac
+    def _kernel(self, x, y, z):
+        return _gravity_kernel(self.field, x, y, z)
 
 
 class EQLTotalField(EQLBase):
@@ -133,34 +302,539 @@ class EQLTotalField(EQLBase):
         there is remanent magnetization and the total magnetization of the
         layer if different from the induced magnetization.
         If there is only induced magnetization, use None
+    * dtype : string or numpy dtype
+        The data type of the Jacobian matrix. Use ``'float32'`` to halve the
+        memory used by large layers. Defaults to ``'float64'``.
+    * matrix_free : True or False
+        If True, will never store the Jacobian or Hessian matrices. Products
+        with them are calculated on the fly instead. Use this with
+        ``config('cg')`` for layers that are too large to fit in memory.
+    * block_cache : int
+        Only used if *matrix_free* is True. Maximum number of bytes used to
+        keep blocks of the Jacobian in memory between products. Cached blocks
+        don't have to be recomputed on later iterations. Defaults to 0 (no
+        caching).
+    * fft : True or False
+        If True, calculate the products with the Jacobian with 2D FFTs. The
+        data must be on the same regular grid as the layer and at a constant
+        height (see :class:`~fatiando.gravmag.eqlayer.EQLBase`). Use this with
+        ``config('cg')``. Memory use is proportional to the number of data.
 
     """
 
-    def __init__(self, x, y, z, data, inc, dec, grid, sinc=None, sdec=None):
-        super().__init__(x, y, z, data, grid)
+    def __init__(self, x, y, z, data, inc, dec, grid, sinc=None, sdec=None,
+                 dtype='float64', matrix_free=False, block_cache=0,
+                 fft=False):
+        super().__init__(x, y, z, data, grid, dtype=dtype,
+                         matrix_free=matrix_free, block_cache=block_cache,
+                         fft=fft)
         self.inc, self.dec = inc, dec
         self.sinc = sinc if sinc is not None else inc
         self.sdec = sdec if sdec is not None else dec
 
-    def jacobian(self, p):
+    def _kernel(self, x, y, z):
+        return _tf_kernel(self.inc, self.dec, self.sinc, self.sdec, x, y, z)
+
+    def reduce_to_pole(self, p=None):
         """
-        Calculate the Jacobian matrix for a given parameter vector.
+        Reduce the data to the pole using the fitted layer.
+
+        Forward models the layer with both the inducing field and the
+        magnetization of the layer pointing vertically down (inclination of
+        90 degrees).
+
+        Parameters:
+
+        * p : 1d-array (optional)
+            The parameter vector of the layer. If not given, will use the value
+            calculated by ``.fit()``.
+
+        Returns:
+
+        * result : 1d-array
+            The data reduced to the pole.
+
         """
-        x = self.x
-        y = self.y
-        z = self.z
-        inc, dec = self.inc, self.dec
-        mag = dircos(self.sinc, self.sdec)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=float)
-        for i, c in enumerate(self.grid):
-            jac[:, i] = kernel.tf(x, y, z, [c], inc, dec, pmag=mag)
-        return jac
+        if p is None:
+            p = self.p_
+        layer = self._transformed(inc=90, dec=0, sinc=90, sdec=0)
+        return layer.predicted(p)
+
+
+class WindowedEQL(object):
+    """
+    Fit an equivalent layer using overlapping moving windows.
+
+    Splits the layer into windows (see
+    :meth:`~fatiando.mesher.PointGrid.split`) that overlap their neighbors by
+    *overlap* grid points. An independent equivalent layer (with
+    :class:`~fatiando.inversion.regularization.Damping` regularization) is
+    fitted to the data inside each window. Data in the overlap zones are
+    blended using weights that decrease linearly from the inner part of a
+    window (the points that belong to no other window) to its border.
+
+    The Jacobian of the whole layer is never calculated. Only the Jacobian of
+    one window at a time is kept in memory (per job).
+
+    Run the windows in parallel by specifying the ``njobs`` argument. The
+    fitting method of the windows is the one configured in *eql* (using
+    ``eql.config``).
+
+    Parameters:
+
+    * eql : :class:`~fatiando.gravmag.eqlayer.EQLGravity` or
+      :class:`~fatiando.gravmag.eqlayer.EQLTotalField`
+        The equivalent layer for the whole data set. Its layer must be a
+        :class:`~fatiando.mesher.PointGrid`.
+    * windows : tuple = (nx, ny)
+        The number of windows in the x and y directions, respectively.
+    * overlap : int
+        The number of grid points that each window extends into its neighbors.
+    * damping : float
+        The regularization parameter of the damping in each window.
+    * njobs : int
+        Number of processes used to fit and forward model the windows.
+
+    """
+
+    def __init__(self, eql, windows, overlap, damping, njobs=1):
+        assert njobs >= 1, "njobs should be >= 1. {} given.".format(njobs)
+        self.eql = eql
+        self.windows = windows
+        self.overlap = overlap
+        self.damping = damping
+        self.njobs = njobs
+        self.p_ = None
+        self.estimate_ = None
+        grid = eql.grid
+        x, y = numpy.ravel(eql.x), numpy.ravel(eql.y)
+        z = numpy.ravel(eql.z*numpy.ones_like(eql.x))
+        half = [0.5*grid.dx, 0.5*grid.dy]
+        self.misfits, self.indices, self.weights = [], [], []
+        self.cores, self.window_cores = [], []
+        for core, window in zip(grid.split(windows),
+                                grid.split(windows, overlap)):
+            inner, outer = [], []
+            for k in range(4):
+                sign = (-1)**(k + 1)
+                bound = core.area[k] + sign*half[k//2]
+                if numpy.isclose(core.area[k], grid.area[k]):
+                    # The data beyond the layer belong to the windows on
+                    # the border
+                    bound = sign*numpy.inf
+                inner.append(bound)
+                outer.append(max(window.area[k] + sign*half[k//2], bound,
+                                 key=lambda b: sign*b))
+            weights = (_taper(x, inner[:2], outer[:2]) *
+                       _taper(y, inner[2:], outer[2:]))
+            index = numpy.nonzero(weights > 0)[0]
+            misfit = eql._transformed(
+                x=x[index], y=y[index], z=z[index], data=eql.data[index],
+                grid=window, ndata=index.size, nparams=window.size,
+                weights=None)
+            if eql.weights is not None:
+                misfit.weights = scipy.sparse.csr_matrix(
+                    eql.weights)[index][:, index]
+            self.misfits.append(misfit)
+            self.indices.append(index)
+            self.weights.append(weights[index])
+            self.cores.append(_inside(grid, core.area, half))
+            self.window_cores.append(_inside(window, core.area, half))
+
+    def _map(self, function, jobs):
+        """
+        Call *function* on every one of the *jobs* (in parallel if njobs > 1).
+        """
+        if self.njobs > 1:
+            pool = multiprocessing.Pool(self.njobs)
+            results = pool.map(function, jobs)
+            pool.close()
+            pool.join()
+        else:
+            results = [function(job) for job in jobs]
+        return results
+
+    def fit(self):
+        """
+        Fit the equivalent layer of every window.
+
+        The estimated physical property of each window is stored in the list
+        ``p_``. The ``estimate_`` attribute has the physical property of the
+        whole layer (taken from the inner part of each window).
+
+        Returns:
+
+        * self
+
+        """
+        jobs = [(misfit, self.damping) for misfit in self.misfits]
+        self.p_ = self._map(_fit_window, jobs)
+        estimate = numpy.empty(self.eql.nparams)
+        for p, core, window_core in zip(self.p_, self.cores,
+                                        self.window_cores):
+            estimate[core] = p[window_core]
+        self.estimate_ = estimate
+        return self
+
+    def _blend(self, method, *args):
+        """
+        Blend the outputs of calling *method* on the layer of every window.
+        """
+        jobs = [(misfit, p, method, args)
+                for misfit, p in zip(self.misfits, self.p_)]
+        results = self._map(_call_window, jobs)
+        blended = numpy.zeros(self.eql.ndata)
+        total = numpy.zeros(self.eql.ndata)
+        for index, weights, result in zip(self.indices, self.weights,
+                                          results):
+            blended[index] += weights*result
+            total[index] += weights
+        return blended/total
+
+    def predicted(self):
+        """
+        Calculate the data predicted by the fitted windows.
+
+        Returns:
+
+        * result : 1d-array
+            The blended predicted data vector.
+
+        """
+        return self._blend('predicted')
+
+    def upcontinue(self, height):
+        """
+        Upward continue the data using the fitted windows.
+
+        See :meth:`~fatiando.gravmag.eqlayer.EQLBase.upcontinue`.
+
+        Parameters:
+
+        * height : float
+            How much higher to continue the data (positive upward).
+
+        Returns:
+
+        * result : 1d-array
+            The blended upward continued data.
+
+        """
+        return self._blend('upcontinue', height)
+
+    def reduce_to_pole(self):
+        """
+        Reduce the data to the pole using the fitted windows.
+
+        Only available if the layer is an
+        :class:`~fatiando.gravmag.eqlayer.EQLTotalField`. See
+        :meth:`~fatiando.gravmag.eqlayer.EQLTotalField.reduce_to_pole`.
+
+        Returns:
+
+        * result : 1d-array
+            The blended data reduced to the pole.
+
+        """
+        return self._blend('reduce_to_pole')
+
+
+def _taper(coord, inner, outer):
+    """
+    Weights that are 1 between the *inner* bounds and decrease linearly to 0
+    at the *outer* bounds.
+    """
+    weights = numpy.ones_like(coord)
+    weights[(coord < outer[0]) | (coord > outer[1])] = 0
+    for k in range(2):
+        if outer[k] != inner[k]:
+            weights = numpy.minimum(weights,
+                                    (coord - outer[k])/(inner[k] - outer[k]))
+    return numpy.clip(weights, 0, 1)
+
+
+def _inside(grid, area, half):
+    """
+    The indices of the points of *grid* that are inside *area*.
+    """
+    x1, x2, y1, y2 = area
+    inside = ((grid.x > x1 - half[0]) & (grid.x < x2 + half[0]) &
+              (grid.y > y1 - half[1]) & (grid.y < y2 + half[1]))
+    return numpy.nonzero(inside)[0]
+
+
+def _fit_window(job):
+    """
+    Fit the layer of a window and return the estimate. Needed for
+    multiprocessing.
+    """
+    misfit, damping = job
+    solver = misfit.copy() + damping*Damping(misfit.nparams)
+    if getattr(misfit, 'fit_method', None) is not None:
+        solver.config(misfit.fit_method, **misfit.fit_args)
+    return solver.fit().p_
+
+
+def _call_window(job):
+    """
+    Call a method of the layer of a window. Needed for multiprocessing.
+    """
+    misfit, p, method, args = job
+    return getattr(misfit.copy(), method)(*args, p=p)
+
+
+def _source_arrays(grid):
+    """
+    Get the coordinates and volumes of the point sources in the layer.
+
+    Reads the arrays straight from a
+    :class:`~fatiando.mesher.PointGrid` instead of creating a
+    :class:`~fatiando.mesher.Sphere` for each point. Other lists of spheres
+    are also accepted.
+
+    Returns:
+
+    * x, y, z, volume : 1d-arrays
+        The coordinates and volume of each source.
+
+    """
+    if isinstance(grid, PointGrid):
+        x, y = grid.x, grid.y
+        z = grid.z*numpy.ones(grid.size)
+        radius = grid.radius*numpy.ones(grid.size)
+    else:
+        x, y, z, radius = numpy.transpose(
+            [[s.x, s.y, s.z, s.radius] for s in grid])
+    volume = 4*numpy.pi*(radius**3)/3
+    return x, y, z, volume
+
+
+def _gravity_kernel(field, x, y, z):
+    """
+    The gravitational field of unit density and volume point sources.
+
+    Same as the functions in :mod:`fatiando.gravmag.sphere` but for 2d-arrays
+    of distances (source - data) between every data point and source.
+    """
+    r_sqr = x**2 + y**2 + z**2
+    r = numpy.sqrt(r_sqr)
+    if field == 'gz':
+        return G*SI2MGAL*z/(r*r*r)
+    func = getattr(kernel, '_v_' + field[1:])
+    return G*SI2EOTVOS*func(x, y, z, r_sqr, r*r*r*r*r)
+
+
+def _tf_kernel(inc, dec, sinc, sdec, x, y, z):
+    """
+    The total-field anomaly of unit magnetization and volume point sources.
+
+    Same as :func:`fatiando.gravmag.sphere.tf` but for 2d-arrays of distances
+    (source - data) between every data point and source.
+    """
+    fx, fy, fz = dircos(inc, dec)
+    mx, my, mz = dircos(sinc, sdec)
+    r_sqr = x**2 + y**2 + z**2
+    r = numpy.sqrt(r_sqr)
+    r_5 = r*r*r*r*r
+    dotprod = mx*x + my*y + mz*z
+    res = (3*dotprod*(fx*x + fy*y + fz*z) -
+           r_sqr*(fx*mx + fy*my + fz*mz))/r_5
+    return CM*T2NT*res
+
+
+class _KernelOperator(scipy.sparse.linalg.LinearOperator):
+    """
+    The Jacobian of an equivalent layer as a matrix-free linear operator.
+
+    Products are calculated by iterating over the blocks of data rows given by
+    the ``_kernel_blocks`` method of the layer. The first blocks are kept in
+    memory (with the ``dtype`` of the layer) until *block_cache* bytes are
+    used.
+    """
+
+    def __init__(self, layer, block_cache):
+        super().__init__(numpy.dtype(layer.dtype),
+                         (layer.ndata, len(layer.grid)))
+        self.layer = layer
+        self.block_cache = block_cache
+        self.cache = []
+        self.cached_rows = 0
+
+    def blocks(self):
+        """
+        Iterate over the (start, end, block) of the Jacobian matrix.
+        """
+        for item in self.cache:
+            yield item
+        nbytes = sum(block.nbytes for _, _, block in self.cache)
+        new_blocks = self.layer._kernel_blocks(self.layer.grid,
+                                               first=self.cached_rows)
+        # Only cache contiguous blocks so that iteration can resume from
+        # the end of the cache next time
+        caching = True
+        for start, end, block in new_blocks:
+            size = block.size*self.dtype.itemsize
+            caching = caching and nbytes + size <= self.block_cache
+            if caching:
+                block = block.astype(self.dtype)
+                nbytes += block.nbytes
+                self.cache.append((start, end, block))
+                self.cached_rows = end
+            yield start, end, block
+
+    def _matvec(self, vector):
+        vector = numpy.ravel(vector)
+        result = numpy.empty(self.shape[0])
+        for start, end, block in self.blocks():
+            result[start:end] = block.dot(vector)
+        return result
+
+    def _rmatvec(self, vector):
+        vector = numpy.ravel(vector)
+        result = numpy.zeros(self.shape[1])
+        for start, end, block in self.blocks():
+            result += block.T.dot(vector[start:end])
+        return result
+
+    def rmatvec_squared(self, vector):
+        """
+        Product of the transpose of the element-wise squared Jacobian with a
+        vector.
+        """
+        result = numpy.zeros(self.shape[1])
+        for start, end, block in self.blocks():
+            result += (block**2).T.dot(vector[start:end])
+        return result
+
+
+class _BTTBOperator(scipy.sparse.linalg.LinearOperator):
+    """
+    The Block-Toeplitz Toeplitz-Block Jacobian of a gridded equivalent layer.
+
+    The kernel of the layer only depends on the offsets between data points
+    and sources. It is calculated for all (2nx, 2ny) possible offsets and
+    stored as the 2D FFT of the circulant matrix that embeds the Jacobian.
+    Products are then circular convolutions of the zero padded vector.
+    """
+
+    def __init__(self, layer):
+        super().__init__(numpy.dtype(layer.dtype),
+                         (layer.ndata, layer.nparams))
+        grid = layer.grid
+        if not isinstance(grid, PointGrid):
+            raise ValueError("Need a PointGrid layer to use the FFT.")
+        x, y = numpy.ravel(layer.x), numpy.ravel(layer.y)
+        z = numpy.ravel(layer.z*numpy.ones_like(layer.x))
+        if x.size != grid.size:
+            raise ValueError(
+                "Data and layer must be on the same grid to use the FFT.")
+        shiftx, shifty = x - grid.x, y - grid.y
+        regular = (numpy.allclose(shiftx, shiftx[0]) and
+                   numpy.allclose(shifty, shifty[0]) and
+                   numpy.allclose(z, z[0]) and
+                   numpy.allclose(grid.z, grid.z[0]))
+        if not regular:
+            raise ValueError(
+                "Data and layer must be on the same grid to use the FFT.")
+        nx, ny = grid.shape
+        self.gridshape = (nx, ny)
+        self.padshape = (2*nx, 2*ny)
+        # The offset (in number of points) of the data with respect to the
+        # sources for each element of the circulant matrix
+        ix = numpy.arange(2*nx)
+        ix[nx:] -= 2*nx
+        iy = numpy.arange(2*ny)
+        iy[ny:] -= 2*ny
+        offx, offy = numpy.meshgrid(ix, iy, indexing='ij')
+        sx, sy, sz, volume = _source_arrays(grid)
+        kernel = volume[0]*layer._kernel(
+            -offx*grid.dx - shiftx[0],
+            -offy*grid.dy - shifty[0],
+            (sz[0] - z[0])*numpy.ones(self.padshape))
+        self.eigenvalues = numpy.fft.rfft2(kernel)
+        self.squared_eigenvalues = numpy.fft.rfft2(kernel**2)
+
+    def _convolve(self, vector, eigenvalues):
+        nx, ny = self.gridshape
+        vector = numpy.reshape(vector, self.gridshape)
+        result = numpy.fft.irfft2(
+            eigenvalues*numpy.fft.rfft2(vector, s=self.padshape),
+            s=self.padshape)
+        return result[:nx, :ny].ravel()
+
+    def _matvec(self, vector):
+        return self._convolve(vector, self.eigenvalues)
+
+    def _rmatvec(self, vector):
+        return self._convolve(vector, self.eigenvalues.conj())
+
+    def rmatvec_squared(self, vector):
+        """
+        Product of the transpose of the element-wise squared Jacobian with a
+        vector.
+        """
+        return self._convolve(vector, self.squared_eigenvalues.conj())
+
+
+class _GaussHessianOperator(scipy.sparse.linalg.LinearOperator):
+    """
+    The product J^T W J of a matrix-free Jacobian J and weight matrix W.
+
+    Without weights, each product with a vector takes a single pass over the
+    blocks of the Jacobian (if the Jacobian is calculated in blocks).
+    """
+
+    def __init__(self, jacobian, weights):
+        nparams = jacobian.shape[1]
+        super().__init__(jacobian.dtype, (nparams, nparams))
+        self.jacobian = jacobian
+        self.weights = weights
+
+    def _matvec(self, vector):
+        vector = numpy.ravel(vector)
+        if self.weights is not None:
+            tmp = safe_dot(self.weights, self.jacobian.matvec(vector))
+            return self.jacobian.rmatvec(numpy.ravel(tmp))
+        if not hasattr(self.jacobian, 'blocks'):
+            return self.jacobian.rmatvec(self.jacobian.matvec(vector))
+        result = numpy.zeros(self.shape[1])
+        for start, end, block in self.jacobian.blocks():
+            result += block.T.dot(block.dot(vector))
+        return result
+
+    def _rmatvec(self, vector):
+        return self._matvec(vector)
+
+    def diagonal(self):
+        """
+        The diagonal of J^T W J (None if it can't be calculated).
+
+        Used for Jacobi preconditioning. Needs a diagonal weight matrix.
+        """
+        if not hasattr(self.jacobian, 'rmatvec_squared'):
+            return None
+        if self.weights is None:
+            weights = numpy.ones(self.jacobian.shape[0])
+        else:
+            weights = safe_diagonal(self.weights)
+            offdiagonal = scipy.sparse.csr_matrix(
+                self.weights - scipy.sparse.diags(weights, 0))
+            if offdiagonal.count_nonzero() > 0:
+                return None
+        return self.jacobian.rmatvec_squared(weights)
 
 
 class PELBase(EQLBase):
     """
     Base class for the Polynomial Equivalent Layer.
 
+    The Jacobian is the product of the sensitivity matrix of the point
+    sources and a sparse matrix that converts the polynomial coefficients of
+    each window into physical property values (see ``_pel_bmatrix``). If
+    ``matrix_free`` is True, the Jacobian is a
+    :class:`scipy.sparse.linalg.LinearOperator` that applies the two on the
+    fly.
+
     .. note::
 
         Overloads *fit* to convert the estimated coefficients to physical
@@ -168,12 +842,30 @@ class PELBase(EQLBase):
 
     """
 
-    def __init__(self, x, y, z, data, grid, windows, degree):
-        super().__init__(x, y, z, data, grid)
+    def __init__(self, x, y, z, data, grid, windows, degree, dtype='float64',
+                 matrix_free=False, block_cache=0):
+        super().__init__(x, y, z, data, grid, dtype=dtype,
+                         matrix_free=matrix_free, block_cache=block_cache)
         self.nparams = windows[0]*windows[1]*ncoeffs(degree)
         self.windows = windows
         self.degree = degree
 
+    def jacobian(self, p):
+        """
+        Calculate the Jacobian matrix for a given parameter vector.
+
+        If the layer is ``matrix_free``, returns a
+        :class:`scipy.sparse.linalg.LinearOperator` instead.
+        """
+        bmatrix = _pel_bmatrix(self.grid, self.windows, self.degree)
+        if self.matrix_free:
+            sources = _KernelOperator(self, self.block_cache)
+            return sources*scipy.sparse.linalg.aslinearoperator(bmatrix)
+        jac = numpy.empty((self.ndata, self.nparams), dtype=self.dtype)
+        for start, end, block in self._kernel_blocks(self.grid):
+            jac[start:end] = safe_dot(bmatrix.T, block.T).T
+        return jac
+
     def fmt_estimate(self, coefs):
         """
         Convert the estimated polynomial coefficients to physical property
@@ -190,28 +882,48 @@ class PELBase(EQLBase):
             The converted physical property values along the layer.
 
         """
-        ny, nx = self.windows
-        pergrid = ncoeffs(self.degree)
-        estimate = numpy.empty(self.grid.shape, dtype=float)
-        grids = self.grid.split(self.windows)
-        k = 0
-        ystart = 0
-        gny, gnx = grids[0].shape
-        for i in range(ny):
-            yend = ystart + gny
-            xstart = 0
-            for j in range(nx):
-                xend = xstart + gnx
-                g = grids[k]
-                bk = _bkmatrix(g, self.degree)
-                window_coefs = coefs[k * pergrid:(k + 1) * pergrid]
-                window_props = safe_dot(bk, window_coefs).reshape(g.shape)
-                estimate[ystart:yend, xstart:xend] = window_props
-                xstart = xend
-                k += 1
-            ystart = yend
+        bmatrix = _pel_bmatrix(self.grid, self.windows, self.degree)
         self.coeffs_ = coefs
-        return estimate.ravel()
+        return safe_dot(bmatrix, coefs)
+
+
+def _pel_bmatrix(grid, windows, degree):
+    """
+    Make the sparse matrix that converts the coefficients of all windows into
+    physical property values on the grid points.
+
+    The matrix is block diagonal (up to the ordering of the grid points) with
+    the Bk matrix of each window (see ``_bkmatrix``). Windows are in the same
+    order as returned by :meth:`~fatiando.mesher.PointGrid.split`.
+
+    Parameters:
+
+    * grid : :class:`~fatiando.mesher.PointGrid`
+        The sources in the equivalent layer
+    * windows : tuple = (nx, ny)
+        The number of windows in the x and y directions
+    * degree : int
+        The degree of the bivariate polynomial
+
+    Returns:
+
+    * bmatrix : sparse CSR matrix
+        The matrix
+
+    """
+    nx, ny = grid.shape
+    if nx % windows[0] != 0 or ny % windows[1] != 0:
+        raise ValueError(
+            'Cannot split! nx and ny must be divisible by grid shape')
+    mx, my = nx//windows[0], ny//windows[1]
+    pergrid = ncoeffs(degree)
+    ix, iy = numpy.unravel_index(numpy.arange(grid.size), grid.shape)
+    window = (ix//mx)*windows[1] + iy//my
+    rows = numpy.repeat(numpy.arange(grid.size), pergrid)
+    cols = window[:, numpy.newaxis]*pergrid + numpy.arange(pergrid)
+    shape = (grid.size, windows[0]*windows[1]*pergrid)
+    return scipy.sparse.csr_matrix(
+        (_bkmatrix(grid, degree).ravel(), (rows, cols.ravel())), shape=shape)
 
 
 def _bkmatrix(grid, degree):
@@ -254,10 +966,13 @@ def _bkmatrix(grid, degree):
      [ 1.  2.  1.  4.  2.  1.  8.  4.  2.  1.]]
 
     """
-    bmatrix = numpy.transpose(
-        [(grid.x**i)*(grid.y**j)
-         for l in range(1, degree + 2)
-         for i, j in zip(range(l), range(l - 1, -1, -1))])
+    # The monomials are ordered by total degree d and then by the power i of
+    # x: x**i*y**(d - i)
+    total, xpower = numpy.tril_indices(degree + 1)
+    powers = numpy.arange(degree + 1)
+    x = grid.x[:, numpy.newaxis]**powers
+    y = grid.y[:, numpy.newaxis]**powers
+    bmatrix = x[:, xpower]*y[:, total - xpower]
     return bmatrix
 
 
@@ -314,31 +1029,27 @@ class PELGravity(PELBase):
         Which gravitational field is the data. Options are: ``'gz'`` (gravity
         anomaly), ``'gxx'``, ``'gxy'``, ..., ``'gzz'`` (gravity gradient
         tensor). Defaults to ``'gz'``.
+    * dtype : string or numpy dtype
+        The data type of the Jacobian matrix. Defaults to ``'float64'``.
+    * matrix_free : True or False
+        If True, will never store the sensitivity matrix of the sources or the
+        Jacobian. Products with the Jacobian apply the sensitivity and the
+        polynomials of the windows on the fly. Use this with ``config('cg')``.
+    * block_cache : int
+        Only used if *matrix_free* is True. Maximum number of bytes used to
+        keep blocks of the sensitivity matrix in memory between products.
+        Defaults to 0 (no caching).
 
     """
 
-    def __init__(self, x, y, z, data, grid, windows, degree, field='gz'):
-        super().__init__(x, y, z, data, grid, windows, degree)
+    def __init__(self, x, y, z, data, grid, windows, degree, field='gz',
+                 dtype='float64', matrix_free=False, block_cache=0):
+        super().__init__(x, y, z, data, grid, windows, degree, dtype=dtype,
+                         matrix_free=matrix_free, block_cache=block_cache)
         self.field = field
 
-    def jacobian(self, p):
-        """
-        Calculate the Jacobian matrix for a given parameter vector.
-        """
-        x = self.x
-        y = self.y
-        z = self.z
-        func = getattr(kernel, self.field)
-        grids = self.grid.split(self.windows)
-        pergrid = ncoeffs(self.degree)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=float)
-        gk = numpy.empty((self.ndata, grids[0].size), dtype=float)
-        for i, grid in enumerate(grids):
-            bk = _bkmatrix(grid, self.degree)
-            for k, c in enumerate(grid):
-                gk[:, k] = func(x, y, z, [c], dens=1.)
-            jac[:, i*pergrid:(i + 1)*pergrid] = safe_dot(gk, bk)
-        return jac
+    def _kernel(self, x, y, z):
+        return _gravity_kernel(self.field, x, y, z)
 
 
 class PELTotalField(PELBase):
@@ -368,35 +1079,30 @@ class PELTotalField(PELBase):
         there is remanent magnetization and the total magnetization of the
         layer if different from the induced magnetization.
         If there is only induced magnetization, use None
+    * dtype : string or numpy dtype
+        The data type of the Jacobian matrix. Defaults to ``'float64'``.
+    * matrix_free : True or False
+        If True, will never store the sensitivity matrix of the sources or the
+        Jacobian. Products with the Jacobian apply the sensitivity and the
+        polynomials of the windows on the fly. Use this with ``config('cg')``.
+    * block_cache : int
+        Only used if *matrix_free* is True. Maximum number of bytes used to
+        keep blocks of the sensitivity matrix in memory between products.
+        Defaults to 0 (no caching).
 
     """
 
     def __init__(self, x, y, z, data, inc, dec, grid, windows, degree,
-                 sinc=None, sdec=None):
-        super().__init__(x, y, z, data, grid, windows, degree)
+                 sinc=None, sdec=None, dtype='float64', matrix_free=False,
+                 block_cache=0):
+        super().__init__(x, y, z, data, grid, windows, degree, dtype=dtype,
+                         matrix_free=matrix_free, block_cache=block_cache)
         self.inc, self.dec = inc, dec
         self.sinc = sinc if sinc is not None else inc
         self.sdec = sdec if sdec is not None else dec
 
-    def jacobian(self, p):
-        """
-        Calculate the Jacobian matrix for a given parameter vector.
-        """
-        x = self.x
-        y = self.y
-        z = self.z
-        inc, dec = self.inc, self.dec
-        mag = dircos(self.sinc, self.sdec)
-        grids = self.grid.split(self.windows)
-        pergrid = ncoeffs(self.degree)
-        jac = numpy.empty((self.ndata, self.nparams), dtype=float)
-        gk = numpy.empty((self.ndata, grids[0].size), dtype=float)
-        for i, grid in enumerate(grids):
-            bk = _bkmatrix(grid, self.degree)
-            for k, c in enumerate(grid):
-                gk[:, k] = kernel.tf(x, y, z, [c], inc, dec, pmag=mag)
-            jac[:, i*pergrid:(i + 1)*pergrid] = safe_dot(gk, bk)
-        return jac
+    def _kernel(self, x, y, z):
+        return _tf_kernel(self.inc, self.dec, self.sinc, self.sdec, x, y, z)
 
 
 class PELSmoothness(Smoothness):
@@ -431,43 +1137,25 @@ class PELSmoothness(Smoothness):
 def _pel_fdmatrix(windows, grid, degree):
     """
     Makes the finite difference matrix for PEL smoothness.
+
+    The differences are between neighboring grid points that belong to
+    different windows. The matrix is sparse.
     """
-    ny, nx = windows
-    grids = grid.split(windows)
-    gsize = grids[0].size
-    gny, gnx = grids[0].shape
-    nderivs = (nx - 1) * grid.shape[0] + (ny - 1) * grid.shape[1]
-    rmatrix = scipy.sparse.lil_matrix((nderivs, grid.size))
-    deriv = 0
-    # derivatives in x
-    for k in range(0, len(grids) - ny):
-        bottom = k * gsize + gny * (gnx - 1)
-        top = (k + ny) * gsize
-        for i in range(gny):
-            rmatrix[deriv, bottom + i] = -1.
-            rmatrix[deriv, top + 1] = 1.
-            deriv += 1
-    # derivatives in y
-    for k in range(0, len(grids)):
-        if (k + 1) % ny == 0:
-            continue
-        right = k * gsize + gny - 1
-        left = (k + 1) * gsize
-        for i in range(gnx):
-            rmatrix[deriv, right + i * gny] = -1.
-            rmatrix[deriv, left + i * gny] = 1.
-            deriv += 1
-    rmatrix = rmatrix.tocsr()
+    mx, my = grid.shape[0]//windows[0], grid.shape[1]//windows[1]
+    index = numpy.arange(grid.size).reshape(grid.shape)
+    # Points on the border of each window and their neighbors in the next
+    # window along x and along y
+    first = numpy.hstack([index[mx - 1:-1:mx, :].ravel(),
+                          index[:, my - 1:-1:my].ravel()])
+    second = numpy.hstack([index[mx::mx, :].ravel(),
+                           index[:, my::my].ravel()])
+    nderivs = first.size
+    rows = numpy.repeat(numpy.arange(nderivs), 2)
+    cols = numpy.transpose([first, second]).ravel()
+    values = numpy.tile([-1., 1.], nderivs)
+    rmatrix = scipy.sparse.csr_matrix((values, (rows, cols)),
+                                      shape=(nderivs, grid.size))
     # Make the RB matrix because R is for the sources, B converts it to
     # coefficients.
-    pergrid = ncoeffs(degree)
-    ncoefs = len(grids) * pergrid
-    fdmatrix = numpy.empty((nderivs, ncoefs), dtype=float)
-    st = 0
-    for i, g in enumerate(grids):
-        bk = _bkmatrix(g, degree)
-        en = st + g.size
-        fdmatrix[:, i*pergrid:(i + 1)*pergrid] = safe_dot(rmatrix[:, st:en],
-                                                          bk)
-        st = en
-    return fdmatrix
+    fdmatrix = safe_dot(rmatrix, _pel_bmatrix(grid, windows, degree))
+    return fdmatrix.tocsr()
@@ -50,18 +50,18 @@ Prospecting, 59(6), 1052-1071, doi:10.1111/j.1365-2478.2011.01005.x
 ----
 """
 from __future__ import absolute_import, division
-from future.builtins import range
-from functools import reduce
+from future.builtins import range, zip
 import numpy
 
-from fatiando.mesher import PrismMesh
-from fatiando.gravmag import transform
+from fatiando.mesher import PrismMesh, Prism
+from fatiando.gravmag import transform, _fft
 from fatiando.gravmag import prism as pot_prism
 from fatiando.constants import G
 from fatiando import utils
 
 
-def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
+def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1,
+            shape=None, workers=1):
     """
     3D potential field migration (Zhdanov et al., 2011).
 
@@ -71,9 +71,21 @@ def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
     .. note:: Only works on **gravity** data for now.
 
     .. note:: The data **do not** need to be leveled or on a regular grid.
+        But if they are, pass the *shape* of the grid to use the much faster
+        FFT implementation.
 
     .. note:: The coordinate system adopted is x->North, y->East, and z->Down
 
+    For scattered data, the migrated density of each prism is the dot product
+    of the data with the gravitational effect of the prism, calculated
+    directly one layer at a time. If the data are leveled and on a regular
+    grid (like the ones generated by :func:`fatiando.gridder.regular`)
+    and *shape* is given, the horizontal cells of the mesh are centered on
+    the grid points. The product for each layer is then a 2D correlation of
+    the data with the effect of a single prism, calculated with FFTs on a
+    zero padded grid. The memory used is proportional to the number of data
+    instead of the number of data times the number of prisms in a layer.
+
     Parameters:
 
     * x, y : 1D-arrays
@@ -94,6 +106,14 @@ def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
     * scale : float
         A scale factor for the depth weights. Simply changes the scale of the
         physical property values.
+    * shape : None or tuple = (nx, ny)
+        The shape of the grid if the data are on a regular grid. Must match
+        the number of prisms in the x and y directions of *meshshape*. If
+        None, will assume the data are scattered.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`. Only
+        used if *shape* is given.
 
     Returns:
 
@@ -103,7 +123,13 @@ def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
 
     """
     nlayers, ny, nx = meshshape
-    mesh = _makemesh(x, y, (ny, nx), zmin, zmax, nlayers)
+    if shape is None:
+        mesh = _makemesh(x, y, (ny, nx), zmin, zmax, nlayers)
+    else:
+        assert tuple(shape) == (nx, ny), \
+            "Grid shape {} doesn't match the mesh shape {}".format(
+                shape, meshshape)
+        mesh = _makegridmesh(x, y, shape, zmin, zmax, nlayers)
     # This way, if z is not an array, it is now
     z = z * numpy.ones_like(x)
     dx, dy, dz = mesh.dims
@@ -111,16 +137,29 @@ def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
     # data z coordinate. No idea why
     depths = mesh.get_zs()[:-1] + 0.5 * dz
     weights = numpy.abs(depths) ** power / (2 * G * numpy.sqrt(numpy.pi))
-    density = []
-    for l in range(nlayers):
-        sensibility_T = numpy.array(
-            [pot_prism.gz(x, y, z, [p], dens=1) for p in mesh.get_layer(l)])
-        density.extend(scale * weights[l] * numpy.dot(sensibility_T, gz))
-    mesh.addprop('density', numpy.array(density))
+    density = numpy.empty(mesh.size)
+    # A view with one row per layer
+    layers = density.reshape((nlayers, ny * nx))
+    if shape is None:
+        for l in range(nlayers):
+            sensibility_T = numpy.array(
+                [pot_prism.gz(x, y, z, [p], dens=1)
+                 for p in mesh.get_layer(l)])
+            layers[l] = numpy.dot(sensibility_T, gz)
+    else:
+        zs = mesh.get_zs()
+        for i, layer in enumerate(_migrate_fft(x, y, z, gz, shape, zs,
+                                               workers)):
+            # The grid has x along the first axis but the mesh has x along
+            # the last one
+            layers[i] = layer.T.ravel()
+    layers *= scale * weights[:, numpy.newaxis]
+    mesh.addprop('density', density)
     return mesh
 
 
-def sandwich(x, y, z, data, shape, zmin, zmax, nlayers, power=0.5):
+def sandwich(x, y, z, data, shape, zmin, zmax, nlayers, power=0.5,
+             workers=1):
     """
     Sandwich model (Pedersen, 1991).
 
@@ -152,6 +191,9 @@ def sandwich(x, y, z, data, shape, zmin, zmax, nlayers, power=0.5):
     * power : float
         The power law used for the depth weighting. This controls what depth
         the bulk of the solution will be.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -163,32 +205,30 @@ def sandwich(x, y, z, data, shape, zmin, zmax, nlayers, power=0.5):
     mesh = _makemesh(x, y, shape, zmin, zmax, nlayers)
     # This way, if z is not an array, it is now
     z = z * numpy.ones_like(x)
-    freq, dataft = _getdataft(x, y, data, shape)
+    freq, dataft = _getdataft(x, y, data, shape, workers)
     dx, dy, dz = mesh.dims
     # Remove the last z because I only want depths to the top of the layers
     depths = mesh.get_zs()[:-1]
     weights = (numpy.abs(depths) + 0.5 * dz) ** (power)
-    density = []
+    # The filters of all layers are calculated at once in arrays with shape
+    # (nlayers, nfreqs_x, nfreqs_y)
+    depths = depths[:, numpy.newaxis, numpy.newaxis]
+    weights = weights[:, numpy.newaxis, numpy.newaxis]
+    # The 1e-10 is to avoid zero division when freq[i]==0
+    denominator = numpy.sum(weights * _layer_kernel(freq, depths, dz) ** 2,
+                            axis=0)
+    denominator += nlayers * 1e-10
+    denominator *= numpy.pi * G
     # Offset by the data z because in the paper the data is at z=0
-    for depth, weight in zip(depths - z[0], weights):
-        # The 1e-10 is to avoid zero division when freq[i]==0
-        density.extend(
-            numpy.real(numpy.fft.ifft2(
-                weight *
-                (numpy.exp(-freq * depth) - numpy.exp(-freq * (depth + dz))) *
-                freq * dataft /
-                (numpy.pi * G *
-                 reduce(numpy.add,
-                        [w * (numpy.exp(-freq * h) -
-                         numpy.exp(-freq * (h + dz))) ** 2 + 1e-10
-                         for h, w in zip(depths, weights)])
-                 )
-            ).ravel()))
-    mesh.addprop('density', numpy.array(density))
+    kernel = _layer_kernel(freq, depths - z[0], dz)
+    kernel *= weights
+    filters = kernel * (freq * dataft / denominator)
+    density = _fft.irfft2(filters, shape, workers)
+    mesh.addprop('density', density.ravel())
     return mesh
 
 
-def geninv(x, y, z, data, shape, zmin, zmax, nlayers):
+def geninv(x, y, z, data, shape, zmin, zmax, nlayers, workers=1):
     """
     Generalized Inverse imaging in the frequency domain (Cribb, 1976).
 
@@ -220,6 +260,9 @@ def geninv(x, y, z, data, shape, zmin, zmax, nlayers):
     * nlayers : int
         The number of layers used to divide the region where the physical
         property distribution is calculated
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -231,29 +274,39 @@ def geninv(x, y, z, data, shape, zmin, zmax, nlayers):
     mesh = _makemesh(x, y, shape, zmin, zmax, nlayers)
     # This way, if z is not an array, it is now
     z = z * numpy.ones_like(x)
-    freq, dataft = _getdataft(x, y, data, shape)
+    freq, dataft = _getdataft(x, y, data, shape, workers)
     dx, dy, dz = mesh.dims
     # Remove the last z because I only want depths to the top of the layers
     depths = mesh.get_zs()[:-1] + 0.5 * dz - z[0]  # Offset by the data height
-    density = []
-    for depth in depths:
-        density.extend(
-            numpy.real(
-                numpy.fft.ifft2(
-                    numpy.exp(-freq * depth) * freq * dataft / (numpy.pi * G)
-                ).ravel()
-            ))
-    mesh.addprop('density', numpy.array(density))
+    # The filters of all layers are calculated at once in an array with shape
+    # (nlayers, nfreqs_x, nfreqs_y)
+    kernel = numpy.exp(-freq * depths[:, numpy.newaxis, numpy.newaxis])
+    filters = kernel * (freq * dataft / (numpy.pi * G))
+    density = _fft.irfft2(filters, shape, workers)
+    mesh.addprop('density', density.ravel())
     return mesh
 
 
-def _getdataft(x, y, data, shape):
+def _layer_kernel(freq, depths, thickness):
+    """
+    The (unscaled) Fourier transform of the gravity of layers with tops at
+    *depths*. *depths* must broadcast against *freq*.
+    """
+    kernel = numpy.exp(-freq * depths)
+    kernel -= numpy.exp(-freq * (depths + thickness))
+    return kernel
+
+
+def _getdataft(x, y, data, shape, workers=1):
     """
     Get the Fourier transform of the data and the norm of the wavenumber vector
+
+    Only the non-negative wavenumbers of the second axis are returned (the
+    data are real so the rest of the spectrum is redundant).
     """
-    Fx, Fy = transform._fftfreqs(x, y, shape, shape)
+    Fx, Fy = transform._fftfreqs(x, y, shape, shape, real=True)
     freq = numpy.sqrt(Fx ** 2 + Fy ** 2)
-    dataft = (2. * numpy.pi) * numpy.fft.fft2(numpy.reshape(data, shape))
+    dataft = (2. * numpy.pi) * _fft.rfft2(numpy.reshape(data, shape), workers)
     return freq, dataft
 
 
@@ -265,3 +318,50 @@ def _makemesh(x, y, shape, zmin, zmax, nlayers):
     bounds = [x.min(), x.max(), y.min(), y.max(), zmin, zmax]
     mesh = PrismMesh(bounds, (nlayers, ny, nx))
     return mesh
+
+
+def _makegridmesh(x, y, shape, zmin, zmax, nlayers):
+    """
+    Make a prism mesh with the horizontal cells centered on the grid points.
+    """
+    nx, ny = shape
+    dx = (x.max() - x.min()) / (nx - 1)
+    dy = (y.max() - y.min()) / (ny - 1)
+    bounds = [x.min() - 0.5 * dx, x.max() + 0.5 * dx,
+              y.min() - 0.5 * dy, y.max() + 0.5 * dy, zmin, zmax]
+    mesh = PrismMesh(bounds, (nlayers, ny, nx))
+    return mesh
+
+
+def _migrate_fft(x, y, z, gz, shape, zs, workers=1):
+    """
+    Correlate the gridded data with the gz of a single prism of each layer.
+
+    The layers have their top and bottom in *zs*. Yields one array with the
+    shape of the grid for each layer.
+    """
+    assert numpy.allclose(z, z[0]), \
+        "The data must be leveled to use the FFT migration"
+    nx, ny = shape
+    dx = (x.max() - x.min()) / (nx - 1)
+    dy = (y.max() - y.min()) / (ny - 1)
+    # Pad with zeros so that the circular convolution doesn't wrap around
+    padshape = (transform._nextpow2(2 * nx - 1),
+                transform._nextpow2(2 * ny - 1))
+    padded = numpy.zeros(padshape)
+    padded[:nx, :ny] = numpy.reshape(gz, shape)
+    dataft = _fft.rfft2(padded, workers)
+    # The kernel at index (i, j) is the effect at a point (i, j) grid cells
+    # away, with negative lags wrapping around. It is evaluated at the
+    # negative lags so that the convolution becomes a correlation.
+    lagx = numpy.fft.fftfreq(padshape[0], 1 / padshape[0])
+    lagy = numpy.fft.fftfreq(padshape[1], 1 / padshape[1])
+    xp, yp = [i.ravel() for i in numpy.meshgrid(-dx * lagx, -dy * lagy,
+                                                indexing='ij')]
+    zp = z[0] * numpy.ones_like(xp)
+    for top, bottom in zip(zs[:-1], zs[1:]):
+        cell = Prism(-0.5 * dx, 0.5 * dx, -0.5 * dy, 0.5 * dy, top, bottom)
+        kernel = pot_prism.gz(xp, yp, zp, [cell], dens=1).reshape(padshape)
+        kernelft = _fft.rfft2(kernel, workers)
+        kernelft *= dataft
+        yield _fft.irfft2(kernelft, padshape, workers)[:nx, :ny]
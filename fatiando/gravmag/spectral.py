@@ -0,0 +1,283 @@
+r"""
+Spectral methods for estimating the depth of potential field sources.
+
+* :class:`~fatiando.gravmag.spectral.SpectralDepthMW`: Estimate the depth to
+  the top, centroid, and bottom of the sources from the radially averaged
+  power spectrum of the data in moving windows (Spector and Grant, 1970;
+  Tanaka et al., 1999).
+
+The power spectrum of the field of an ensemble of sources with top at depth
+:math:`z_t` decays as
+
+.. math::
+
+    \ln P(|k|) \approx A - 2|k|z_t
+
+at intermediate to high wavenumbers. At low wavenumbers, the depth to the
+centroid :math:`z_0` of the sources controls the spectrum (Tanaka et al.,
+1999):
+
+.. math::
+
+    \ln \frac{\sqrt{P(|k|)}}{|k|} \approx B - |k|z_0
+
+for magnetic data. The gravity spectrum has one less power of :math:`|k|`,
+so :math:`\ln \sqrt{P(|k|)}` is used instead. The depth to the bottom of the
+sources (for magnetic data, the Curie depth) is :math:`z_b = 2z_0 - z_t`. The
+wavenumbers :math:`|k|` are in radians per meter.
+
+**References**
+
+Spector, A., and F. S. Grant (1970), Statistical models for interpreting
+aeromagnetic data, Geophysics, 35(2), 293-302, doi:10.1190/1.1440092.
+
+Tanaka, A., Y. Okubo, and O. Matsubayashi (1999), Curie point depth based on
+spectrum analysis of the magnetic anomaly data in East and Southeast Asia,
+Tectonophysics, 306(3-4), 461-470, doi:10.1016/S0040-1951(99)00072-4.
+
+----
+
+"""
+from __future__ import division, absolute_import
+from future.builtins import range
+import itertools
+import multiprocessing
+
+import numpy
+from numpy.lib.stride_tricks import as_strided
+
+from . import transform, _fft
+
+
+class SpectralDepthMW(object):
+    """
+    Spectral depth estimates in moving windows over gridded data.
+
+    The data in each window are detrended (the mean is removed), multiplied
+    by a 2D Hanning taper, and Fourier transformed. The radially averaged
+    power spectrum of each window (see
+    :func:`~fatiando.gravmag.transform.radial_average_spectrum`) is fitted
+    by straight lines in the given wavenumber ranges to estimate the depth
+    to the top and centroid of the sources.
+
+    The windows are read from the grid as strided views (no copies of the
+    overlapping data). They are processed in batches of *chunk* windows:
+    each batch is tapered and transformed with a single call to the FFT and
+    the spectra of all windows are averaged and fitted at once. Use *njobs*
+    to process the batches in parallel.
+
+    .. note:: Requires gridded data.
+
+    Parameters:
+
+    * x, y : 1D-arrays
+        The x and y coordinates of the grid points
+    * data : 1D-array or 2D-array
+        The potential field at the grid points (can be a
+        :class:`numpy.memmap`)
+    * shape : tuple = (nx, ny)
+        The shape of the grid
+    * window : tuple = (nx, ny)
+        The number of grid points in each window in the x and y directions
+    * top_range : tuple = (kmin, kmax)
+        The range of wavenumbers (in radians per meter) used to estimate the
+        depth to the top.
+    * centroid_range : tuple = (kmin, kmax)
+        The range of wavenumbers (in radians per meter) used to estimate the
+        depth to the centroid.
+    * field : str
+        The kind of data: ``'magnetic'`` (e.g., total field anomaly) or
+        ``'gravity'``. Only changes the estimate of the centroid.
+    * step : None or tuple = (nx, ny)
+        The number of grid points between consecutive windows. If None, will
+        use half of the window (windows overlap by half).
+    * njobs : int
+        Number of processes used to calculate the spectra of the windows.
+    * workers : int
+        The number of threads used by each FFT. See
+        :func:`~fatiando.gravmag.transform.set_fft_backend`.
+    * chunk : int
+        The number of windows transformed together.
+
+    After calling :meth:`~fatiando.gravmag.spectral.SpectralDepthMW.fit`,
+    the estimates are in the attributes ``top_``, ``centroid_``, and
+    ``bottom_`` (1D-arrays with one value per window). The windows are
+    ordered like a grid with shape ``windows_shape_`` and their centers are
+    in ``x_`` and ``y_``. The radially averaged power spectra are in
+    ``spectra_`` (one row per window) and their wavenumbers in ``k_``.
+    Windows that can't be fitted (e.g., with constant data, which have a null
+    spectrum) get NaN estimates.
+
+    Examples:
+
+    Point masses with random densities at 1000 m depth:
+
+    >>> import numpy as np
+    >>> from fatiando import gridder
+    >>> from fatiando.gravmag import sphere
+    >>> from fatiando.mesher import Sphere
+    >>> shape = (128, 128)
+    >>> x, y, z = gridder.regular((0, 64000, 0, 64000), shape, z=0)
+    >>> random = np.random.RandomState(0)
+    >>> model = [Sphere(xc, yc, 1000, 100, {'density': d})
+    ...          for xc, yc, d in zip(random.uniform(0, 64000, 2000),
+    ...                               random.uniform(0, 64000, 2000),
+    ...                               random.normal(0, 1000, 2000))]
+    >>> gz = sphere.gz(x, y, z, model)
+    >>> spec = SpectralDepthMW(x, y, gz, shape, window=(64, 64),
+    ...                        top_range=(1e-3, 4e-3),
+    ...                        centroid_range=(2e-4, 6e-4),
+    ...                        field='gravity').fit()
+    >>> spec.windows_shape_
+    (3, 3)
+    >>> print(', '.join('{:.0f}'.format(i) for i in spec.x_[::3]))
+    15874, 32000, 48126
+    >>> print(np.all(np.abs(spec.top_ - 1000) < 100))
+    True
+
+    """
+
+    def __init__(self, x, y, data, shape, window, top_range, centroid_range,
+                 field='magnetic', step=None, njobs=1, workers=1, chunk=256):
+        assert njobs >= 1, "njobs should be >= 1. {} given.".format(njobs)
+        assert field in ['magnetic', 'gravity'], \
+            "Invalid field '{}'".format(field)
+        assert window[0] <= shape[0] and window[1] <= shape[1], \
+            "Window {} larger than the grid {}".format(window, shape)
+        self.x = x
+        self.y = y
+        self.data = data
+        self.shape = tuple(shape)
+        self.window = tuple(window)
+        self.top_range = top_range
+        self.centroid_range = centroid_range
+        self.field = field
+        if step is None:
+            step = (max(window[0]//2, 1), max(window[1]//2, 1))
+        self.step = tuple(step)
+        self.njobs = njobs
+        self.workers = workers
+        self.chunk = chunk
+
+    def _windows(self):
+        """
+        A strided view of the data with shape (nwx, nwy, window_x, window_y).
+        """
+        grid = numpy.asarray(self.data).reshape(self.shape)
+        nwx = (self.shape[0] - self.window[0])//self.step[0] + 1
+        nwy = (self.shape[1] - self.window[1])//self.step[1] + 1
+        s0, s1 = grid.strides
+        return as_strided(grid, shape=(nwx, nwy) + self.window,
+                          strides=(s0*self.step[0], s1*self.step[1], s0, s1))
+
+    def _map(self, function, jobs):
+        """
+        Call *function* on every one of the *jobs* (in parallel if njobs > 1).
+
+        *jobs* can be a generator. It's consumed *njobs* items at a time so
+        that only the jobs being processed are in memory.
+        """
+        if self.njobs > 1:
+            pool = multiprocessing.Pool(self.njobs)
+            results = []
+            jobs = iter(jobs)
+            group = list(itertools.islice(jobs, self.njobs))
+            while group:
+                results.extend(pool.map(function, group))
+                group = list(itertools.islice(jobs, self.njobs))
+            pool.close()
+            pool.join()
+        else:
+            results = [function(job) for job in jobs]
+        return results
+
+    def fit(self):
+        """
+        Calculate the spectra of all windows and estimate the depths.
+
+        Returns:
+
+        * self
+
+        """
+        windows = self._windows()
+        self.windows_shape_ = windows.shape[:2]
+        nwindows = self.windows_shape_[0]*self.windows_shape_[1]
+        # Coordinates of the grid points of the first window and the window
+        # centers
+        x = numpy.reshape(self.x, self.shape)
+        y = numpy.reshape(self.y, self.shape)
+        wx, wy = self.window
+        sx = numpy.arange(self.windows_shape_[0])*self.step[0]
+        sy = numpy.arange(self.windows_shape_[1])*self.step[1]
+        centers_x = 0.5*(x[sx, 0] + x[sx + wx - 1, 0])
+        centers_y = 0.5*(y[0, sy] + y[0, sy + wy - 1])
+        self.x_, self.y_ = [c.ravel() for c in
+                            numpy.meshgrid(centers_x, centers_y,
+                                           indexing='ij')]
+        kx, ky = transform._fftfreqs(x[:wx, :wy], y[:wx, :wy], self.window,
+                                     self.window)
+        taper = numpy.outer(numpy.hanning(wx), numpy.hanning(wy))
+        # The windows of a batch are only copied out of the strided view when
+        # the batch is about to be processed
+        index = numpy.unravel_index(numpy.arange(nwindows),
+                                    self.windows_shape_)
+        jobs = ((windows[index[0][i:i + self.chunk],
+                         index[1][i:i + self.chunk]],
+                 taper, kx, ky, self.workers)
+                for i in range(0, nwindows, self.chunk))
+        results = self._map(_radial_spectra, jobs)
+        self.k_ = results[0][0]
+        self.spectra_ = numpy.concatenate([r[1] for r in results])
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            top = _slopes(self.k_, numpy.log(self.spectra_), self.top_range)
+            amplitude = numpy.sqrt(self.spectra_)
+            if self.field == 'magnetic':
+                amplitude /= self.k_
+            centroid = _slopes(self.k_, numpy.log(amplitude),
+                               self.centroid_range)
+        self.top_ = -0.5*top
+        self.centroid_ = -centroid
+        self.bottom_ = 2*self.centroid_ - self.top_
+        return self
+
+
+def _radial_spectra(job):
+    """
+    Radially averaged power spectra of a batch of windows. Needed for
+    multiprocessing.
+    """
+    windows, taper, kx, ky, workers = job
+    # The batch is already a copy of the grid but might not be float (e.g.,
+    # integer grids), so it's only safe to work in place after this
+    windows = numpy.asarray(windows, dtype=numpy.float64)
+    windows -= windows.mean(axis=(1, 2))[:, numpy.newaxis, numpy.newaxis]
+    windows *= taper
+    pds = numpy.abs(_fft.fft2(windows, workers))**2
+    return transform.radial_average_spectrum(kx, ky, pds)
+
+
+def _slopes(k, values, krange):
+    """
+    Least-squares slopes of straight lines fitted to each row of *values*
+    (as a function of *k*) inside the range of wavenumbers *krange*.
+
+    Non-finite values (e.g., the log of the spectrum of a flat window) are
+    left out of the fit of their row only. Rows with less than 2 finite
+    values in the range get a NaN slope.
+    """
+    kmin, kmax = krange
+    inrange = (k >= kmin) & (k <= kmax) & (k > 0)
+    assert inrange.sum() >= 2, \
+        "Less than 2 wavenumbers in the range {}".format(krange)
+    values = values[:, inrange]
+    use = numpy.isfinite(values)
+    count = use.sum(axis=1)
+    k = numpy.where(use, k[inrange], 0)
+    values = numpy.where(use, values, 0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        k = numpy.where(use, k - (k.sum(axis=1)/count)[:, numpy.newaxis], 0)
+        values = values - (values.sum(axis=1)/count)[:, numpy.newaxis]
+        slopes = numpy.sum(k*values, axis=1)/numpy.sum(k**2, axis=1)
+    slopes[count < 2] = numpy.nan
+    return slopes
@@ -1,9 +1,10 @@
 from __future__ import division, absolute_import
 import pytest
 import numpy as np
+import scipy.sparse
 from numpy.testing import assert_allclose, assert_array_almost_equal
 from ..eqlayer import EQLGravity, EQLTotalField, PELGravity, PELTotalField, \
-    PELSmoothness
+    PELSmoothness, WindowedEQL, _bkmatrix, _pel_fdmatrix
 from ...inversion import Damping
 from .. import sphere, prism
 from ...mesher import PointGrid, Prism
@@ -145,3 +146,214 @@ def test_eqlayer_polereduce():
     calc = sphere.tf(x, y, z, layer, inc=-90, dec=0)
 
     assert_allclose(calc, true, atol=10, rtol=0.05)
+
+
+def test_eql_grav_jacobian_layer():
+    "EQLGravity Jacobian of a PointGrid matches the sphere forward models"
+    area = [-1000, 1000, -1000, 1000]
+    layer = PointGrid(area, 300, (6, 7))
+    x, y, z = gridder.scatter(area, 200, z=-100, seed=42)
+    for field in 'gz gxx gxy gxz gyy gyz gzz'.split():
+        func = getattr(sphere, field)
+        true = np.transpose([func(x, y, z, [layer[i]], dens=1.)
+                             for i in range(layer.size)])
+        eql = EQLGravity(x, y, z, true[:, 0], layer, field=field)
+        assert_allclose(eql.jacobian(None), true, rtol=1e-10)
+
+
+def test_eql_mag_jacobian_layer_float32():
+    "EQLTotalField builds a float32 Jacobian of a PointGrid"
+    inc, dec = -30, 20
+    sinc, sdec = 10, -5
+    area = [-1000, 1000, -1000, 1000]
+    layer = PointGrid(area, 300, (6, 7))
+    x, y, z = gridder.scatter(area, 200, z=-100, seed=42)
+    mag = utils.dircos(sinc, sdec)
+    true = np.transpose([sphere.tf(x, y, z, [layer[i]], inc, dec, pmag=mag)
+                         for i in range(layer.size)])
+    eql = EQLTotalField(x, y, z, true[:, 0], inc, dec, layer, sinc, sdec,
+                        dtype='float32')
+    A = eql.jacobian(None)
+    assert A.dtype == np.float32
+    assert_allclose(A, true, rtol=1e-5)
+
+
+def test_eqlgrav_matrix_free_operators():
+    "EQLGravity matrix-free operators match the dense Jacobian and Hessian"
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 300, z=-100, seed=42)
+    data = np.random.RandomState(0).normal(size=x.size)
+    layer = PointGrid(area, 200, (15, 15))
+    p = np.random.RandomState(1).normal(size=layer.size)
+    dense = EQLGravity(x, y, z, data, layer)
+    jacobian = dense.jacobian(None)
+    hessian = dense.hessian(None)
+    for cache in [0, 10**8]:
+        eql = EQLGravity(x, y, z, data, layer, matrix_free=True,
+                         block_cache=cache)
+        # Twice so that the cached blocks are used
+        for i in range(2):
+            assert_allclose(eql.jacobian(p).matvec(p), jacobian.dot(p))
+            assert_allclose(eql.jacobian(p).rmatvec(data),
+                            jacobian.T.dot(data))
+            assert_allclose(eql.hessian(p).matvec(p), hessian.dot(p))
+        assert_allclose(eql.predicted(p), dense.predicted(p))
+        assert_allclose(eql.gradient(p), dense.gradient(p))
+        assert_allclose(eql.gradient(None), dense.gradient(None))
+
+
+def test_eqlgrav_matrix_free_cg():
+    "EQLGravity matrix-free with CG fits the data like the dense solver"
+    model = [Prism(-300, 300, -500, 500, 100, 600, {'density': 400})]
+    shape = (20, 20)
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 400, z=-100, seed=42)
+    data = prism.gz(x, y, z, model)
+    layer = PointGrid(area, 200, shape)
+    dense = EQLGravity(x, y, z, data, layer) + 1e-23*Damping(layer.size)
+    dense.fit()
+    for cache in [0, 10**8]:
+        eql = (EQLGravity(x, y, z, data, layer, matrix_free=True,
+                          block_cache=cache) +
+               1e-23*Damping(layer.size))
+        eql.config('cg', tol=1e-8, maxit=5000).fit()
+        assert_allclose(eql[0].predicted(), data, rtol=0.01)
+        assert_allclose(eql[0].predicted(), dense[0].predicted(), rtol=0.01)
+
+
+def test_eqlgrav_matrix_free_default_fit():
+    "EQLGravity matrix-free plus regularization fits with the default config"
+    model = [Prism(-300, 300, -500, 500, 100, 600, {'density': 400})]
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 400, z=-100, seed=42)
+    data = prism.gz(x, y, z, model)
+    layer = PointGrid(area, 200, (20, 20))
+    eql = EQLGravity(x, y, z, data, layer, matrix_free=True)
+    assert eql.fit_method == 'cg'
+    solver = (eql + 1e-23*Damping(layer.size)).fit()
+    assert solver.stats_['method'] == 'Conjugate Gradient'
+    assert_allclose(solver[0].predicted(), data, rtol=0.05)
+
+
+def test_eql_fft_jacobian():
+    "EQL Jacobian with the FFT matches the dense Jacobian on a shifted grid"
+    area = [-1000, 1000, -2000, 2000]
+    shape = (7, 9)
+    layer = PointGrid(area, 300, shape)
+    x, y, z = gridder.regular(area, shape, z=-100)
+    x, y = x + 13, y - 7
+    v = np.random.RandomState(0).normal(size=layer.size)
+    for eql in [EQLGravity(x, y, z, x, layer, field='gxz', fft=True),
+                EQLTotalField(x, y, z, x, -30, 20, layer, 10, -5, fft=True)]:
+        A = eql.jacobian(None)
+        dense = eql._kernel_matrix(layer)
+        assert_allclose(A.matvec(v), dense.dot(v), rtol=1e-10)
+        assert_allclose(A.rmatvec(v), dense.T.dot(v), rtol=1e-10)
+
+
+def test_eql_fft_not_gridded():
+    "EQL with the FFT fails if the data are not on the layer grid"
+    area = [-1000, 1000, -1000, 1000]
+    layer = PointGrid(area, 300, (6, 7))
+    x, y, z = gridder.scatter(area, layer.size, z=-100, seed=42)
+    eql = EQLGravity(x, y, z, x, layer, fft=True)
+    with pytest.raises(ValueError):
+        eql.jacobian(None)
+
+
+def test_eqlayer_fft_upcontinue_polereduce():
+    "EQLTotalField with the FFT upward continues and reduces to the pole"
+    model = [Prism(-100, 100, -500, 500, 0, 100,
+                   {'magnetization': utils.ang2vec(5, -60, -15)})]
+    inc, dec = -60, -15
+    shape = (30, 30)
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.regular(area, shape, z=-100)
+    data = prism.tf(x, y, z, model, inc, dec)
+    layer = PointGrid(area, 200, shape)
+    dense = EQLTotalField(x, y, z, data, inc, dec, layer) + \
+        1e-24*Damping(layer.size)
+    dense.fit()
+    eql = EQLTotalField(x, y, z, data, inc, dec, layer, fft=True) + \
+        1e-24*Damping(layer.size)
+    eql.config('cg', tol=1e-10, maxit=2000).fit()
+    assert_allclose(eql[0].predicted(), data, atol=0.5)
+    assert_allclose(eql[0].upcontinue(500), dense[0].upcontinue(500),
+                    atol=0.5)
+    assert_allclose(eql[0].reduce_to_pole(), dense[0].reduce_to_pole(),
+                    atol=1)
+    true = prism.tf(x, y, z - 500, model, inc, dec)
+    assert_allclose(eql[0].upcontinue(500), true, atol=1)
+
+
+def test_windowed_eql():
+    "WindowedEQL fits and upward continues data in parallel windows"
+    model = [Prism(-300, 300, -500, 500, 100, 600, {'density': 400})]
+    area = [-2000, 2000, -2000, 2000]
+    x, y, z = gridder.scatter(area, 1200, z=-100, seed=42)
+    data = prism.gz(x, y, z, model)
+    layer = PointGrid(area, 200, (30, 30))
+    serial = WindowedEQL(EQLGravity(x, y, z, data, layer), (3, 3), 4, 1e-23)
+    serial.fit()
+    assert serial.estimate_.shape == (layer.size,)
+    assert_allclose(serial.predicted(), data, atol=0.05)
+    true = prism.gz(x, y, z - 300, model)
+    assert_allclose(serial.upcontinue(300), true, atol=0.1)
+    parallel = WindowedEQL(EQLGravity(x, y, z, data, layer), (3, 3), 4,
+                           1e-23, njobs=2).fit()
+    assert_allclose(parallel.estimate_, serial.estimate_)
+    assert_allclose(parallel.predicted(), serial.predicted())
+
+
+def test_pel_jacobian_matrix_free():
+    "PEL Jacobian matches the sphere forward models times the polynomials"
+    area = [-1000, 1000, -2000, 2000]
+    layer = PointGrid(area, 300, (6, 8))
+    x, y, z = gridder.scatter(area, 100, z=-100, seed=1)
+    windows, degree = (3, 2), 2
+    true = np.hstack([
+        np.transpose([sphere.gz(x, y, z, [g[i]], dens=1.)
+                      for i in range(g.size)]).dot(_bkmatrix(g, degree))
+        for g in layer.split(windows)])
+    pel = PELGravity(x, y, z, x, layer, windows, degree)
+    assert_allclose(pel.jacobian(None), true, rtol=1e-10)
+    pel = PELGravity(x, y, z, x, layer, windows, degree, matrix_free=True)
+    A = pel.jacobian(None)
+    v = np.random.RandomState(0).normal(size=pel.nparams)
+    r = np.random.RandomState(1).normal(size=pel.ndata)
+    assert_allclose(A.matvec(v), true.dot(v), rtol=1e-10)
+    assert_allclose(A.rmatvec(r), true.T.dot(r), rtol=1e-10)
+
+
+def test_pel_fdmatrix_sparse():
+    "PEL smoothness matrix is sparse and differences points across windows"
+    area = [-1000, 1000, -2000, 2000]
+    layer = PointGrid(area, 300, (6, 8))
+    windows = (3, 2)
+    fdmatrix = _pel_fdmatrix(windows, layer, 0)
+    assert scipy.sparse.issparse(fdmatrix)
+    # 2 borders between windows along x with 8 points each and 1 border
+    # along y with 6 points
+    assert fdmatrix.shape == (2*8 + 6, 6)
+    # Constant properties have no differences
+    assert_allclose(fdmatrix.dot(np.ones(6)), 0)
+
+
+def test_eql_matrix_free_hessian_diagonal():
+    "EQL matrix-free Hessian diagonal (for preconditioning) matches dense"
+    area = [-1000, 1000, -1000, 1000]
+    layer = PointGrid(area, 300, (6, 7))
+    x, y, z = gridder.scatter(area, 200, z=-100, seed=42)
+    weights = np.random.RandomState(0).uniform(0.5, 2, x.size)
+    dense = EQLGravity(x, y, z, x, layer).set_weights(weights)
+    eql = EQLGravity(x, y, z, x, layer, matrix_free=True)
+    eql.set_weights(weights)
+    true = np.diag(dense.hessian(None))
+    assert_allclose(utils.safe_diagonal(eql.hessian(None)), true,
+                    rtol=1e-10)
+    x, y, z = gridder.regular(area, layer.shape, z=-100)
+    dense = EQLGravity(x, y, z, x, layer)
+    eql = EQLGravity(x, y, z, x, layer, fft=True)
+    true = np.diag(dense.hessian(None))
+    assert_allclose(utils.safe_diagonal(eql.hessian(None)), true,
+                    rtol=1e-10)
@@ -0,0 +1,75 @@
+from __future__ import division, absolute_import
+import numpy as np
+import numpy.testing as npt
+
+from .. import imaging, prism
+from ... import gridder
+from ...constants import G
+from ...mesher import Prism
+
+
+def test_migrate_fft_matches_direct():
+    "gravmag.imaging.migrate on a grid matches the direct sum over prisms"
+    shape = (20, 24)
+    x, y, z = gridder.regular((0, 1000, 0, 1200), shape, z=-10)
+    model = [Prism(300, 500, 400, 700, 100, 400, {'density': 500})]
+    gz = prism.gz(x, y, z, model)
+    mesh = imaging.migrate(x, y, z, gz, 0, 800, (5, 24, 20), shape=shape)
+    depths = mesh.get_zs()[:-1] + 0.5*mesh.dims[2]
+    weights = np.abs(depths)**0.5/(2*G*np.sqrt(np.pi))
+    true = np.concatenate([
+        weights[i]*np.dot([prism.gz(x, y, z, [p], dens=1)
+                           for p in mesh.get_layer(i)], gz)
+        for i in range(5)])
+    npt.assert_allclose(mesh.props['density'], true, rtol=1e-10,
+                        atol=1e-10*np.abs(true).max())
+    # The cells are centered on the grid points
+    npt.assert_allclose(mesh.get_xs()[:-1] + 0.5*mesh.dims[0],
+                        np.unique(x))
+
+
+def _per_layer(x, y, z, gz, shape, mesh, power=None):
+    "Reference geninv/sandwich with one complex FFT per layer"
+    kx, ky = np.meshgrid(2*np.pi*np.fft.fftfreq(shape[1], y[1] - y[0]),
+                         2*np.pi*np.fft.fftfreq(shape[0], x[shape[1]] - x[0]))
+    freq = np.sqrt(kx**2 + ky**2)
+    dataft = 2*np.pi*np.fft.fft2(np.reshape(gz, shape))
+    dz = mesh.dims[2]
+    tops = mesh.get_zs()[:-1]
+    layers = []
+    for i, top in enumerate(tops):
+        if power is None:
+            kernel = np.exp(-freq*(top + 0.5*dz - z[0]))
+            denominator = np.pi*G
+        else:
+            weights = (np.abs(tops) + 0.5*dz)**power
+            kernel = weights[i]*(np.exp(-freq*(top - z[0])) -
+                                 np.exp(-freq*(top - z[0] + dz)))
+            denominator = np.pi*G*sum(
+                w*(np.exp(-freq*h) - np.exp(-freq*(h + dz)))**2 + 1e-10
+                for h, w in zip(tops, weights))
+        layers.append(np.real(np.fft.ifft2(kernel*freq*dataft/denominator)))
+    return np.array(layers)
+
+
+def test_geninv_sandwich_match_per_layer():
+    "gravmag.imaging geninv and sandwich match the per-layer formulas"
+    shape = (20, 24)
+    x, y, z = gridder.regular((0, 1000, 0, 1200), shape, z=-10)
+    model = [Prism(300, 500, 400, 700, 100, 400, {'density': 500}),
+             Prism(600, 800, 200, 500, 50, 150, {'density': -300})]
+    gz = prism.gz(x, y, z, model)
+    nlayers = 6
+    mesh = imaging.geninv(x, y, z, gz, shape, 0, 600, nlayers)
+    true = _per_layer(x, y, z, gz, shape, mesh)
+    density = mesh.props['density']
+    assert density.shape == (mesh.size,)
+    npt.assert_allclose(density.reshape(true.shape), true, rtol=1e-10,
+                        atol=1e-10*np.abs(true).max())
+    # The layers are not interchangeable, so a wrong ordering would fail
+    assert not np.allclose(true[0], true[-1])
+    mesh = imaging.sandwich(x, y, z, gz, shape, 0, 600, nlayers, power=0.5)
+    true = _per_layer(x, y, z, gz, shape, mesh, power=0.5)
+    npt.assert_allclose(mesh.props['density'].reshape(true.shape), true,
+                        rtol=1e-10, atol=1e-10*np.abs(true).max())
+    assert not np.allclose(true[0], true[-1])
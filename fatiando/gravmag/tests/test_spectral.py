@@ -0,0 +1,114 @@
+from __future__ import division, absolute_import
+import numpy as np
+import numpy.testing as npt
+
+from .. import transform, sphere
+from ..spectral import SpectralDepthMW
+from ... import gridder
+from ...mesher import Sphere
+
+
+def _point_masses(shape, depth, nsources=2000, seed=0):
+    "Gravity of point masses with random densities at a fixed depth"
+    area = (0, 64000, 0, 64000)
+    x, y, z = gridder.regular(area, shape, z=0)
+    random = np.random.RandomState(seed)
+    model = [Sphere(xc, yc, depth, 100, {'density': d})
+             for xc, yc, d in zip(random.uniform(0, 64000, nsources),
+                                  random.uniform(0, 64000, nsources),
+                                  random.normal(0, 1000, nsources))]
+    return x, y, sphere.gz(x, y, z, model)
+
+
+def test_spectral_depth_top():
+    "gravmag.spectral recovers the depth of random point masses"
+    shape = (128, 128)
+    for depth in [1000, 1500]:
+        x, y, gz = _point_masses(shape, depth)
+        spec = SpectralDepthMW(x, y, gz, shape, window=(64, 64),
+                               top_range=(1/depth, 4/depth),
+                               centroid_range=(2e-4, 6e-4),
+                               field='gravity').fit()
+        assert spec.top_.size == 9
+        # The estimates of each window are noisy
+        npt.assert_allclose(spec.top_, depth, rtol=0.2)
+        npt.assert_allclose(spec.top_.mean(), depth, rtol=0.1)
+        npt.assert_allclose(spec.bottom_, 2*spec.centroid_ - spec.top_)
+
+
+def test_spectral_depth_matches_single_window():
+    "gravmag.spectral batched spectra match power_density_spectra per window"
+    shape = (60, 80)
+    x, y, gz = _point_masses(shape, 1000, nsources=200)
+    window, step = (32, 40), (7, 13)
+    spec = SpectralDepthMW(x, y, gz, shape, window=window, step=step,
+                           top_range=(1e-3, 3e-3),
+                           centroid_range=(2e-4, 6e-4), chunk=5).fit()
+    x, y, gz = [a.reshape(shape) for a in [x, y, gz]]
+    taper = np.outer(np.hanning(window[0]), np.hanning(window[1]))
+    count = 0
+    for i in range(0, shape[0] - window[0] + 1, step[0]):
+        for j in range(0, shape[1] - window[1] + 1, step[1]):
+            cut = (slice(i, i + window[0]), slice(j, j + window[1]))
+            data = (gz[cut] - gz[cut].mean())*taper
+            kx, ky, pds = transform.power_density_spectra(
+                x[cut].ravel(), y[cut].ravel(), data.ravel(), window)
+            k, radial = transform.radial_average_spectrum(kx, ky, pds)
+            npt.assert_allclose(spec.k_, k)
+            npt.assert_allclose(spec.spectra_[count], radial)
+            npt.assert_allclose(spec.x_[count], x[cut].mean())
+            npt.assert_allclose(spec.y_[count], y[cut].mean())
+            count += 1
+    assert count == spec.top_.size
+    assert spec.windows_shape_ == (5, 4)
+
+
+def test_spectral_depth_njobs():
+    "gravmag.spectral gives the same results in parallel"
+    shape = (64, 64)
+    x, y, gz = _point_masses(shape, 1000, nsources=200)
+    args = dict(window=(32, 32), top_range=(1e-3, 3e-3),
+                centroid_range=(2e-4, 6e-4))
+    serial = SpectralDepthMW(x, y, gz, shape, **args).fit()
+    parallel = SpectralDepthMW(x, y, gz, shape, njobs=2, chunk=3,
+                               **args).fit()
+    npt.assert_allclose(parallel.spectra_, serial.spectra_)
+    npt.assert_allclose(parallel.top_, serial.top_)
+    npt.assert_allclose(parallel.centroid_, serial.centroid_)
+
+
+def test_spectral_depth_flat_window():
+    "gravmag.spectral gives NaN only for windows with constant data"
+    shape = (128, 128)
+    x, y, gz = _point_masses(shape, 1000)
+    gz = gz.reshape(shape)
+    gz[:64, :64] = 1
+    spec = SpectralDepthMW(x, y, gz.ravel(), shape, window=(64, 64),
+                           top_range=(1e-3, 4e-3),
+                           centroid_range=(2e-4, 6e-4),
+                           field='gravity').fit()
+    flat = np.zeros(spec.windows_shape_, dtype=bool)
+    flat[0, 0] = True
+    flat = flat.ravel()
+    assert np.all(np.isnan(spec.top_[flat]))
+    assert np.all(np.isnan(spec.centroid_[flat]))
+    assert np.all(np.isfinite(spec.top_[~flat]))
+    # Windows that don't overlap the flat part are unaffected
+    clear = np.ones(spec.windows_shape_, dtype=bool)
+    clear[:2, :2] = False
+    npt.assert_allclose(spec.top_[clear.ravel()], 1000, rtol=0.2)
+
+
+def test_spectral_depth_integer_grid():
+    "gravmag.spectral works with integer data"
+    shape = (64, 64)
+    x, y, gz = _point_masses(shape, 1000, nsources=200)
+    integer = np.round(gz*1000).astype(np.int64)
+    args = dict(window=(32, 32), top_range=(1e-3, 3e-3),
+                centroid_range=(2e-4, 6e-4))
+    spec = SpectralDepthMW(x, y, integer, shape, **args).fit()
+    true = SpectralDepthMW(x, y, integer.astype(np.float64), shape,
+                           **args).fit()
+    npt.assert_allclose(spec.spectra_, true.spectra_)
+    npt.assert_allclose(spec.top_, true.top_)
+    assert np.all(integer == np.round(gz*1000))
@@ -268,3 +268,204 @@ def test_radial_average_spectrum_integers():
         z[inside] = i
     k, radial_z = transform.radial_average_spectrum(x, y, z)
     npt.assert_allclose(integers, radial_z, rtol=0.1)
+
+
+def test_grid_spectrum_matches_functions():
+    "gravmag.transform GridSpectrum gives the same results as the functions"
+    inc, dec = -30, 20
+    mag = utils.ang2vec(10, inc, dec)
+    model = [Prism(-1000, 1000, -500, 500, 0, 2000, {'magnetization': mag})]
+    shape = (60, 80)
+    x, y, z = gridder.regular([-10000, 10000, -10000, 10000], shape, z=-100)
+    data = prism.tf(x, y, z, model, inc, dec)
+    spectrum = transform.GridSpectrum(x, y, data, shape)
+    for deriv in 'xyz':
+        for order in [1, 2]:
+            true = getattr(transform, 'deriv' + deriv)(x, y, data, shape,
+                                                       order=order,
+                                                       method='fft')
+            npt.assert_allclose(getattr(spectrum, 'deriv' + deriv)(order),
+                                true)
+    npt.assert_allclose(spectrum.upcontinue(100),
+                        transform.upcontinue(x, y, data, shape, 100))
+    npt.assert_allclose(spectrum.tga(),
+                        transform.tga(x, y, data, shape, method='fft'))
+    dx, dy, dz = [getattr(transform, 'deriv' + d)(x, y, data, shape,
+                                                  method='fft')
+                  for d in 'xyz']
+    npt.assert_allclose(spectrum.tilt(),
+                        transform.tilt(x, y, data, shape, dx, dy, dz))
+    unpadded = transform.GridSpectrum(x, y, data, shape, pad=False)
+    npt.assert_allclose(
+        unpadded.reduce_to_pole(inc, dec, inc, dec),
+        transform.reduce_to_pole(x, y, data, shape, inc, dec, inc, dec))
+
+
+def test_grid_spectrum_even_nyquist():
+    "gravmag.transform GridSpectrum matches a complex FFT on even grids"
+    shape = (50, 50)
+    x, y = gridder.regular([-5000, 5000, -4000, 4000], shape)
+    data = np.random.RandomState(0).normal(size=x.size)
+    padded, padx, pady = transform._pad_data(data, shape)
+    assert padded.shape == (64, 64)
+    kx, ky = transform._fftfreqs(x, y, shape, padded.shape)
+    spectrum = transform.GridSpectrum(x, y, data, shape)
+
+    def complex_fft(filt):
+        result = np.real(np.fft.ifft2(np.fft.fft2(padded)*filt))
+        return result[padx: padx + shape[0], pady: pady + shape[1]].ravel()
+
+    for order in [1, 2, 3]:
+        npt.assert_allclose(spectrum.derivx(order),
+                            complex_fft((1j*kx)**order), rtol=1e-10)
+        npt.assert_allclose(spectrum.derivy(order),
+                            complex_fft((1j*ky)**order), rtol=1e-10)
+    inc, dec, sinc, sdec = 30, -20, 10, 40
+    fx, fy, fz = utils.ang2vec(1, inc, dec)
+    mx, my, mz = utils.ang2vec(1, sinc, sdec)
+    kz = np.sqrt(kx**2 + ky**2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rtp = kz**2/((mz*fz - mx*fx)*kx**2 + (mz*fz - my*fy)*ky**2 +
+                     (-my*fx - mx*fy)*kx*ky +
+                     1j*kz*((mx*fz + mz*fx)*kx + (my*fz + mz*fy)*ky))
+    rtp[0, 0] = 0
+    npt.assert_allclose(spectrum.reduce_to_pole(inc, dec, sinc, sdec),
+                        complex_fft(rtp), rtol=1e-10)
+    # The x derivative of data flipped in x is the flipped derivative with
+    # the opposite sign
+    flipped = data.reshape(shape)[::-1].ravel()
+    deriv = transform.GridSpectrum(x, y, flipped, shape).derivx()
+    npt.assert_allclose(deriv.reshape(shape)[::-1].ravel(),
+                        -spectrum.derivx(), rtol=1e-10)
+
+
+def test_grid_spectrum_single_fft(monkeypatch):
+    "gravmag.transform GridSpectrum only calculates the forward FFT once"
+    calls = []
+    rfft2 = transform._fft.rfft2
+
+    def counted(*args, **kwargs):
+        calls.append(1)
+        return rfft2(*args, **kwargs)
+
+    shape = (40, 40)
+    x, y = gridder.regular([-1000, 1000, -1000, 1000], shape)
+    data = np.exp(-(x**2 + y**2)/500**2)
+    monkeypatch.setattr(transform._fft, 'rfft2', counted)
+    spectrum = transform.GridSpectrum(x, y, data, shape)
+    spectrum.derivx()
+    spectrum.derivz(order=2)
+    spectrum.upcontinue(10)
+    spectrum.upcontinue(50)
+    spectrum.tilt()
+    spectrum.reduce_to_pole(30, 10, 30, 10)
+    assert len(calls) == 1
+
+
+def test_fft_backends():
+    "gravmag.transform gives the same results with all FFT backends"
+    model = [Prism(-1000, 1000, -500, 500, 0, 2000, {'density': 100})]
+    shape = (45, 60)
+    x, y, z = gridder.regular([-5000, 5000, -5000, 5000], shape, z=-100)
+    data = prism.gz(x, y, z, model)
+    results = []
+    previous = transform.set_fft_backend('numpy')
+    try:
+        for backend in transform._fft.BACKENDS:
+            transform.set_fft_backend(backend)
+            for workers in [1, 2]:
+                spectrum = transform.GridSpectrum(x, y, data, shape,
+                                                  workers=workers)
+                results.append([spectrum.derivx(), spectrum.derivz(2),
+                                spectrum.upcontinue(100)])
+    finally:
+        transform.set_fft_backend(previous)
+    for result in results[1:]:
+        for calculated, expected in zip(result, results[0]):
+            npt.assert_allclose(calculated, expected, rtol=1e-10,
+                                atol=1e-10*np.abs(expected).max())
+
+
+def test_tiled_memmap(tmpdir):
+    "gravmag.transform tiled derivatives on memmaps match analytical solution"
+    model = [Prism(-1000, 1000, -500, 500, 0, 2000, {'density': 100})]
+    area = [-10000, 10000, -10000, 10000]
+    shape = (300, 300)
+    x, y, z = gridder.regular(area, shape, z=-100)
+    fname = str(tmpdir.join('data.npy'))
+    data = np.lib.format.open_memmap(fname, mode='w+', shape=shape)
+    data[:] = utils.mgal2si(prism.gz(x, y, z, model)).reshape(shape)
+    data.flush()
+    data = np.load(fname, mmap_mode='r')
+    for deriv in 'xyz':
+        analytical = getattr(prism, 'g{}z'.format(deriv))(x, y, z, model)
+        output = str(tmpdir.join('d{}.dat'.format(deriv)))
+        result = transform.tiled(area, data, shape, 'deriv' + deriv,
+                                 tile=(100, 120), overlap=(60, 60),
+                                 output=output)
+        assert isinstance(result, np.memmap)
+        calculated = utils.si2eotvos(np.array(result).ravel())
+        diff = _trim(np.abs(analytical - calculated), shape)
+        # The z derivative is less accurate at the edges of the grid
+        assert np.all(diff <= 0.01*np.abs(analytical).max()), \
+            "Failed for g{}z".format(deriv)
+
+
+def test_tiled_odd_blocks():
+    "gravmag.transform tiled works on blocks with 2**k - 1 points"
+    model = [Prism(-1000, 1000, -500, 500, 0, 1000, {'density': 1000})]
+    area = [-5000, 5000, -5000, 5000]
+    height = 100
+    # A single block of 63 points and tiles with margins adding up to 127
+    for shape, tile, overlap in [((63, 50), (1024, 1024), (128, 128)),
+                                 ((127, 127), (27, 27), (50, 50))]:
+        x, y, z = gridder.regular(area, shape, z=-500)
+        data = prism.gz(x, y, z, model).reshape(shape)
+        analytical = prism.gz(x, y, z - height, model)
+        result = transform.tiled(area, data, shape, 'upcontinue',
+                                 tile=tile, overlap=overlap, height=height)
+        assert result.shape == shape
+        diff = _trim(np.abs(result.ravel() - analytical), shape, d=10)
+        assert np.all(diff <= 0.01*np.abs(analytical).max()), \
+            "Failed for shape {}".format(shape)
+
+
+def test_upcontinue_heights(tmpdir):
+    "gravmag.transform upward continuation to many heights at once"
+    model = [Prism(-1000, 1000, -500, 500, 0, 1000, {'density': 1000})]
+    shape = (60, 50)
+    x, y, z = gridder.regular([-5000, 5000, -5000, 5000], shape, z=-500)
+    data = prism.gz(x, y, z, model)
+    heights = [10, 100, 50, 500]
+    single = [transform.upcontinue(x, y, data, shape, h).reshape(shape)
+              for h in heights]
+    stack = transform.upcontinue(x, y, data, shape, heights=heights)
+    assert stack.shape == (len(heights),) + shape
+    npt.assert_allclose(stack, single)
+    generator = transform.upcontinue(x, y, data, shape, heights=heights,
+                                     generator=True)
+    for cont, expected in zip(generator, single):
+        npt.assert_allclose(cont, expected)
+    fname = str(tmpdir.join('stack.dat'))
+    stack = transform.upcontinue(x, y, data, shape, heights=heights,
+                                 output=fname)
+    assert isinstance(stack, np.memmap)
+    stack = np.memmap(fname, dtype=np.float64, mode='r',
+                      shape=(len(heights),) + shape)
+    npt.assert_allclose(stack, single)
+    with pytest.warns(UserWarning):
+        transform.upcontinue(x, y, data, shape, heights=[10, -10])
+
+
+def test_radial_average_spectrum_stack():
+    "gravmag.transform radial average of a stack of spectra"
+    shape = (40, 60)
+    x, y = gridder.regular((0, 10000, 0, 20000), shape)
+    stack = np.random.RandomState(0).uniform(size=(5,) + shape)
+    kx, ky, _ = transform.power_density_spectra(x, y, stack[0].ravel(), shape)
+    k, radial = transform.radial_average_spectrum(kx, ky, stack)
+    assert radial.shape == (stack.shape[0], k.size)
+    for pds, expected in zip(stack, radial):
+        k_single, single = transform.radial_average_spectrum(kx, ky, pds)
+        npt.assert_allclose(k_single, k)
+        npt.assert_allclose(single, expected)
@@ -17,6 +17,16 @@ Potential field transformations, like upward continuation and derivatives.
 * :func:`~fatiando.gravmag.transform.radial_average`: Calculates the
   the radial average of a Power Density Spectra using concentring rings.
 
+**Many transformations of the same grid**
+
+* :class:`~fatiando.gravmag.transform.GridSpectrum`: Pads and Fourier
+  transforms a grid once and calculates any number of derivatives,
+  continuations, and reductions to the pole from the same spectrum.
+* :func:`~fatiando.gravmag.transform.tiled`: Apply a transformation to a grid
+  that doesn't fit in memory one tile at a time.
+* :func:`~fatiando.gravmag.transform.set_fft_backend`: Choose the library used
+  to calculate the FFTs (pyFFTW, scipy, or numpy).
+
 **Derivatives**
 
 * :func:`~fatiando.gravmag.transform.derivx`: Calculate the n-th order
@@ -33,10 +43,11 @@ from __future__ import division, absolute_import
 import warnings
 import numpy
 
-from .. import utils
+from .. import utils, gridder
+from . import _fft
 
 
-def reduce_to_pole(x, y, data, shape, inc, dec, sinc, sdec):
+def reduce_to_pole(x, y, data, shape, inc, dec, sinc, sdec, workers=1):
     r"""
     Reduce total field magnetic anomaly data to the pole.
 
@@ -94,6 +105,9 @@ def reduce_to_pole(x, y, data, shape, inc, dec, sinc, sdec):
         anomaly source. The total magnetization is the vector sum of the
         induced and remanent magnetization. If there is only induced
         magnetization, use the *inc* and *dec* of the Geomagnetic field.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -106,29 +120,12 @@ def reduce_to_pole(x, y, data, shape, inc, dec, sinc, sdec):
     Applications, Cambridge University Press.
 
     """
-    fx, fy, fz = utils.ang2vec(1, inc, dec)
-    if sinc is None or sdec is None:
-        mx, my, mz = fx, fy, fz
-    else:
-        mx, my, mz = utils.ang2vec(1, sinc, sdec)
-    kx, ky = [k for k in _fftfreqs(x, y, shape, shape)]
-    kz_sqr = kx**2 + ky**2
-    a1 = mz*fz - mx*fx
-    a2 = mz*fz - my*fy
-    a3 = -my*fx - mx*fy
-    b1 = mx*fz + mz*fx
-    b2 = my*fz + mz*fy
-    # The division gives a RuntimeWarning because of the zero frequency term.
-    # This suppresses the warning.
-    with numpy.errstate(divide='ignore', invalid='ignore'):
-        rtp = (kz_sqr)/(a1*kx**2 + a2*ky**2 + a3*kx*ky +
-                        1j*numpy.sqrt(kz_sqr)*(b1*kx + b2*ky))
-    rtp[0, 0] = 0
-    ft_pole = rtp*numpy.fft.fft2(numpy.reshape(data, shape))
-    return numpy.real(numpy.fft.ifft2(ft_pole)).ravel()
+    spectrum = GridSpectrum(x, y, data, shape, pad=False, workers=workers)
+    return spectrum.reduce_to_pole(inc, dec, sinc, sdec)
 
 
-def upcontinue(x, y, data, shape, height):
+def upcontinue(x, y, data, shape, height=None, workers=1, heights=None,
+               generator=False, output=None):
     r"""
     Upward continuation of potential field data.
 
@@ -143,6 +140,10 @@ def upcontinue(x, y, data, shape, height):
     continue data, :math:`\Delta z` is the height increase, :math:`F` denotes
     the Fourier Transform,  and :math:`|k|` is the wavenumber modulus.
 
+    Use *heights* instead of *height* to continue to several heights at once.
+    The data are only padded and transformed once and the results are
+    returned as a 3D array (or one at a time with ``generator=True``).
+
     .. note:: Requires gridded data.
 
     .. note:: x, y, z and height should be in meters.
@@ -164,11 +165,27 @@ def upcontinue(x, y, data, shape, height):
         The shape of the grid
     * height : float
         The height increase (delta z) in meters.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
+    * heights : None or list of floats
+        Several height increases (delta z) in meters. Use instead of
+        *height*.
+    * generator : True or False
+        If True and *heights* is given, return a generator that calculates
+        the continued data for each height when iterated over.
+    * output : None, str, or 3D-array
+        Where to write the stack of continued data if *heights* is given.
+        If None, will create a new array in memory. If a str, will create a
+        :class:`numpy.memmap` with this file name. Otherwise, an array (or
+        memmap) with shape ``(len(heights), nx, ny)``.
 
     Returns:
 
     * cont : array
-        The upward continued data
+        The upward continued data. If *heights* is given, a 3D-array with the
+        continued data for each height with shape ``(len(heights), nx, ny)``
+        (or a generator of 2D-arrays with shape ``(nx, ny)``).
 
     References:
 
@@ -176,21 +193,14 @@ def upcontinue(x, y, data, shape, height):
     Applications, Cambridge University Press.
 
     """
-    assert x.shape == y.shape, \
-        "x and y arrays must have same shape"
-    if height <= 0:
-        warnings.warn("Using 'height' <= 0 means downward continuation, " +
-                      "which is known to be unstable.")
-    nx, ny = shape
-    # Pad the array with the edge values to avoid instability
-    padded, padx, pady = _pad_data(data, shape)
-    kx, ky = _fftfreqs(x, y, shape, padded.shape)
-    kz = numpy.sqrt(kx**2 + ky**2)
-    upcont_ft = numpy.fft.fft2(padded)*numpy.exp(-height*kz)
-    cont = numpy.real(numpy.fft.ifft2(upcont_ft))
-    # Remove padding
-    cont = cont[padx: padx + nx, pady: pady + ny].ravel()
-    return cont
+    assert (height is None) != (heights is None), \
+        "Only one of 'height' or 'heights' should be given"
+    spectrum = GridSpectrum(x, y, data, shape, workers=workers)
+    if heights is None:
+        return spectrum.upcontinue(height)
+    if generator:
+        return spectrum.iter_upcontinue(heights)
+    return spectrum.upcontinue_stack(heights, output)
 
 
 def _upcontinue_space(x, y, data, shape, height):
@@ -213,7 +223,7 @@ def _upcontinue_space(x, y, data, shape, height):
     return cont
 
 
-def tga(x, y, data, shape, method='fd'):
+def tga(x, y, data, shape, method='fd', workers=1):
     r"""
     Calculate the total gradient amplitude (TGA).
 
@@ -252,6 +262,9 @@ def tga(x, y, data, shape, method='fd'):
         The method used to calculate the horizontal derivatives. Options are:
         ``'fd'`` for finite-difference (more stable) or ``'fft'`` for the Fast
         Fourier Transform. The z derivative is always calculated by FFT.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -269,14 +282,20 @@ def tga(x, y, data, shape, method='fd'):
     doi:10.1190/1.1443174.
 
     """
+    assert method in ['fft', 'fd'], \
+        'Invalid method "{}".'.format(method)
+    spectrum = GridSpectrum(x, y, data, shape, workers=workers)
+    if method == 'fft':
+        return spectrum.tga()
     dx = derivx(x, y, data, shape, method=method)
     dy = derivy(x, y, data, shape, method=method)
-    dz = derivz(x, y, data, shape)
+    dz = spectrum.derivz()
     res = numpy.sqrt(dx ** 2 + dy ** 2 + dz ** 2)
     return res
 
 
-def tilt(x, y, data, shape, xderiv=None, yderiv=None, zderiv=None):
+def tilt(x, y, data, shape, xderiv=None, yderiv=None, zderiv=None,
+         workers=1):
     r"""
     Calculates the potential field tilt, as defined by Miller and Singh (1994)
 
@@ -322,6 +341,9 @@ def tilt(x, y, data, shape, xderiv=None, yderiv=None, zderiv=None):
         Optional. Values of the derivative in the z direction.
         If ``None``, will calculated using the default options of
         :func:`~fatiando.gravmag.transform.derivz`
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -341,13 +363,13 @@ def tilt(x, y, data, shape, xderiv=None, yderiv=None, zderiv=None):
     if yderiv is None:
         yderiv = derivy(x, y, data, shape)
     if zderiv is None:
-        zderiv = derivz(x, y, data, shape)
+        zderiv = derivz(x, y, data, shape, workers=workers)
     horiz_deriv = numpy.sqrt(xderiv**2 + yderiv**2)
     tilt = numpy.arctan2(zderiv, horiz_deriv)
     return tilt
 
 
-def derivx(x, y, data, shape, order=1, method='fd'):
+def derivx(x, y, data, shape, order=1, method='fd', workers=1):
     """
     Calculate the derivative of a potential field in the x direction.
 
@@ -375,6 +397,10 @@ def derivx(x, y, data, shape, order=1, method='fd'):
         The method used to calculate the derivatives. Options are:
         ``'fd'`` for central finite-differences (more stable) or ``'fft'``
         for the Fast Fourier Transform.
+    * workers : int
+        The number of threads used to calculate the FFTs (if
+        ``method='fft'``). ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -386,13 +412,8 @@ def derivx(x, y, data, shape, order=1, method='fd'):
     assert method in ['fft', 'fd'], \
         'Invalid method "{}".'.format(method)
     if method == 'fft':
-        # Pad the array with the edge values to avoid instability
-        padded, padx, pady = _pad_data(data, shape)
-        kx, _ = _fftfreqs(x, y, shape, padded.shape)
-        deriv_ft = numpy.fft.fft2(padded)*(kx*1j)**order
-        deriv_pad = numpy.real(numpy.fft.ifft2(deriv_ft))
-        # Remove padding from derivative
-        deriv = deriv_pad[padx: padx + nx, pady: pady + ny]
+        spectrum = GridSpectrum(x, y, data, shape, workers=workers)
+        deriv = spectrum.derivx(order)
     elif method == 'fd':
         datamat = data.reshape(shape)
         dx = (x.max() - x.min())/(nx - 1)
@@ -405,7 +426,7 @@ def derivx(x, y, data, shape, order=1, method='fd'):
     return deriv.ravel()
 
 
-def derivy(x, y, data, shape, order=1, method='fd'):
+def derivy(x, y, data, shape, order=1, method='fd', workers=1):
     """
     Calculate the derivative of a potential field in the y direction.
 
@@ -433,6 +454,10 @@ def derivy(x, y, data, shape, order=1, method='fd'):
         The method used to calculate the derivatives. Options are:
         ``'fd'`` for central finite-differences (more stable) or ``'fft'``
         for the Fast Fourier Transform.
+    * workers : int
+        The number of threads used to calculate the FFTs (if
+        ``method='fft'``). ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -444,13 +469,8 @@ def derivy(x, y, data, shape, order=1, method='fd'):
     assert method in ['fft', 'fd'], \
         'Invalid method "{}".'.format(method)
     if method == 'fft':
-        # Pad the array with the edge values to avoid instability
-        padded, padx, pady = _pad_data(data, shape)
-        _, ky = _fftfreqs(x, y, shape, padded.shape)
-        deriv_ft = numpy.fft.fft2(padded)*(ky*1j)**order
-        deriv_pad = numpy.real(numpy.fft.ifft2(deriv_ft))
-        # Remove padding from derivative
-        deriv = deriv_pad[padx: padx + nx, pady: pady + ny]
+        spectrum = GridSpectrum(x, y, data, shape, workers=workers)
+        deriv = spectrum.derivy(order)
     elif method == 'fd':
         datamat = data.reshape(shape)
         dy = (y.max() - y.min())/(ny - 1)
@@ -463,7 +483,7 @@ def derivy(x, y, data, shape, order=1, method='fd'):
     return deriv.ravel()
 
 
-def derivz(x, y, data, shape, order=1, method='fft'):
+def derivz(x, y, data, shape, order=1, method='fft', workers=1):
     """
     Calculate the derivative of a potential field in the z direction.
 
@@ -490,6 +510,9 @@ def derivz(x, y, data, shape, order=1, method='fft'):
     * method : string
         The method used to calculate the derivatives. Options are:
         ``'fft'`` for the Fast Fourier Transform.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -499,17 +522,10 @@ def derivz(x, y, data, shape, order=1, method='fft'):
     """
     assert method == 'fft', \
         "Invalid method '{}'".format(method)
-    nx, ny = shape
-    # Pad the array with the edge values to avoid instability
-    padded, padx, pady = _pad_data(data, shape)
-    kx, ky = _fftfreqs(x, y, shape, padded.shape)
-    deriv_ft = numpy.fft.fft2(padded)*numpy.sqrt(kx**2 + ky**2)**order
-    deriv = numpy.real(numpy.fft.ifft2(deriv_ft))
-    # Remove padding from derivative
-    return deriv[padx: padx + nx, pady: pady + ny].ravel()
+    return GridSpectrum(x, y, data, shape, workers=workers).derivz(order)
 
 
-def power_density_spectra(x, y, data, shape):
+def power_density_spectra(x, y, data, shape, workers=1):
     r"""
     Calculates the Power Density Spectra of a 2D gridded potential field
     through the FFT:
@@ -530,6 +546,9 @@ def power_density_spectra(x, y, data, shape):
         The potential field at the grid points
     * shape : tuple = (nx, ny)
         The shape of the grid
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
 
     Returns:
 
@@ -539,7 +558,7 @@ def power_density_spectra(x, y, data, shape):
         The Power Density Spectra of the data
     """
     kx, ky = _fftfreqs(x, y, shape, shape)
-    pds = abs(numpy.fft.fft2(numpy.reshape(data, shape)))**2
+    pds = abs(_fft.fft2(numpy.reshape(data, shape), workers))**2
     return kx, ky, pds
 
 
@@ -561,8 +580,10 @@ def radial_average_spectrum(kx, ky, pds, max_radius=None, ring_width=None):
 
     * kx, ky : 2D-arrays
         The wavenumbers arrays in the `x` and `y` directions
-    * pds : 2D-array
-        The Power Density Spectra
+    * pds : 2D-array or 3D-array
+        The Power Density Spectra. Can also be a stack of spectra with shape
+        ``(nspectra, nx, ny)`` (e.g., from several windows of the data) that
+        share the same wavenumbers. They are all averaged at once.
     * max_radius : float (optional)
         Inner radius of the biggest ring.
         By default it's set as the minimum of kx.max() and ky.max().
@@ -582,32 +603,503 @@ def radial_average_spectrum(kx, ky, pds, max_radius=None, ring_width=None):
     * k_radial : 1D-array
         Wavenumbers of each Radially Averaged Power Spectrum point.
         Also, the inner radius of the rings.
-    * pds_radial : 1D array
-        Radially Averaged Power Spectrum
+    * pds_radial : 1D array or 2D-array
+        Radially Averaged Power Spectrum. If *pds* is a stack of spectra, will
+        have shape ``(nspectra, len(k_radial))``. Rings without any points are
+        set to NaN.
+
+    Examples:
+
+    >>> kx, ky = numpy.meshgrid(numpy.arange(-3, 4), numpy.arange(-3, 4))
+    >>> pds = numpy.sqrt(kx**2 + ky**2)
+    >>> k, pds_radial = radial_average_spectrum(kx, ky, pds)
+    >>> print(k.tolist())
+    [0, 1, 2, 3]
+    >>> print(', '.join('{:.2f}'.format(i) for i in pds_radial))
+    0.00, 1.21, 2.16, 3.04
+    >>> k, pds_radial = radial_average_spectrum(
+    ...     kx, ky, numpy.array([pds, 2*pds]))
+    >>> pds_radial.shape
+    (2, 4)
+    >>> print(', '.join('{:.2f}'.format(i) for i in pds_radial[1]))
+    0.00, 2.41, 4.31, 6.08
+
     """
-    nx, ny = pds.shape
     if max_radius is None:
         max_radius = min(kx.max(), ky.max())
     if ring_width is None:
-        ring_width = max(numpy.unique(kx)[numpy.unique(kx) > 0][0],
-                         numpy.unique(ky)[numpy.unique(ky) > 0][0])
-    k = numpy.sqrt(kx**2 + ky**2)
-    pds_radial = []
-    k_radial = []
-    radius_i = -1
-    while True:
-        radius_i += 1
-        if radius_i*ring_width > max_radius:
-            break
+        ring_width = max(numpy.min(kx[kx > 0]), numpy.min(ky[ky > 0]))
+    k = numpy.sqrt(kx**2 + ky**2).ravel()
+    # The rings are centered on these radii
+    rings = numpy.arange(int(max_radius//ring_width) + 2)
+    k_radial = rings[rings*ring_width <= max_radius]*ring_width
+    nrings = k_radial.size
+    # The index of the ring that each point falls in. Ring i contains the
+    # points with (i - 0.5)*width < k <= (i + 0.5)*width.
+    index = numpy.digitize(k, (rings[:nrings] + 0.5)*ring_width, right=True)
+    inside = index < nrings
+    index = index[inside]
+    counts = numpy.bincount(index, minlength=nrings)
+    spectra = pds.reshape((-1, k.size))[:, inside]
+    nspectra = spectra.shape[0]
+    # Offset the ring indices of each spectrum to sum all in one bincount
+    offsets = nrings*numpy.arange(nspectra)[:, numpy.newaxis]
+    sums = numpy.bincount((index + offsets).ravel(), weights=spectra.ravel(),
+                          minlength=nspectra*nrings).reshape((nspectra, -1))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        pds_radial = sums/counts
+    if pds.ndim == 2:
+        pds_radial = pds_radial[0]
+    return k_radial, pds_radial
+
+
+def set_fft_backend(backend):
+    """
+    Choose the library used to calculate the FFTs in this module.
+
+    The options are ``'pyfftw'`` (if pyFFTW is installed), ``'scipy'`` (if
+    scipy >= 1.4), and ``'numpy'``. The default is the first one available.
+    With pyFFTW, the FFTW plans are created once for each grid shape and kept
+    in memory. Only pyFFTW and scipy will use more than one thread
+    (``workers`` argument of the transformations).
+
+    Parameters:
+
+    * backend : str
+        The name of the library.
+
+    Returns:
+
+    * previous : str
+        The name of the library used before.
+
+    Examples:
+
+    >>> previous = set_fft_backend('numpy')
+    >>> previous = set_fft_backend(previous)
+    >>> print(previous)
+    numpy
+
+    """
+    previous = _fft.get_backend()
+    _fft.set_backend(backend)
+    return previous
+
+
+class GridSpectrum(object):
+    r"""
+    The Fourier transform of a grid, reused to calculate many transformations.
+
+    The grid is padded (with the edge values, like
+    :func:`~fatiando.gravmag.transform.upcontinue`) and transformed only once
+    when the object is created. The spectrum and the wavenumbers are kept in
+    memory and each transformation only multiplies the spectrum by a filter
+    and calculates the inverse transform. Since the data are real, only the
+    non-negative wavenumbers in the y direction are kept (the other half of
+    the spectrum is redundant). Use this when you need several
+    products (derivatives, continuations, tilt, etc) of the same data.
+
+    The results are the same as the ones from the functions in this module
+    with ``method='fft'``. The exception is
+    :func:`~fatiando.gravmag.transform.reduce_to_pole`, which doesn't pad
+    the grid. Use ``pad=False`` to get the same results as it.
+
+    .. note:: Requires gridded data.
+
+    Parameters:
+
+    * x, y : 1D-arrays
+        The x and y coordinates of the grid points
+    * data : 1D-array
+        The potential field at the grid points
+    * shape : tuple = (nx, ny)
+        The shape of the grid
+    * pad : True or False
+        Whether or not to pad the grid before the transform. Padding reduces
+        the edge effects of the FFT.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
+
+    Examples:
+
+    >>> from fatiando import gridder
+    >>> shape = (50, 50)
+    >>> x, y = gridder.regular((-5000, 5000, -5000, 5000), shape)
+    >>> data = 1000/((x - 100)**2 + y**2 + 1000**2)**0.5
+    >>> spectrum = GridSpectrum(x, y, data, shape)
+    >>> spectrum.padded_shape
+    (64, 64)
+    >>> dx, dy, dz = spectrum.derivx(), spectrum.derivy(), spectrum.derivz()
+    >>> total = spectrum.tga()
+    >>> print(numpy.allclose(total, numpy.sqrt(dx**2 + dy**2 + dz**2)))
+    True
+    >>> cont = spectrum.upcontinue(500)
+    >>> print(numpy.allclose(cont, upcontinue(x, y, data, shape, 500)))
+    True
+
+    Any other filter in the wavenumber domain can be applied with
+    :meth:`~fatiando.gravmag.transform.GridSpectrum.apply`:
+
+    >>> lowpass = spectrum.apply(numpy.exp(-(500*spectrum.kz)**2))
+    >>> lowpass.shape
+    (2500,)
+
+    """
+
+    def __init__(self, x, y, data, shape, pad=True, workers=1):
+        assert x.shape == y.shape, \
+            "x and y arrays must have same shape"
+        self.shape = tuple(shape)
+        self.workers = workers
+        if pad:
+            # Pad the array with the edge values to avoid instability
+            padded, self.padx, self.pady = _pad_data(data, shape)
+        else:
+            padded, self.padx, self.pady = numpy.reshape(data, shape), 0, 0
+        self.padded_shape = padded.shape
+        self.kx, self.ky = _fftfreqs(x, y, shape, padded.shape, real=True)
+        self.spectrum = _fft.rfft2(padded, workers)
+        self._kz = None
+
+    @property
+    def kz(self):
+        r"""
+        The wavenumber modulus :math:`|k| = \sqrt{k_x^2 + k_y^2}`.
+        """
+        if self._kz is None:
+            self._kz = numpy.sqrt(self.kx**2 + self.ky**2)
+        return self._kz
+
+    def apply(self, filt, zero=None):
+        """
+        Multiply the spectrum by a filter and transform back.
+
+        Parameters:
+
+        * filt : 2D-array, scalar, or function
+            The filter in the wavenumber domain. Must have the same shape as
+            ``kx`` and ``ky``. The filter of real data must be Hermitian
+            (the value at -k is the complex conjugate of the value at k).
+            Filters that are odd in kx (like the x derivatives) aren't
+            Hermitian at the Nyquist wavenumber of an even number of points,
+            which is its own negative. Pass them as a function
+            ``filt(kx, ky)`` instead and the filter on that row will be the
+            mean of the values at kx and -kx (the same as with a complex
+            FFT).
+        * zero : None or complex
+            If not None, will replace the value of the filter at the zero
+            wavenumber (useful when the filter is undefined there).
+
+        Returns:
+
+        * result : 1D-array
+            The filtered data on the original grid (without the padding)
+
+        """
+        if callable(filt):
+            filt = self._hermitian(filt)
+        filtered = self.spectrum*filt
+        if zero is not None:
+            filtered[0, 0] = self.spectrum[0, 0]*zero
+        return self._inverse(filtered).ravel()
+
+    def _hermitian(self, function):
+        """
+        Evaluate a filter function on the wavenumbers.
+
+        The x Nyquist row (if there is one) gets the mean of the filter at kx
+        and -kx. In the corner with the y Nyquist column, the real FFT keeps
+        only the real part and that must come from -kx (rfftfreq gives a
+        positive y Nyquist wavenumber and fftfreq a negative one).
+        """
+        filt = numpy.array(function(self.kx, self.ky), dtype=numpy.complex128)
+        nx, ny = self.padded_shape
+        if nx % 2 == 0:
+            row = nx//2
+            mirror = function(-self.kx[row], self.ky[row])
+            filt[row] = 0.5*(filt[row] + mirror)
+            if ny % 2 == 0:
+                filt[row, -1] = mirror[-1]
+        return filt
+
+    def _inverse(self, filtered):
+        """
+        Inverse transform of a filtered spectrum without the padding.
+
+        Might overwrite *filtered*.
+        """
+        result = _fft.irfft2(filtered, self.padded_shape, self.workers)
+        nx, ny = self.shape
+        return result[self.padx: self.padx + nx, self.pady: self.pady + ny]
+
+    def derivx(self, order=1):
+        """
+        The n-th order derivative in the x direction.
+
+        See :func:`~fatiando.gravmag.transform.derivx`.
+        """
+        return self.apply(lambda kx, ky: (kx*1j)**order)
+
+    def derivy(self, order=1):
+        """
+        The n-th order derivative in the y direction.
+
+        See :func:`~fatiando.gravmag.transform.derivy`.
+        """
+        return self.apply((self.ky*1j)**order)
+
+    def derivz(self, order=1):
+        """
+        The n-th order derivative in the z direction.
+
+        See :func:`~fatiando.gravmag.transform.derivz`.
+        """
+        return self.apply(self.kz**order)
+
+    def upcontinue(self, height):
+        """
+        Upward continuation to a height increase *height* (in meters).
+
+        See :func:`~fatiando.gravmag.transform.upcontinue`.
+        """
+        _check_heights([height])
+        return self.apply(numpy.exp(-height*self.kz))
+
+    def iter_upcontinue(self, heights):
+        """
+        Iterate over the upward continuation to several heights.
+
+        The filter and the filtered spectrum are calculated in place in the
+        same arrays for all heights.
+
+        See :func:`~fatiando.gravmag.transform.upcontinue`.
+
+        Parameters:
+
+        * heights : list of floats
+            The height increases (delta z) in meters.
+
+        Yields:
+
+        * cont : 2D-array
+            The continued data for each height (with the shape of the grid)
+
+        """
+        _check_heights(heights)
+        exponent = numpy.empty(self.kz.shape)
+        filtered = numpy.empty_like(self.spectrum)
+        for height in heights:
+            numpy.multiply(self.kz, -height, out=exponent)
+            numpy.exp(exponent, out=exponent)
+            numpy.multiply(self.spectrum, exponent, out=filtered)
+            yield self._inverse(filtered)
+
+    def upcontinue_stack(self, heights, output=None):
+        """
+        Upward continuation to several heights stacked in a 3D array.
+
+        See :func:`~fatiando.gravmag.transform.upcontinue`.
+
+        Parameters:
+
+        * heights : list of floats
+            The height increases (delta z) in meters.
+        * output : None, str, or 3D-array
+            Where to write the result. If None, will create a new array in
+            memory. If a str, will create a :class:`numpy.memmap` with this
+            file name. Otherwise, an array (or memmap) with shape
+            ``(len(heights), nx, ny)``.
+
+        Returns:
+
+        * stack : 3D-array
+            The *output* array with the continued data for each height
+
+        """
+        output = _output_array(output, (len(heights),) + self.shape)
+        for i, cont in enumerate(self.iter_upcontinue(heights)):
+            output[i] = cont
+        if isinstance(output, numpy.memmap):
+            output.flush()
+        return output
+
+    def reduce_to_pole(self, inc, dec, sinc, sdec):
+        """
+        Reduce total field magnetic anomaly data to the pole.
+
+        See :func:`~fatiando.gravmag.transform.reduce_to_pole`. Unlike that
+        function, the grid is padded (unless the spectrum was created with
+        ``pad=False``), so the results differ close to the edges.
+        """
+        fx, fy, fz = utils.ang2vec(1, inc, dec)
+        if sinc is None or sdec is None:
+            mx, my, mz = fx, fy, fz
         else:
-            if radius_i == 0:
-                inside = k <= 0.5*ring_width
-            else:
-                inside = numpy.logical_and(k > (radius_i - 0.5)*ring_width,
-                                           k <= (radius_i + 0.5)*ring_width)
-            pds_radial.append(pds[inside].mean())
-            k_radial.append(radius_i*ring_width)
-    return numpy.array(k_radial), numpy.array(pds_radial)
+            mx, my, mz = utils.ang2vec(1, sinc, sdec)
+        a1 = mz*fz - mx*fx
+        a2 = mz*fz - my*fy
+        a3 = -my*fx - mx*fy
+        b1 = mx*fz + mz*fx
+        b2 = my*fz + mz*fy
+
+        def rtp(kx, ky):
+            kz_sqr = kx**2 + ky**2
+            # The division gives a RuntimeWarning because of the zero
+            # frequency term. This suppresses the warning.
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                return (kz_sqr)/(a1*kx**2 + a2*ky**2 + a3*kx*ky +
+                                 1j*numpy.sqrt(kz_sqr)*(b1*kx + b2*ky))
+
+        return self.apply(rtp, zero=0)
+
+    def tga(self):
+        """
+        The total gradient amplitude with all derivatives calculated by FFT.
+
+        See :func:`~fatiando.gravmag.transform.tga`.
+        """
+        dx, dy, dz = self.derivx(), self.derivy(), self.derivz()
+        return numpy.sqrt(dx**2 + dy**2 + dz**2)
+
+    def tilt(self):
+        """
+        The tilt angle (in radians) with all derivatives calculated by FFT.
+
+        See :func:`~fatiando.gravmag.transform.tilt`.
+        """
+        dx, dy, dz = self.derivx(), self.derivy(), self.derivz()
+        return numpy.arctan2(dz, numpy.sqrt(dx**2 + dy**2))
+
+
+def tiled(area, data, shape, operation, tile=(1024, 1024), overlap=(128, 128),
+          padtype='OddReflectionTaper', output=None, workers=1, **kwargs):
+    r"""
+    Apply a transformation to a grid too large for memory in tiles.
+
+    The grid is read one tile at a time (together with a margin of
+    *overlap* points on each side), padded with
+    :func:`~fatiando.gridder.pad_array`, and transformed using a
+    :class:`~fatiando.gravmag.transform.GridSpectrum`. Only the central part
+    of each transformed tile is written to the output (the margins are
+    discarded, like in the overlap-save method). Use a
+    :class:`numpy.memmap` for the input and output grids so that only the
+    current tile is ever in memory.
+
+    The margins must be larger than the distance over which the
+    transformation mixes the data. For upward continuation, use margins of
+    a few times the height. Derivatives need smaller margins.
+
+    .. note:: Requires gridded data.
+
+    Parameters:
+
+    * area : list = [x1, x2, y1, y2]
+        The borders of the grid
+    * data : 2D-array or 1D-array
+        The potential field on the grid. Can be a :class:`numpy.memmap`
+    * shape : tuple = (nx, ny)
+        The shape of the grid
+    * operation : str
+        The name of the transformation. One of ``'upcontinue'``,
+        ``'derivx'``, ``'derivy'``, ``'derivz'``, ``'reduce_to_pole'``,
+        ``'tga'``, or ``'tilt'`` (all calculated with the FFT). The
+        arguments of the transformation are passed as keyword arguments (see
+        :class:`~fatiando.gravmag.transform.GridSpectrum`).
+    * tile : tuple = (nx, ny)
+        The number of points in each tile (without the margins)
+    * overlap : tuple = (nx, ny)
+        The number of points in the margins on each side of the tiles
+    * padtype : str
+        How to pad the tiles. See :func:`~fatiando.gridder.pad_array`.
+    * output : None, str, or 2D-array
+        Where to write the result. If None, will create a new array in
+        memory. If a str, will create a :class:`numpy.memmap` with this file
+        name. Otherwise, an array (or memmap) with shape equal to *shape*.
+    * workers : int
+        The number of threads used to calculate the FFTs. ``-1`` uses all
+        cores. See :func:`~fatiando.gravmag.transform.set_fft_backend`.
+
+    Returns:
+
+    * result : 2D-array
+        The *output* array (with shape *shape*) containing the result
+
+    Examples:
+
+    >>> from fatiando import gridder
+    >>> area, shape = (-5000, 5000, -5000, 5000), (101, 101)
+    >>> x, y = gridder.regular(area, shape)
+    >>> data = 1000/((x - 100)**2 + y**2 + 1000**2)**0.5
+    >>> result = tiled(area, data, shape, 'upcontinue', tile=(50, 50),
+    ...                overlap=(25, 25), height=100)
+    >>> result.shape
+    (101, 101)
+    >>> whole = upcontinue(x, y, data, shape, 100).reshape(shape)
+    >>> error = numpy.abs(result - whole)[10:-10, 10:-10].max()
+    >>> print(error < 0.01*numpy.abs(whole).max())
+    True
+
+    """
+    operations = ['upcontinue', 'derivx', 'derivy', 'derivz',
+                  'reduce_to_pole', 'tga', 'tilt']
+    assert operation in operations, \
+        "Invalid operation '{}'. Options are {}.".format(operation, operations)
+    nx, ny = shape
+    x1, x2, y1, y2 = area
+    dx = (x2 - x1)/(nx - 1)
+    dy = (y2 - y1)/(ny - 1)
+    data = data.reshape(shape)
+    output = _output_array(output, shape)
+    for i in range(0, nx, tile[0]):
+        for j in range(0, ny, tile[1]):
+            # Limits of the tile with the margins
+            start = (max(i - overlap[0], 0), max(j - overlap[1], 0))
+            end = (min(i + tile[0] + overlap[0], nx),
+                   min(j + tile[1] + overlap[1], ny))
+            block = numpy.array(data[start[0]:end[0], start[1]:end[1]],
+                                dtype=numpy.float64)
+            # Leave at least one padding point on each side of the tile
+            padshape = [_nextpow2(n + 2) for n in block.shape]
+            padded, nps = gridder.pad_array(block, padshape, padtype)
+            # Only the spacing is taken from the coordinates
+            xp = numpy.array([0, dx*(padshape[0] - 1)])
+            yp = numpy.array([0, dy*(padshape[1] - 1)])
+            spectrum = GridSpectrum(xp, yp, padded, padshape, pad=False,
+                                    workers=workers)
+            result = getattr(spectrum, operation)(**kwargs).reshape(padshape)
+            # Skip the padding and the margins
+            ni, nj = min(tile[0], nx - i), min(tile[1], ny - j)
+            oi, oj = nps[0][0] + i - start[0], nps[1][0] + j - start[1]
+            output[i:i + ni, j:j + nj] = result[oi:oi + ni, oj:oj + nj]
+    if isinstance(output, numpy.memmap):
+        output.flush()
+    return output
+
+
+def _output_array(output, shape):
+    """
+    Create the array where results are written or check the one given.
+
+    *output* can be None (new array in memory), a file name (new
+    numpy.memmap), or an array.
+    """
+    shape = tuple(shape)
+    if output is None:
+        output = numpy.empty(shape)
+    elif isinstance(output, str):
+        output = numpy.memmap(output, dtype=numpy.float64, mode='w+',
+                              shape=shape)
+    assert output.shape == shape, \
+        "Output with shape {} instead of {}".format(output.shape, shape)
+    return output
+
+
+def _check_heights(heights):
+    "Warn about downward continuation"
+    if numpy.any(numpy.asarray(heights) <= 0):
+        warnings.warn("Using 'height' <= 0 means downward continuation, " +
+                      "which is known to be unstable.")
 
 
 def _pad_data(data, shape):
@@ -625,13 +1117,19 @@ def _nextpow2(i):
     return int(2**buf)
 
 
-def _fftfreqs(x, y, shape, padshape):
+def _fftfreqs(x, y, shape, padshape, real=False):
     """
     Get two 2D-arrays with the wave numbers in the x and y directions.
+
+    If *real* is True, returns only the non-negative wave numbers in the y
+    direction (the ones used by the real FFT).
     """
     nx, ny = shape
     dx = (x.max() - x.min())/(nx - 1)
     fx = 2*numpy.pi*numpy.fft.fftfreq(padshape[0], dx)
     dy = (y.max() - y.min())/(ny - 1)
-    fy = 2*numpy.pi*numpy.fft.fftfreq(padshape[1], dy)
+    if real:
+        fy = 2*numpy.pi*numpy.fft.rfftfreq(padshape[1], dy)
+    else:
+        fy = 2*numpy.pi*numpy.fft.fftfreq(padshape[1], dy)
     return numpy.meshgrid(fy, fx)[::-1]
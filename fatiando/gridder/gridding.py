@@ -0,0 +1,444 @@
+"""
+Gridding of large data sets using nearest neighbor searches.
+
+Interpolation with :func:`~fatiando.gridder.interp` needs a triangulation of
+all data points, which becomes too slow and too large for surveys with
+millions of points. The methods here only use the data close to each grid
+point, found with a KD-tree (``scipy.spatial.cKDTree``):
+
+* :func:`~fatiando.gridder.idw`: Inverse distance weighted average of the
+  nearest data points.
+* :func:`~fatiando.gridder.nearest_average`: Average of the nearest data
+  points.
+* :func:`~fatiando.gridder.block_median`: Median of the data inside the cell
+  around each grid point (decimation).
+
+The grids are the same as the ones generated by
+:func:`~fatiando.gridder.regular`. The data can be given in chunks (e.g.,
+read from a file or a :class:`numpy.memmap`) using the classes
+:class:`~fatiando.gridder.KNearestGridder` and
+:class:`~fatiando.gridder.BlockMedianGridder`, so that only one chunk needs
+to be in memory at a time.
+
+"""
+from __future__ import division, absolute_import, print_function
+import numpy as np
+import scipy.spatial
+
+from .point_generation import regular
+
+
+class KNearestGridder(object):
+    """
+    Find the nearest data points to each point of a regular grid.
+
+    The data are given in chunks with the
+    :meth:`~fatiando.gridder.KNearestGridder.add` method. The *k* nearest
+    points of each chunk are found with a KD-tree and merged with the ones
+    found so far, so only the *k* nearest data points (and their values) for
+    each grid point are kept in memory.
+
+    Parameters:
+
+    * area : tuple = (x1, x2, y1, y2)
+        The borders of the grid
+    * shape : tuple = (nx, ny)
+        Shape of the regular grid (see :func:`~fatiando.gridder.regular`)
+    * k : int
+        The number of nearest data points used for each grid point
+    * radius : None or float
+        Only use data points closer than this to a grid point. If None, will
+        use all data points.
+    * workers : int
+        Number of threads used to search the KD-tree. ``-1`` uses all cores.
+
+    The coordinates of the grid points are in the attributes ``x`` and
+    ``y``. The distances to the nearest data points and their values are
+    in ``distance`` and ``value`` (2D arrays with one row per grid point).
+    Missing neighbors have infinite distance.
+
+    Examples:
+
+    Giving the data in chunks is the same as giving all of it at once:
+
+    >>> import numpy as np
+    >>> from fatiando.gridder import scatter
+    >>> x, y = scatter((0, 10, 0, 10), 3000, seed=0)
+    >>> v = 2*x + y
+    >>> grid = KNearestGridder((0, 10, 0, 10), (11, 11), k=4)
+    >>> for i in range(0, 3000, 1000):
+    ...     grid = grid.add(x[i:i + 1000], y[i:i + 1000], v[i:i + 1000])
+    >>> whole = KNearestGridder((0, 10, 0, 10), (11, 11), k=4).add(x, y, v)
+    >>> print(np.allclose(grid.average(), whole.average()))
+    True
+
+    """
+
+    def __init__(self, area, shape, k=8, radius=None, workers=1):
+        self.area = area
+        self.shape = tuple(shape)
+        self.k = k
+        self.radius = radius
+        self.workers = workers
+        self.x, self.y = regular(area, shape)
+        self.distance = np.empty((self.x.size, 0))
+        self.value = np.empty((self.x.size, 0))
+
+    def add(self, x, y, v):
+        """
+        Include a chunk of data points.
+
+        Parameters:
+
+        * x, y : 1D arrays
+            The x and y coordinates of the data points.
+        * v : 1D array
+            The data values.
+
+        Returns:
+
+        * self
+
+        """
+        v = np.asarray(v, dtype=np.float64).ravel()
+        if v.size == 0:
+            return self
+        tree = scipy.spatial.cKDTree(np.transpose([np.ravel(x), np.ravel(y)]))
+        upper = np.inf if self.radius is None else self.radius
+        k = min(self.k, v.size)
+        distance, index = _query(tree, np.transpose([self.x, self.y]), k,
+                                 upper, self.workers)
+        distance = distance.reshape((self.x.size, k))
+        index = index.reshape((self.x.size, k))
+        # Missing neighbors have index equal to the number of data points
+        value = np.append(v, np.nan)[index]
+        distance = np.hstack([self.distance, distance])
+        value = np.hstack([self.value, value])
+        if distance.shape[1] > self.k:
+            keep = np.argpartition(distance, self.k - 1, axis=1)[:, :self.k]
+            rows = np.arange(distance.shape[0])[:, np.newaxis]
+            distance, value = distance[rows, keep], value[rows, keep]
+        self.distance, self.value = distance, value
+        return self
+
+    def idw(self, power=2):
+        """
+        Inverse distance weighted average of the nearest data points.
+
+        Grid points that coincide with data points get the data value. Grid
+        points with no data points in the search radius are NaN.
+
+        Parameters:
+
+        * power : float
+            The power of the distance in the weights.
+
+        Returns:
+
+        * v : 1D array
+            The gridded values.
+
+        """
+        found = np.isfinite(self.distance)
+        exact = found & (self.distance == 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.where(found, self.distance, 1)**(-power)
+            weights[~found] = 0
+            # Only the data points on top of the grid point count
+            hit = exact.any(axis=1)
+            weights[hit] = exact[hit]
+            v = (np.sum(weights*np.where(found, self.value, 0), axis=1) /
+                 np.sum(weights, axis=1))
+        return v
+
+    def average(self):
+        """
+        Average of the nearest data points.
+
+        Grid points with no data points in the search radius are NaN.
+
+        Returns:
+
+        * v : 1D array
+            The gridded values.
+
+        """
+        found = np.isfinite(self.distance)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v = (np.sum(np.where(found, self.value, 0), axis=1) /
+                 np.sum(found, axis=1))
+        return v
+
+
+class BlockMedianGridder(object):
+    """
+    Median of the data in blocks around the points of a regular grid.
+
+    Each grid point is the center of a block with the size of the grid
+    spacing. A grid with a single row or column uses the spacing of the
+    other axis as the width of its blocks. Data points outside of all blocks
+    are ignored. The data are given in chunks with the
+    :meth:`~fatiando.gridder.BlockMedianGridder.add` method. Only the block
+    index (an integer) and the value of each data point are kept, not their
+    coordinates.
+
+    Parameters:
+
+    * area : tuple = (x1, x2, y1, y2)
+        The borders of the grid
+    * shape : tuple = (nx, ny)
+        Shape of the regular grid (see :func:`~fatiando.gridder.regular`)
+
+    The coordinates of the grid points are in the attributes ``x`` and
+    ``y``.
+
+    """
+
+    def __init__(self, area, shape):
+        assert max(shape) > 1, \
+            "Need at least 2 grid points along one axis. Got {}".format(shape)
+        self.area = area
+        self.shape = tuple(shape)
+        self.x, self.y = regular(area, shape)
+        x1, x2, y1, y2 = area
+        nx, ny = self.shape
+        dx = (x2 - x1)/(nx - 1) if nx > 1 else None
+        dy = (y2 - y1)/(ny - 1) if ny > 1 else None
+        self._spacing = (dx if dx is not None else dy,
+                         dy if dy is not None else dx)
+        self._blocks = []
+        self._values = []
+
+    def add(self, x, y, v):
+        """
+        Include a chunk of data points.
+
+        Parameters:
+
+        * x, y : 1D arrays
+            The x and y coordinates of the data points.
+        * v : 1D array
+            The data values.
+
+        Returns:
+
+        * self
+
+        """
+        x1, x2, y1, y2 = self.area
+        nx, ny = self.shape
+        dx, dy = self._spacing
+        ix = _block_index(np.ravel(x), x1, dx)
+        iy = _block_index(np.ravel(y), y1, dy)
+        inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        self._blocks.append(ix[inside]*ny + iy[inside])
+        self._values.append(np.ravel(v)[inside].astype(np.float64))
+        return self
+
+    @property
+    def count(self):
+        """
+        The number of data points in each block.
+        """
+        blocks = np.concatenate([np.empty(0, dtype=np.int64)] + self._blocks)
+        return np.bincount(blocks, minlength=self.x.size)
+
+    def median(self):
+        """
+        The median of the data in each block.
+
+        Blocks without data are NaN.
+
+        Returns:
+
+        * v : 1D array
+            The gridded values.
+
+        """
+        blocks = np.concatenate([np.empty(0, dtype=np.int64)] + self._blocks)
+        values = np.concatenate([np.empty(0)] + self._values)
+        # Sort by block and then by value inside each block
+        order = np.lexsort((values, blocks))
+        values = values[order]
+        count = np.bincount(blocks, minlength=self.x.size)
+        start = np.cumsum(count) - count
+        v = np.empty(self.x.size)
+        v.fill(np.nan)
+        full = count > 0
+        lower = start[full] + (count[full] - 1)//2
+        upper = start[full] + count[full]//2
+        v[full] = 0.5*(values[lower] + values[upper])
+        return v
+
+
+def idw(x, y, v, shape, area=None, power=2, k=8, radius=None, workers=1,
+        chunk=None):
+    """
+    Grid data by inverse distance weighting of the nearest data points.
+
+    Uses a :class:`~fatiando.gridder.KNearestGridder`.
+
+    Parameters:
+
+    * x, y : 1D arrays
+        Arrays with the x and y coordinates of the data points.
+    * v : 1D array
+        Array with the scalar value assigned to the data points.
+    * shape : tuple = (nx, ny)
+        Shape of the regular grid, ie (nx, ny).
+    * area : tuple = (x1, x2, y1, y2)
+        The are where the data will be gridded. If None, then will get the
+        area from *x* and *y*.
+    * power : float
+        The power of the distance in the weights.
+    * k : int
+        The number of nearest data points used for each grid point
+    * radius : None or float
+        Only use data points closer than this to a grid point. If None, will
+        use all data points.
+    * workers : int
+        Number of threads used to search the KD-tree. ``-1`` uses all cores.
+    * chunk : None or int
+        Process the data in chunks of this many points (useful for
+        :class:`numpy.memmap` arrays). If None, will use all at once.
+
+    Returns:
+
+    * ``[x, y, v]``
+        Three 1D arrays with the gridded x, y, and v
+
+    Examples:
+
+    Grid points that coincide with data points get the data values:
+
+    >>> import numpy as np
+    >>> x, y = regular((0, 10, 0, 10), (21, 21))
+    >>> xp, yp, vp = idw(x, y, x + y, (11, 11), chunk=100)
+    >>> print(np.allclose(vp, xp + yp))
+    True
+
+    """
+    gridder = KNearestGridder(_area(x, y, area), shape, k=k, radius=radius,
+                              workers=workers)
+    for chunk in _chunks(x, y, v, chunk):
+        gridder.add(*chunk)
+    return gridder.x, gridder.y, gridder.idw(power)
+
+
+def nearest_average(x, y, v, shape, area=None, k=8, radius=None, workers=1,
+                    chunk=None):
+    """
+    Grid data by averaging the nearest data points.
+
+    Uses a :class:`~fatiando.gridder.KNearestGridder`.
+
+    Parameters:
+
+    * x, y : 1D arrays
+        Arrays with the x and y coordinates of the data points.
+    * v : 1D array
+        Array with the scalar value assigned to the data points.
+    * shape : tuple = (nx, ny)
+        Shape of the regular grid, ie (nx, ny).
+    * area : tuple = (x1, x2, y1, y2)
+        The are where the data will be gridded. If None, then will get the
+        area from *x* and *y*.
+    * k : int
+        The number of nearest data points averaged for each grid point
+    * radius : None or float
+        Only use data points closer than this to a grid point. If None, will
+        use all data points.
+    * workers : int
+        Number of threads used to search the KD-tree. ``-1`` uses all cores.
+    * chunk : None or int
+        Process the data in chunks of this many points (useful for
+        :class:`numpy.memmap` arrays). If None, will use all at once.
+
+    Returns:
+
+    * ``[x, y, v]``
+        Three 1D arrays with the gridded x, y, and v
+
+    """
+    gridder = KNearestGridder(_area(x, y, area), shape, k=k, radius=radius,
+                              workers=workers)
+    for chunk in _chunks(x, y, v, chunk):
+        gridder.add(*chunk)
+    return gridder.x, gridder.y, gridder.average()
+
+
+def block_median(x, y, v, shape, area=None, chunk=None):
+    """
+    Grid data by taking the median of the data around each grid point.
+
+    Each grid point is the center of a block with the size of the grid
+    spacing. Uses a :class:`~fatiando.gridder.BlockMedianGridder`.
+
+    Parameters:
+
+    * x, y : 1D arrays
+        Arrays with the x and y coordinates of the data points.
+    * v : 1D array
+        Array with the scalar value assigned to the data points.
+    * shape : tuple = (nx, ny)
+        Shape of the regular grid, ie (nx, ny).
+    * area : tuple = (x1, x2, y1, y2)
+        The are where the data will be gridded. If None, then will get the
+        area from *x* and *y*.
+    * chunk : None or int
+        Process the data in chunks of this many points (useful for
+        :class:`numpy.memmap` arrays). If None, will use all at once.
+
+    Returns:
+
+    * ``[x, y, v]``
+        Three 1D arrays with the gridded x, y, and v. Blocks without data are
+        NaN.
+
+    Examples:
+
+    >>> import numpy as np
+    >>> x = np.array([0., 0.1, -0.2, 1., 1.2, 0.9, 0.1, 2.])
+    >>> y = np.array([0., 0.2, 0.1, 0., 0.1, -0.1, 1., 1.])
+    >>> v = np.array([1., 2., 10., 4., 6., 5., 7., 8.])
+    >>> xp, yp, vp = block_median(x, y, v, (3, 2), area=(0, 2, 0, 1))
+    >>> vp.tolist()
+    [2.0, 7.0, 5.0, nan, nan, 8.0]
+
+    """
+    gridder = BlockMedianGridder(_area(x, y, area), shape)
+    for chunk in _chunks(x, y, v, chunk):
+        gridder.add(*chunk)
+    return gridder.x, gridder.y, gridder.median()
+
+
+def _area(x, y, area):
+    "Get the area from the data if it's not given"
+    if area is None:
+        area = (np.min(x), np.max(x), np.min(y), np.max(y))
+    return area
+
+
+def _chunks(x, y, v, chunk):
+    "Iterate over chunks of the data"
+    size = np.size(v)
+    if chunk is None:
+        chunk = max(size, 1)
+    for i in range(0, size, chunk):
+        yield (np.asarray(x[i:i + chunk]), np.asarray(y[i:i + chunk]),
+               np.asarray(v[i:i + chunk]))
+
+
+def _block_index(coordinate, start, spacing):
+    "Index of the block around the grid points containing each coordinate"
+    return np.floor((coordinate - start)/spacing + 0.5).astype(np.int64)
+
+
+def _query(tree, points, k, upper, workers):
+    "Query the KD-tree using several threads (older scipy uses n_jobs)"
+    try:
+        return tree.query(points, k=k, distance_upper_bound=upper,
+                          workers=workers)
+    except TypeError:
+        return tree.query(points, k=k, distance_upper_bound=upper,
+                          n_jobs=workers)
@@ -1,13 +1,162 @@
 """
 2D interpolation, griding, and profile extraction.
+
+The functions below build a new triangulation of the data points every time
+they are called. To interpolate several data sets recorded at the same points
+(e.g., all the components of the gravity gradient tensor), use an
+:class:`~fatiando.gridder.Interpolator`, which triangulates the data points
+only once.
 """
 from __future__ import division, absolute_import, print_function
 import numpy as np
 import scipy.interpolate
+import scipy.sparse
+import scipy.spatial
 
 from .point_generation import regular
 
 
+class Interpolator(object):
+    """
+    Interpolate many data sets recorded on the same points.
+
+    The Delaunay triangulation of the data points and the location of the
+    interpolation points in it are calculated only once, when the
+    interpolator is created. For the ``'linear'`` and ``'nearest'``
+    algorithms, the interpolation is stored as a sparse matrix of weights
+    (the barycentric coordinates of the points in their triangles) and
+    interpolating a data set is a sparse matrix-vector product. The
+    ``'cubic'`` algorithm (Clough-Tocher, see
+    ``scipy.interpolate.CloughTocher2DInterpolator``) reuses the
+    triangulation.
+
+    Parameters:
+
+    * x, y : 1D arrays
+        Arrays with the x and y coordinates of the data points.
+    * xp, yp : 1D arrays
+        Points where the data values will be interpolated
+    * algorithm : string
+        Interpolation algorithm. Either ``'cubic'``, ``'nearest'``,
+        ``'linear'`` (see scipy.interpolate.griddata)
+    * extrapolate : True or False
+        If True, will extrapolate values outside of the convex hull of the data
+        points using the nearest data point.
+
+    Examples:
+
+    >>> import numpy as np
+    >>> x = np.array([0., 1., 0., 1.])
+    >>> y = np.array([0., 0., 1., 1.])
+    >>> xp = np.array([0.5, 0.25, 2.])
+    >>> yp = np.array([0.5, 0.25, 2.])
+    >>> interpolator = Interpolator(x, y, xp, yp, algorithm='linear')
+    >>> interpolator(x + y).tolist()
+    [1.0, 0.5, nan]
+    >>> gz, gzz = interpolator([x + y, 2*x])
+    >>> gzz.tolist()
+    [1.0, 0.5, nan]
+    >>> interpolator = Interpolator(x, y, xp, yp, algorithm='linear',
+    ...                             extrapolate=True)
+    >>> interpolator(x + y).tolist()
+    [1.0, 0.5, 2.0]
+
+    """
+
+    def __init__(self, x, y, xp, yp, algorithm='cubic', extrapolate=False):
+        assert algorithm in ['cubic', 'linear', 'nearest'], \
+            "Invalid interpolation algorithm '{}'".format(algorithm)
+        self.algorithm = algorithm
+        self.extrapolate = extrapolate
+        self.ndata = np.size(x)
+        self.size = np.size(xp)
+        points = np.transpose([np.ravel(x), np.ravel(y)]).astype(np.float64)
+        targets = np.transpose([np.ravel(xp), np.ravel(yp)]).astype(np.float64)
+        rows = np.arange(self.size)
+        if algorithm == 'nearest':
+            self.triangulation = None
+            self.outside = np.zeros(self.size, dtype=bool)
+            self._fill = None
+            self.weights = scipy.sparse.csr_matrix(
+                (np.ones(self.size), (rows, _nearest(points, targets))),
+                shape=(self.size, self.ndata))
+            return
+        self.triangulation = scipy.spatial.Delaunay(points)
+        self.targets = targets
+        simplex = self.triangulation.find_simplex(targets)
+        self.outside = simplex == -1
+        # The closest data point to the points outside of the convex hull
+        self._fill = None
+        if np.any(self.outside):
+            self._fill = _nearest(points, targets[self.outside])
+        self.weights = None
+        if algorithm == 'linear':
+            inside = ~self.outside
+            transform = self.triangulation.transform[simplex[inside]]
+            bary = np.einsum('ijk,ik->ij', transform[:, :2],
+                             targets[inside] - transform[:, 2])
+            bary = np.hstack([bary, 1 - bary.sum(axis=1, keepdims=True)])
+            vertices = self.triangulation.simplices[simplex[inside]]
+            rows = np.repeat(rows[inside], 3)
+            cols = vertices.ravel()
+            values = bary.ravel()
+            if extrapolate and self._fill is not None:
+                rows = np.append(rows, np.nonzero(self.outside)[0])
+                cols = np.append(cols, self._fill)
+                values = np.append(values, np.ones(self._fill.size))
+            self.weights = scipy.sparse.csr_matrix(
+                (values, (rows, cols)), shape=(self.size, self.ndata))
+
+    def __call__(self, v):
+        """
+        Interpolate the data values.
+
+        Parameters:
+
+        * v : 1D array, 2D array or list of 1D arrays
+            The data values at the data points. If a 2D array (one data set
+            per row) or a list is given, all the data sets are interpolated
+            at once.
+
+        Returns:
+
+        * vp : 1D array, 2D array or list of 1D arrays
+            The interpolated values. A 2D array (one row per data set) or a
+            list if *v* is one.
+
+        """
+        ndim = np.ndim(v)
+        assert ndim in [1, 2], \
+            "Invalid data values with {} dimensions".format(ndim)
+        size = np.shape(v)[-1]
+        assert size == self.ndata, \
+            "Need {} data values but got {}".format(self.ndata, size)
+        values = np.transpose(np.reshape(v, (-1, self.ndata)))
+        if self.weights is not None:
+            result = np.asarray(self.weights.dot(values))
+        else:
+            interpolator = scipy.interpolate.CloughTocher2DInterpolator(
+                self.triangulation, values)
+            result = interpolator(self.targets)
+        if self._fill is not None:
+            if self.extrapolate:
+                result[self.outside] = values[self._fill]
+            else:
+                result[self.outside] = np.nan
+        if ndim == 1:
+            return result[:, 0]
+        if isinstance(v, (list, tuple)):
+            return list(result.T)
+        return result.T
+
+
+def _nearest(points, targets):
+    """
+    Index of the data point closest to each target point.
+    """
+    return scipy.spatial.cKDTree(points).query(targets)[1]
+
+
 def fill_nans(x, y, v, xp, yp, vp):
     """"
     Fill in the NaNs or masked values on interpolated points using nearest
@@ -37,22 +186,24 @@ def fill_nans(x, y, v, xp, yp, vp):
         nans = vp.mask
     else:
         nans = np.isnan(vp)
-    vp[nans] = scipy.interpolate.griddata((x, y), v, (xp[nans], yp[nans]),
-                                          method='nearest').ravel()
+    vp[nans] = Interpolator(x, y, xp[nans], yp[nans], algorithm='nearest')(v)
 
 
 def interp_at(x, y, v, xp, yp, algorithm='cubic', extrapolate=False):
     """
     Interpolate spacial data onto specified points.
 
-    Wraps ``scipy.interpolate.griddata``.
+    Uses an :class:`~fatiando.gridder.Interpolator`. Use one directly to
+    interpolate several data sets on the same points.
 
     Parameters:
 
     * x, y : 1D arrays
         Arrays with the x and y coordinates of the data points.
-    * v : 1D array
-        Array with the scalar value assigned to the data points.
+    * v : 1D array, 2D array or list of 1D arrays
+        Array with the scalar value assigned to the data points. If a 2D array
+        (one data set per row) or a list is given, all data sets are
+        interpolated using the same triangulation.
     * xp, yp : 1D arrays
         Points where the data values will be interpolated
     * algorithm : string
@@ -64,15 +215,14 @@ def interp_at(x, y, v, xp, yp, algorithm='cubic', extrapolate=False):
 
     Returns:
 
-    * v : 1D array
-        1D array with the interpolated v values.
+    * v : 1D array, 2D array or list of 1D arrays
+        1D array with the interpolated v values (a 2D array or list if *v* is
+        one).
 
     """
-    vp = scipy.interpolate.griddata((x, y), v, (xp, yp),
-                                    method=algorithm).ravel()
-    if extrapolate and algorithm != 'nearest' and np.any(np.isnan(vp)):
-        fill_nans(x, y, v, xp, yp, vp)
-    return vp
+    interpolator = Interpolator(x, y, xp, yp, algorithm=algorithm,
+                                extrapolate=extrapolate)
+    return interpolator(v)
 
 
 def interp(x, y, v, shape, area=None, algorithm='cubic', extrapolate=False):
@@ -87,8 +237,10 @@ def interp(x, y, v, shape, area=None, algorithm='cubic', extrapolate=False):
 
     * x, y : 1D arrays
         Arrays with the x and y coordinates of the data points.
-    * v : 1D array
-        Array with the scalar value assigned to the data points.
+    * v : 1D array, 2D array or list of 1D arrays
+        Array with the scalar value assigned to the data points. If a 2D array
+        (one data set per row) or a list is given, all data sets are
+        interpolated using the same triangulation.
     * shape : tuple = (nx, ny)
         Shape of the interpolated regular grid, ie (nx, ny).
     * area : tuple = (x1, x2, y1, y2)
@@ -104,7 +256,8 @@ def interp(x, y, v, shape, area=None, algorithm='cubic', extrapolate=False):
     Returns:
 
     * ``[x, y, v]``
-        Three 1D arrays with the interpolated x, y, and v
+        Three 1D arrays with the interpolated x, y, and v (*v* is a 2D array
+        or list if several data sets are given)
 
     """
     if area is None:
@@ -126,8 +279,10 @@ def profile(x, y, v, point1, point2, size, algorithm='cubic'):
 
     * x, y : 1D arrays
         Arrays with the x and y coordinates of the data points.
-    * v : 1D array
-        Array with the scalar value assigned to the data points.
+    * v : 1D array, 2D array or list of 1D arrays
+        Array with the scalar value assigned to the data points. If a 2D array
+        (one data set per row) or a list is given, all data sets are
+        interpolated using the same triangulation.
     * point1, point2 : lists = [x, y]
         Lists the x, y coordinates of the 2 points between which the profile
         will be extracted.
@@ -142,7 +297,8 @@ def profile(x, y, v, point1, point2, size, algorithm='cubic'):
     * [xp, yp, distances, vp] : 1d arrays
         ``xp`` and ``yp`` are the x, y coordinates of the points along the
         profile. ``distances`` are the distances of the profile points from
-        ``point1``. ``vp`` are the data points along the profile.
+        ``point1``. ``vp`` are the data points along the profile (a 2D array
+        or list if several data sets are given).
 
     """
     x1, y1 = point1
@@ -0,0 +1,68 @@
+from __future__ import division, absolute_import, print_function
+import numpy.testing as npt
+import numpy as np
+
+from ... import gridder
+
+
+def test_idw_matches_brute_force():
+    "idw and nearest_average give the same as a brute force search"
+    x, y = gridder.scatter([0, 10, 0, 10], n=500, seed=0)
+    data = np.sin(x)*np.cos(y)
+    shape, k = (15, 12), 6
+    xp, yp, idw = gridder.idw(x, y, data, shape, power=2, k=k, chunk=70)
+    xp, yp, mean = gridder.nearest_average(x, y, data, shape, k=k, chunk=70)
+    distance = np.sqrt((xp[:, None] - x)**2 + (yp[:, None] - y)**2)
+    nearest = np.argsort(distance, axis=1)[:, :k]
+    rows = np.arange(xp.size)[:, None]
+    weights = distance[rows, nearest]**-2
+    npt.assert_allclose(idw, np.sum(weights*data[nearest], axis=1) /
+                        np.sum(weights, axis=1))
+    npt.assert_allclose(mean, data[nearest].mean(axis=1))
+    xpt, ypt = gridder.regular((x.min(), x.max(), y.min(), y.max()), shape)
+    npt.assert_allclose(xp, xpt)
+    npt.assert_allclose(yp, ypt)
+
+
+def test_nearest_average_radius():
+    "Grid points without data inside the search radius are NaN"
+    x = np.array([0., 0.1, 9.9])
+    y = np.array([0., 0., 10.])
+    xp, yp, v = gridder.nearest_average(x, y, np.array([1., 3., 5.]),
+                                        (3, 3), area=(0, 10, 0, 10), k=4,
+                                        radius=1, chunk=1)
+    npt.assert_allclose(v[[0, -1]], [2, 5])
+    assert np.all(np.isnan(v[1:-1]))
+
+
+def test_block_median_memmap(tmpdir):
+    "block_median in chunks of a memmap gives the median in each block"
+    x, y = gridder.scatter([0, 10, 0, 10], n=5000, seed=1)
+    data = np.random.RandomState(0).normal(size=x.size)
+    shape = (6, 11)
+    area = (0, 10, 0, 10)
+    stored = np.memmap(str(tmpdir.join('data.bin')), dtype=np.float64,
+                       mode='w+', shape=(3, x.size))
+    stored[:] = [x, y, data]
+    xp, yp, median = gridder.block_median(stored[0], stored[1], stored[2],
+                                          shape, area=area, chunk=777)
+    dx, dy = gridder.spacing(area, shape)
+    for i in range(xp.size):
+        inside = ((np.abs(x - xp[i]) < 0.5*dx) &
+                  (np.abs(y - yp[i]) < 0.5*dy))
+        npt.assert_allclose(median[i], np.median(data[inside]))
+
+
+def test_block_median_single_row():
+    "A grid with one row uses the other spacing and ignores points outside"
+    x = np.array([1., 0.9, 1.1, 1000., 1.6, 0.7])
+    y = np.array([0., 0.4, 1., 0., 0.4, 0.6])
+    v = np.array([3., 5., 7., 1e6, 8., 9.])
+    xp, yp, median = gridder.block_median(x, y, v, (1, 3),
+                                          area=(1, 1, 0, 1))
+    npt.assert_allclose(xp, [1, 1, 1])
+    npt.assert_allclose(yp, [0, 0.5, 1])
+    npt.assert_allclose(median, [3, 5, 7])
+    xp, yp, median = gridder.block_median(y, x, v, (3, 1),
+                                          area=(0, 1, 1, 1))
+    npt.assert_allclose(median, [3, 5, 7])
@@ -1,6 +1,8 @@
 from __future__ import division, absolute_import, print_function
 import numpy.testing as npt
 import numpy as np
+import scipy.interpolate
+from pytest import raises
 
 from ... import gridder
 from ..interpolation import fill_nans
@@ -130,3 +132,56 @@ def test_profile():
         npt.assert_almost_equal(yp, np.zeros_like(yp) - 25)
         npt.assert_allclose(xp, np.linspace(area[0], area[1], shape[0]))
         npt.assert_allclose(datap, makedata(xp, yp))
+
+
+def test_interpolator_matches_griddata():
+    "Interpolator gives the same results as scipy's griddata"
+    x, y = gridder.scatter([0, 10, 0, 10], n=1000, seed=0)
+    xp, yp = gridder.regular([-1, 11, -1, 11], (30, 30))
+    data = [np.sin(x)*np.cos(y), x*y]
+    for algorithm in ['linear', 'cubic', 'nearest']:
+        interpolator = gridder.Interpolator(x, y, xp, yp,
+                                            algorithm=algorithm)
+        interpolated = interpolator(data)
+        assert len(interpolated) == 2
+        for v, vp in zip(data, interpolated):
+            true = scipy.interpolate.griddata((x, y), v, (xp, yp),
+                                              method=algorithm)
+            npt.assert_allclose(vp, true, atol=1e-10)
+            npt.assert_allclose(interpolator(v), true, atol=1e-10)
+
+
+def test_interpolator_extrapolate():
+    "Interpolator fills the points outside of the data with nearest neighbors"
+    x, y = gridder.scatter([0, 10, 0, 10], n=1000, seed=0)
+    xp, yp = gridder.regular([-1, 11, -1, 11], (30, 30))
+    data = np.sin(x)*np.cos(y)
+    nearest = scipy.interpolate.griddata((x, y), data, (xp, yp),
+                                         method='nearest')
+    for algorithm in ['linear', 'cubic']:
+        interpolator = gridder.Interpolator(x, y, xp, yp, extrapolate=True,
+                                            algorithm=algorithm)
+        datap = interpolator(data)
+        assert np.any(interpolator.outside)
+        assert not np.any(np.isnan(datap))
+        npt.assert_allclose(datap[interpolator.outside],
+                            nearest[interpolator.outside])
+
+
+def test_interpolator_2d_array():
+    "Interpolator interpolates every row of a 2D array of data values"
+    x, y = gridder.scatter([0, 10, 0, 10], n=500, seed=0)
+    xp, yp = gridder.regular([-1, 11, -1, 11], (20, 20))
+    data = np.array([np.sin(x)*np.cos(y), x*y, x + y])
+    for extrapolate in [False, True]:
+        interpolator = gridder.Interpolator(x, y, xp, yp,
+                                            extrapolate=extrapolate)
+        interpolated = interpolator(data)
+        assert interpolated.shape == (3, xp.size)
+        for v, vp in zip(data, interpolated):
+            npt.assert_allclose(vp, interpolator(v))
+    # The number of data values must match the number of points
+    with raises(AssertionError):
+        interpolator(np.concatenate([data[0], data[1]]))
+    with raises(AssertionError):
+        interpolator(data[:, :-1])
@@ -18,8 +18,11 @@ Modules
 * :mod:`~fatiando.inversion.regularization`: Classes for common regularizing
   functions and base classes for building new ones.
 * :mod:`~fatiando.inversion.hyper_param`: Classes hyper parameter optimization
-  (estimating the regularization parameter), like L-curve analysis and (in the
-  future) cross-validation.
+  (estimating the regularization parameter), like L-curve analysis,
+  generalized cross-validation, and the discrepancy principle.
+* :mod:`~fatiando.inversion.compression`: Compressed representations of large
+  Jacobian matrices (e.g., in the wavelet domain) that can be used with the
+  iterative solvers.
 * :mod:`~fatiando.inversion.optimization`: Functions for several optimization
   methods (used internally by :class:`~fatiando.inversion.misfit.Misfit`).
   In most cases you won't need to touch this.
@@ -348,4 +351,5 @@ from __future__ import absolute_import
 from .misfit import Misfit
 from .regularization import Damping, Smoothness, Smoothness1D, Smoothness2D, \
     TotalVariation, TotalVariation1D, TotalVariation2D
-from .hyper_param import LCurve
+from .hyper_param import LCurve, GCV, DiscrepancyPrinciple
+from .compression import WaveletCompressed
@@ -21,11 +21,15 @@ This module defines base classes that are used by the rest of the
   ``MultiObjective`` and fitting the model to the data.
 * :class:`~fatiando.inversion.base.CachedMethod`: A class that wraps a method
   and caches the returned value. When the same argument (an array) is passed
-  twice in a row, the class returns the cached value instead of recomputing.
+  again, the class returns the cached value instead of recomputing. Keeps a
+  bounded number of values (least recently used are discarded first).
 * :class:`~fatiando.inversion.base.CachedMethodPermanent`: Like
   ``CachedMethod`` but always returns the cached value, regardless of the
   input. Effectively calculates only the first time the method is called.
   Useful for caching the Jacobian matrix in a linear problem.
+* :class:`~fatiando.inversion.base.ApproximateJacobian`: Like
+  ``CachedMethod`` but reuses or updates (Broyden's method) the Jacobian
+  matrix of a non-linear problem instead of recomputing it every iteration.
 
 ----
 
@@ -35,9 +39,14 @@ from future.utils import with_metaclass
 from future.builtins import super, object, range, isinstance, zip, map
 import hashlib
 import copy
+from collections import OrderedDict, namedtuple
+from timeit import default_timer
 from abc import ABCMeta, abstractmethod
 import numpy as np
+import scipy.sparse
+from scipy.sparse.linalg import LinearOperator
 
+from ..utils import safe_dot, LinearOperatorSum
 from . import optimization
 
 
@@ -163,8 +172,9 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
         Parameters:
 
         * method : string
-            The optimization method. One of: ``'linear'``, ``'newton'``,
-            ``'levmarq'``, ``'steepest'``, ``'acor'``
+            The optimization method. One of: ``'linear'``, ``'cg'``,
+            ``'lsqr'``, ``'minres'``, ``'newton'``, ``'levmarq'``,
+            ``'steepest'``, ``'acor'``
 
         Other keyword arguments that can be passed are the ones allowed by each
         method.
@@ -179,6 +189,9 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
         See the corresponding docstrings for more information:
 
         * :meth:`~fatiando.inversion.optimization.linear`
+        * :meth:`~fatiando.inversion.optimization.cg`
+        * :meth:`~fatiando.inversion.optimization.lsqr`
+        * :meth:`~fatiando.inversion.optimization.minres`
         * :meth:`~fatiando.inversion.optimization.newton`
         * :meth:`~fatiando.inversion.optimization.levmarq`
         * :meth:`~fatiando.inversion.optimization.steepest`
@@ -186,7 +199,8 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
 
         """
         kwargs = copy.deepcopy(kwargs)
-        assert method in ['linear', 'newton', 'levmarq', 'steepest', 'acor'], \
+        assert method in ['linear', 'cg', 'lsqr', 'minres', 'newton',
+                          'levmarq', 'steepest', 'acor'], \
             "Invalid optimization method '{}'".format(method)
         if method in ['newton', 'levmarq', 'steepest']:
             assert 'initial' in kwargs, \
@@ -200,7 +214,7 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
         self.fit_args = kwargs
         return self
 
-    def fit(self):
+    def fit(self, callback=None):
         """
         Solve for the parameter vector that minimizes this objective function.
 
@@ -212,6 +226,17 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
         manageable type) of the estimate can be accessed through the property
         ``estimate_``.
 
+        Information about where the time was spent is stored in the
+        ``profile_`` attribute (see
+        :meth:`~fatiando.inversion.base.OptimizerMixin.profile_report`).
+
+        Parameters:
+
+        * callback : function or None
+            If not None, will be called after every iteration with the
+            iteration number, the current estimate and the optimization
+            statistics so far (``callback(i, p, stats)``).
+
         """
         not_configured = (getattr(self, 'fit_method', None) is None or
                           getattr(self, 'fit_args', None) is None)
@@ -220,24 +245,259 @@ class OptimizerMixin(with_metaclass(ABCMeta)):
                 self.config('linear')
             else:
                 self.config('levmarq', initial=np.ones(self.nparams))
+        start = default_timer()
+        # Calls to the timed functions can be nested (the Jacobian is
+        # calculated inside the gradient, for example). The stack keeps the
+        # time of the nested calls so that each phase has only its own time.
+        stack = []
+        phases = dict((name, _Timed(getattr(self, name), stack))
+                      for name in ['value', 'gradient', 'hessian']
+                      if hasattr(self, name))
+        instrumented = self._instrument(stack)
+        try:
+            p, stats = self._run(phases, callback)
+        finally:
+            for obj, name, original, _ in instrumented:
+                if original is None:
+                    del obj.__dict__[name]
+                else:
+                    obj.__dict__[name] = original
+        total = default_timer() - start
+        self.p_ = p
+        self.stats_ = stats
+        profile = dict(total=total, phases={}, cache=self._cache_stats())
+        for name, phase in phases.items():
+            profile['phases'][name] = dict(calls=phase.calls,
+                                           time=phase.time)
+        for name in ['predicted', 'jacobian']:
+            timers = [timer for _, method, _, timer in instrumented
+                      if method == name]
+            if timers:
+                profile['phases'][name] = dict(
+                    calls=sum(timer.calls for timer in timers),
+                    time=sum(timer.time for timer in timers))
+        profile['phases']['solve'] = dict(
+            calls=stats.get('iterations', 1),
+            time=total - sum(phase['time']
+                             for phase in profile['phases'].values()))
+        self.profile_ = profile
+        return self
+
+    def _run(self, phases, callback):
+        """
+        Run the configured optimization method to the end.
+
+        Returns the final estimate and statistics.
+        """
         optimizer = getattr(optimization, self.fit_method)
         # Make the generators from the optimization function
-        if self.fit_method == 'linear':
-            solver = optimizer(self.hessian(None), self.gradient(None),
-                               **self.fit_args)
+        if self.fit_method == 'lsqr':
+            system = self._least_squares()
+            if system is None:
+                # Solve the normal equations in the least-squares sense
+                system = (phases['hessian'](None), -phases['gradient'](None))
+            solver = optimizer(*system, **self.fit_args)
+        elif self.fit_method in ['linear', 'cg', 'minres']:
+            solver = optimizer(phases['hessian'](None),
+                               phases['gradient'](None), **self.fit_args)
         elif self.fit_method in ['newton', 'levmarq']:
-            solver = optimizer(self.hessian, self.gradient, self.value,
+            solver = optimizer(phases['hessian'], phases['gradient'],
+                               phases['value'],
+                               refresh=self._refresh_jacobian,
                                **self.fit_args)
         elif self.fit_method == 'steepest':
-            solver = optimizer(self.gradient, self.value, **self.fit_args)
+            solver = optimizer(phases['gradient'], phases['value'],
+                               **self.fit_args)
         elif self.fit_method == 'acor':
-            solver = optimizer(self.value, **self.fit_args)
+            solver = optimizer(phases['value'], **self.fit_args)
         # Run the optimizer to the end
         for i, p, stats in solver:
-            continue
-        self.p_ = p
-        self.stats_ = stats
-        return self
+            if callback is not None:
+                callback(i, p, stats)
+        return p, stats
+
+    def _instrument(self, stack):
+        """
+        Time the ``predicted`` and ``jacobian`` methods during ``fit``.
+
+        Replaces the methods of this objective (or of its components) by
+        timed versions that share the *stack* of the other phases.
+
+        Returns:
+
+        * instrumented : list
+            ``(obj, name, original, timer)`` for each replaced method.
+            *original* is the previous value in the ``__dict__`` of *obj*
+            (None if the method came from the class) and *timer* the
+            :class:`~fatiando.inversion.base._Timed` that replaced it.
+
+        """
+        if isinstance(self, MultiObjective):
+            objects = list(self._components)
+        else:
+            objects = [self]
+        instrumented = []
+        for obj in objects:
+            for name in ['predicted', 'jacobian']:
+                method = getattr(obj, name, None)
+                if method is None or not hasattr(obj, '__dict__'):
+                    continue
+                original = obj.__dict__.get(name, None)
+                timer = _Timed(method, stack)
+                obj.__dict__[name] = timer
+                instrumented.append((obj, name, original, timer))
+        return instrumented
+
+    def _least_squares(self):
+        """
+        The matrix and vector of the equivalent linear least-squares system.
+
+        Returns None if the objective function can't be written as the squared
+        norm of a linear system (see
+        :meth:`fatiando.inversion.misfit.Misfit._least_squares`).
+        """
+        return None
+
+    def _cache_stats(self):
+        """
+        Get the usage statistics of the cached methods.
+
+        Returns:
+
+        * stats : dict
+            The ``hits``, ``misses``, ``time`` spent calculating (in seconds)
+            and memory used (``nbytes``) by each cached method (``predicted``,
+            ``jacobian``, and ``hessian``).
+
+        """
+        stats = {}
+        for name in ['predicted', 'jacobian', 'hessian']:
+            method = getattr(self, name, None)
+            if (isinstance(method, CachedMethod) or
+                    isinstance(method, CachedMethodPermanent)):
+                stats[name] = method.cache_stats()
+        return stats
+
+    def profile_report(self):
+        """
+        Format the profiling information of the last call to ``fit``.
+
+        The ``profile_`` attribute is a dictionary with keys:
+
+        * ``'total'``: the total time spent in ``fit`` (in seconds).
+        * ``'phases'``: the number of ``calls`` and ``time`` spent in each
+          part of the inversion. The ``predicted`` data and ``jacobian``
+          phases are the calls to these methods of the data misfits (cache
+          hits included). The ``value``, ``gradient``, and ``hessian`` phases
+          are the time spent in these methods minus the time spent in
+          ``predicted`` and ``jacobian`` (so the ``hessian`` phase is the
+          assembly of the Hessian matrix). The ``solve`` phase is the rest of
+          the time, spent by the optimization method itself (mostly solving
+          the linear systems). Its calls are the number of iterations.
+        * ``'cache'``: the ``hits``, ``misses``, ``time`` and memory
+          (``nbytes``) of the cached methods (``predicted``, ``jacobian``,
+          ``hessian``). These are counted since the creation of the cache,
+          not only in the last ``fit``. For a
+          :class:`~fatiando.inversion.base.MultiObjective`, the statistics
+          are given for each component (by its index).
+
+        Calls made in other processes (like the parallel evaluations of
+        :func:`~fatiando.inversion.optimization.acor`) are not counted.
+
+        Returns:
+
+        * report : str
+            A table with the information in ``profile_``.
+
+        Examples:
+
+        >>> import numpy as np
+        >>> from fatiando.inversion import Misfit, Damping
+        >>> class Line(Misfit):
+        ...     def __init__(self, x, data):
+        ...         super().__init__(data=data, nparams=2, islinear=True)
+        ...         self.x = x
+        ...     def predicted(self, p):
+        ...         return self.jacobian(p).dot(p)
+        ...     def jacobian(self, p):
+        ...         return np.transpose([self.x, np.ones_like(self.x)])
+        >>> x = np.linspace(0, 1, 10)
+        >>> solver = (Line(x, 2*x + 1) + 1e-10*Damping(2)).fit()
+        >>> sorted(solver.profile_)
+        ['cache', 'phases', 'total']
+        >>> sorted(solver.profile_['phases'])
+        ['gradient', 'hessian', 'jacobian', 'predicted', 'solve', 'value']
+        >>> solver.profile_['phases']['hessian']['calls']
+        1
+        >>> solver.profile_['phases']['jacobian']['calls']
+        2
+        >>> jacobian = solver.profile_['cache'][0]['jacobian']
+        >>> jacobian['hits'], jacobian['misses'], jacobian['nbytes']
+        (1, 1, 160)
+        >>> print(solver.profile_report()) # doctest: +SKIP
+        Total time: 0.000369 s
+        Phase                    Calls    Time (s)
+        predicted                    0           0
+        jacobian                     2    2.91e-05
+        value                        0           0
+        gradient                     1    3.27e-05
+        hessian                      1    0.000112
+        solve                        1    0.000175
+        Cache                     Hits    Misses    Time (s)   Memory (MB)
+        0.hessian                    0         1    0.000105       3.2e-05
+        0.jacobian                   1         1    1.05e-05       0.00016
+        0.predicted                  0         0           0             0
+        1.hessian                    0         1    6.68e-06       0.00016
+
+        Use a callback to follow the optimization as it runs:
+
+        >>> def show(i, p, stats):
+        ...     print('{} {:.1f} {:.1f}'.format(i, p[0], p[1]))
+        >>> _ = solver.config('newton', initial=[0, 0]).fit(callback=show)
+        0 2.0 1.0
+        1 2.0 1.0
+
+        """
+        assert getattr(self, 'profile_', None) is not None, \
+            "No profiling information found. Run 'fit' first."
+        profile = self.profile_
+        lines = ['Total time: {:.3g} s'.format(profile['total']),
+                 '{:<20}{:>10}{:>12}'.format('Phase', 'Calls', 'Time (s)')]
+        for name in ['predicted', 'jacobian', 'value', 'gradient', 'hessian',
+                     'solve']:
+            if name in profile['phases']:
+                phase = profile['phases'][name]
+                lines.append('{:<20}{:>10}{:>12.3g}'.format(
+                    name, phase['calls'], phase['time']))
+        lines.append('{:<20}{:>10}{:>10}{:>12}{:>14}'.format(
+            'Cache', 'Hits', 'Misses', 'Time (s)', 'Memory (MB)'))
+        for name, cache in sorted(_flatten_cache_stats(profile['cache'])):
+            lines.append('{:<20}{:>10}{:>10}{:>12.3g}{:>14.3g}'.format(
+                name, cache['hits'], cache['misses'], cache['time'],
+                cache['nbytes']/1e6))
+        return '\n'.join(lines)
+
+    def _refresh_jacobian(self):
+        """
+        Make the next call to ``jacobian`` calculate the exact Jacobian.
+
+        Only has an effect if the Jacobian is being approximated (see
+        :class:`~fatiando.inversion.base.ApproximateJacobian`). Used by the
+        optimization methods when a step is rejected.
+
+        Returns:
+
+        * refreshed : True or False
+            Whether the Jacobian will change.
+
+        """
+        jacobian = getattr(self, 'jacobian', None)
+        if isinstance(jacobian, _Timed):
+            # Being profiled by fit
+            jacobian = jacobian.function
+        if isinstance(jacobian, ApproximateJacobian):
+            return jacobian.refresh()
+        return False
 
     def fmt_estimate(self, p):
         """
@@ -386,8 +646,8 @@ class MultiObjective(OptimizerMixin, OperatorMixin):
             self.islinear = False
         self._i = 0  # Tracker for indexing
 
-    def fit(self):
-        super().fit()
+    def fit(self, callback=None):
+        super().fit(callback=callback)
         for obj in self:
             obj.p_ = self.p_
         return self
@@ -405,6 +665,46 @@ class MultiObjective(OptimizerMixin, OperatorMixin):
 
     config.__doc__ = OptimizerMixin.config.__doc__
 
+    def _refresh_jacobian(self):
+        refreshed = [obj._refresh_jacobian() for obj in self
+                     if hasattr(obj, '_refresh_jacobian')]
+        return any(refreshed)
+
+    _refresh_jacobian.__doc__ = OptimizerMixin._refresh_jacobian.__doc__
+
+    def _least_squares(self):
+        if not self.islinear:
+            return None
+        matrices, vectors = [], []
+        for obj in self:
+            if getattr(obj, '_least_squares', None) is None:
+                return None
+            system = obj._least_squares()
+            if system is None:
+                return None
+            matrices.extend(system[0])
+            vectors.extend(system[1])
+        if self.regul_param != 1:
+            scale = np.sqrt(self.regul_param)
+            matrices = [scale*m for m in matrices]
+            vectors = [scale*v for v in vectors]
+        return matrices, vectors
+
+    _least_squares.__doc__ = OptimizerMixin._least_squares.__doc__
+
+    def _cache_stats(self):
+        stats = {}
+        for i, obj in enumerate(self):
+            if hasattr(obj, '_cache_stats'):
+                stats[i] = obj._cache_stats()
+            elif isinstance(getattr(obj, 'hessian', None),
+                            CachedMethodPermanent):
+                # Linear regularization
+                stats[i] = dict(hessian=obj.hessian.cache_stats())
+        return stats
+
+    _cache_stats.__doc__ = OptimizerMixin._cache_stats.__doc__
+
     def _unpack_components(self, args):
         """
         Find all the MultiObjective elements in components and unpack them into
@@ -489,7 +789,17 @@ class MultiObjective(OptimizerMixin, OperatorMixin):
             The sum of the gradients of the components.
 
         """
-        return self.regul_param*sum(obj.gradient(p) for obj in self)
+        gradients = [obj.gradient(p) for obj in self]
+        if all(np.ndim(g) == 0 for g in gradients):
+            return self.regul_param*sum(gradients)
+        # Accumulate in place to avoid a temporary array per component
+        gradient = np.zeros(self.nparams, dtype=np.result_type(
+            np.float64, *[np.asarray(g).dtype for g in gradients]))
+        for grad in gradients:
+            gradient += np.asarray(grad).ravel()
+        if self.regul_param != 1:
+            gradient *= self.regul_param
+        return gradient
 
     def hessian(self, p):
         """
@@ -505,11 +815,98 @@ class MultiObjective(OptimizerMixin, OperatorMixin):
 
         Returns:
 
-        * result : 2d-array
-            The sum of the hessians of the components.
+        * result : 2d-array, sparse matrix or LinearOperator
+            The sum of the hessians of the components. If any of the
+            components returns a :class:`scipy.sparse.linalg.LinearOperator`,
+            the sum will also be a ``LinearOperator``. If all components are
+            sparse matrices, the sum will also be sparse.
+
+        Each call returns a new matrix. The sum is accumulated in place into
+        this matrix to avoid a temporary array per component. Sums of sparse
+        matrices reuse the sparsity structure calculated in the previous call
+        if the structure of the components hasn't changed (only the non-zero
+        values are added).
+
+        """
+        hessians = [obj.hessian(p) for obj in self]
+        if any(isinstance(h, LinearOperator) for h in hessians):
+            return LinearOperatorSum(hessians, self.regul_param)
+        if all(scipy.sparse.issparse(h) for h in hessians):
+            hessian = self._sparse_sum(hessians)
+        elif any(np.ndim(h) != 2 for h in hessians):
+            return self.regul_param*sum(hessians)
+        else:
+            dense = [np.asarray(h) for h in hessians
+                     if not scipy.sparse.issparse(h)]
+            sparse = [h for h in hessians if scipy.sparse.issparse(h)]
+            dtype = np.result_type(np.float64, *[h.dtype for h in hessians])
+            hessian = np.array(dense[0], dtype=dtype)
+            for hess in dense[1:]:
+                hessian += hess
+            for hess in sparse:
+                # Add only the non-zero elements instead of making a dense
+                # copy
+                hess = scipy.sparse.coo_matrix(hess)
+                hess.sum_duplicates()
+                hessian[hess.row, hess.col] += hess.data
+        if self.regul_param != 1:
+            hessian *= self.regul_param
+        return hessian
+
+    def _sparse_sum(self, matrices):
+        """
+        Sum sparse matrices into a new CSR matrix.
 
+        The sparsity structure of the sum and the position of the elements of
+        each matrix in it are kept in ``_sparse_structure``. They are reused
+        while the matrices have the same structure (the case for most
+        problems), so only the non-zero values need to be added.
         """
-        return self.regul_param*sum(obj.hessian(p) for obj in self)
+        matrices = [scipy.sparse.csr_matrix(m) for m in matrices]
+        shape = matrices[0].shape
+        structure = getattr(self, '_sparse_structure', None)
+        same = (structure is not None and
+                len(structure.terms) == len(matrices) and
+                structure.shape == shape and
+                all(np.array_equal(m.indptr, indptr) and
+                    np.array_equal(m.indices, indices)
+                    for m, (indptr, indices) in zip(matrices,
+                                                    structure.terms)))
+        if not same:
+            keys = [_sparse_keys(m) for m in matrices]
+            union = np.unique(np.concatenate(keys))
+            rows = union//shape[1]
+            indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum(np.bincount(rows, minlength=shape[0]))
+            structure = _SparseStructure(
+                shape=shape, indptr=indptr, indices=union % shape[1],
+                positions=[np.searchsorted(union, k) for k in keys],
+                terms=[(m.indptr.copy(), m.indices.copy()) for m in matrices])
+            self._sparse_structure = structure
+        dtype = np.result_type(np.float64, *[m.dtype for m in matrices])
+        data = np.zeros(structure.indices.size, dtype=dtype)
+        for matrix, positions in zip(matrices, structure.positions):
+            if matrix.has_canonical_format:
+                data[positions] += matrix.data
+            else:
+                # Duplicate elements have the same position
+                np.add.at(data, positions, matrix.data)
+        return scipy.sparse.csr_matrix(
+            (data, structure.indices, structure.indptr), shape=shape)
+
+
+_SparseStructure = namedtuple('_SparseStructure',
+                              ['shape', 'indptr', 'indices', 'positions',
+                               'terms'])
+
+
+def _sparse_keys(matrix):
+    """
+    The linear index (row*ncols + column) of each element of a CSR matrix.
+    """
+    rows = np.repeat(np.arange(matrix.shape[0], dtype=np.int64),
+                     np.diff(matrix.indptr))
+    return rows*matrix.shape[1] + matrix.indices
 
 
 class CachedMethod(object):
@@ -517,12 +914,24 @@ class CachedMethod(object):
     Wrap a method to cache it's output based on the hash of the input array.
 
     Store the output of calling the method on a numpy array. If the method is
-    called in succession with the same input array, the cached result will be
-    returned. If the method is called on a different array, the old result will
-    be discarded and the new one stored.
+    called again with the same input array, the cached result will be
+    returned. If the method is called on a different array, the new result
+    will be stored as well. When the cache is full, the least recently used
+    results are discarded.
+
+    By default, only the last result is kept (``maxsize=1``). Increase
+    *maxsize* when the optimization goes back and forth between a few
+    parameter vectors (like the rejected steps of
+    :func:`~fatiando.inversion.optimization.levmarq`). Use *maxbytes* to cap
+    the memory used by the cached results (e.g., when caching a large
+    Jacobian matrix). The most recent result is always kept, even if it
+    alone exceeds *maxbytes*.
 
     Uses SHA1 hashes of the input array to tell if it is the same array.
 
+    The ``hits`` and ``misses`` attributes count how many calls were served
+    from the cache and how many had to run the method.
+
     .. note::
 
         We need the object instance and method name instead of the bound method
@@ -536,6 +945,12 @@ class CachedMethod(object):
         The instance of the object that has the method you want to cache.
     * meth : string
         The name of the method you want to cache.
+    * maxsize : int or None
+        The maximum number of results to keep. If None, will not limit the
+        number of results.
+    * maxbytes : int or None
+        The maximum memory (in bytes) used by the cached results. If None, will
+        not limit the memory.
 
     Examples:
 
@@ -570,35 +985,200 @@ class CachedMethod(object):
     >>> cached.my_method(np.arange(0, 6))
     array([ 0,  1,  4,  9, 16, 25])
 
+    Keep more than one result and check how well the cache is doing:
+
+    >>> class MyClass(object):
+    ...     def __init__(self):
+    ...         self.my_method = CachedMethod(self, 'my_method', maxsize=2)
+    ...     def my_method(self, p):
+    ...         return p**2
+    >>> obj = MyClass()
+    >>> a = obj.my_method(np.arange(0, 5))
+    >>> b = obj.my_method(np.arange(0, 6))
+    >>> a is obj.my_method(np.arange(0, 5))
+    True
+    >>> c = obj.my_method(np.arange(0, 7))
+    >>> b is obj.my_method(np.arange(0, 6))
+    False
+    >>> print(obj.my_method.cache_info())
+    CacheInfo(hits=1, misses=4, maxsize=2, currsize=2, nbytes=104)
+    >>> obj.my_method.evict(np.arange(0, 7))
+    >>> print(obj.my_method.cache_info())
+    CacheInfo(hits=1, misses=4, maxsize=2, currsize=1, nbytes=48)
+
     """
 
-    def __init__(self, instance, meth):
-        self.array_hash = None
-        self.cache = None
+    def __init__(self, instance, meth, maxsize=1, maxbytes=None):
+        self.cache = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.time = 0
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
         self.instance = instance
         self.meth = meth
         method = getattr(self.instance.__class__, self.meth)
         setattr(self, '__doc__', getattr(method, '__doc__'))
 
+    def __copy__(self):
+        # The copies can't share the same dictionary or calling one would
+        # change the cache of the other.
+        obj = self.__class__.__new__(self.__class__)
+        obj.__dict__.update(self.__dict__)
+        obj.cache = OrderedDict(self.cache)
+        return obj
+
     def hard_reset(self):
         """
         Delete the cached values.
         """
-        self.cache = None
-        self.array_hash = None
+        self.cache = OrderedDict()
+        self.nbytes = 0
+
+    def evict(self, p=None):
+        """
+        Delete the cached value of a given parameter vector.
+
+        Parameters:
+
+        * p : 1d-array or None
+            The parameter vector. If None, will delete the least recently used
+            value instead.
+
+        """
+        if not self.cache:
+            return
+        if p is None:
+            _, value = self.cache.popitem(last=False)
+        else:
+            p_hash = hashlib.sha1(p).hexdigest()
+            if p_hash not in self.cache:
+                return
+            value = self.cache.pop(p_hash)
+        self.nbytes -= _nbytes(value)
+
+    def cache_info(self):
+        """
+        Get statistics about the cache usage.
+
+        Returns:
+
+        * info : namedtuple
+            With the number of ``hits`` and ``misses``, the ``maxsize``, the
+            current number of cached values (``currsize``), and the memory
+            used by them in bytes (``nbytes``).
+
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self.cache), self.nbytes)
+
+    def cache_stats(self):
+        """
+        Get the number of hits and misses, the time spent running the method
+        (in seconds) and the memory used by the cache (in bytes).
+
+        Returns:
+
+        * stats : dict
+            With keys ``hits``, ``misses``, ``time``, and ``nbytes``.
+
+        """
+        return dict(hits=self.hits, misses=self.misses, time=self.time,
+                    nbytes=self.nbytes)
 
     def __call__(self, p=None):
         if p is None:
             p = getattr(self.instance, 'p_')
         p_hash = hashlib.sha1(p).hexdigest()
-        if self.cache is None or self.array_hash != p_hash:
-            # Update the cache
-            self.array_hash = p_hash
-            # Get the method from the class because the instance will overwrite
-            # it with the CachedMethod instance.
-            method = getattr(self.instance.__class__, self.meth)
-            self.cache = method(self.instance, p)
-        return self.cache
+        if p_hash in self.cache:
+            self.hits += 1
+            # Move to the end to mark it as the most recently used
+            value = self.cache.pop(p_hash)
+            self.cache[p_hash] = value
+            return value
+        self.misses += 1
+        # Get the method from the class because the instance will overwrite
+        # it with the CachedMethod instance.
+        method = getattr(self.instance.__class__, self.meth)
+        start = default_timer()
+        value = method(self.instance, p)
+        self.time += default_timer() - start
+        self.cache[p_hash] = value
+        self.nbytes += _nbytes(value)
+        while len(self.cache) > 1 and (
+                (self.maxsize is not None and
+                    len(self.cache) > self.maxsize) or
+                (self.maxbytes is not None and
+                    self.nbytes > self.maxbytes)):
+            self.evict()
+        return value
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize nbytes')
+
+
+class _Timed(object):
+    """
+    Wrap a function to count the number of calls and the time spent in them.
+
+    Timers that share a *stack* don't count the time of nested calls to each
+    other. So if the function calls another timed function, that time is
+    counted only by the inner timer.
+
+    A class instead of a closure so that it can be pickled (e.g., for the
+    parallel evaluations in ACO-R).
+    """
+
+    def __init__(self, function, stack=None):
+        self.function = function
+        self.calls = 0
+        self.time = 0
+        if stack is None:
+            stack = []
+        self.stack = stack
+
+    def __call__(self, *args, **kwargs):
+        start = default_timer()
+        # Time spent in nested timed calls
+        self.stack.append(0)
+        try:
+            result = self.function(*args, **kwargs)
+        finally:
+            nested = self.stack.pop()
+            elapsed = default_timer() - start
+            self.time += elapsed - nested
+            if self.stack:
+                self.stack[-1] += elapsed
+        self.calls += 1
+        return result
+
+
+def _flatten_cache_stats(stats, prefix=''):
+    """
+    Convert the (possibly nested) cache statistics of ``profile_`` into a
+    list of ``(name, stats)``.
+    """
+    flat = []
+    for key, value in stats.items():
+        name = '{}{}'.format(prefix, key)
+        if 'hits' in value:
+            flat.append((name, value))
+        else:
+            flat.extend(_flatten_cache_stats(value, prefix=name + '.'))
+    return flat
+
+
+def _nbytes(value):
+    """
+    Estimate the memory used by a cached value (arrays and sparse matrices).
+    """
+    if scipy.sparse.issparse(value):
+        return sum(getattr(value, attr).nbytes
+                   for attr in ['data', 'indices', 'indptr', 'row', 'col',
+                                'offsets']
+                   if hasattr(value, attr))
+    return getattr(value, 'nbytes', 0)
 
 
 class CachedMethodPermanent(object):
@@ -658,6 +1238,9 @@ class CachedMethodPermanent(object):
     """
     def __init__(self, instance, meth):
         self.cache = None
+        self.hits = 0
+        self.misses = 0
+        self.time = 0
         self.instance = instance
         self.meth = meth
 
@@ -667,8 +1250,192 @@ class CachedMethodPermanent(object):
         """
         self.cache = None
 
+    def cache_stats(self):
+        """
+        Get the number of hits and misses, the time spent running the method
+        (in seconds) and the memory used by the cache (in bytes).
+
+        Returns:
+
+        * stats : dict
+            With keys ``hits``, ``misses``, ``time``, and ``nbytes``.
+
+        """
+        return dict(hits=self.hits, misses=self.misses, time=self.time,
+                    nbytes=_nbytes(self.cache))
+
     def __call__(self, p=None):
         if self.cache is None:
+            self.misses += 1
             method = getattr(self.instance.__class__, self.meth)
+            start = default_timer()
             self.cache = method(self.instance, p)
+            self.time += default_timer() - start
+        else:
+            self.hits += 1
         return self.cache
+
+
+class ApproximateJacobian(CachedMethod):
+    r"""
+    Wrap the ``jacobian`` method to avoid recomputing it at every iteration.
+
+    The exact Jacobian is calculated on the first call. On calls with a
+    different parameter vector, the previous Jacobian is either reused as is
+    (``method='reuse'``) or updated with the rank-one formula of Broyden
+    (1965) (``method='broyden'``):
+
+    .. math::
+
+        \bar{\bar{J}}^{k+1} = \bar{\bar{J}}^k +
+        \frac{(\Delta\bar{d} - \bar{\bar{J}}^k\Delta\bar{p})\Delta\bar{p}^T}
+             {\Delta\bar{p}^T\Delta\bar{p}}
+
+    in which :math:`\Delta\bar{p}` is the change in the parameter vector and
+    :math:`\Delta\bar{d}` is the corresponding change in the predicted data.
+    The Broyden update only needs the predicted data, which are usually
+    cached from the evaluation of the objective function.
+
+    The exact Jacobian is calculated again every *refresh* parameter vectors
+    or after calling ``refresh`` (the optimization methods do this when a
+    step is rejected).
+
+    The ``misses`` attribute counts the number of exact Jacobians calculated
+    and ``updates`` the number of approximations used in their place.
+    Broyden updates always produce a dense Jacobian matrix.
+
+    Parameters:
+
+    * instance : object
+        The instance of the object that has the ``jacobian`` method (a
+        :class:`~fatiando.inversion.misfit.Misfit`).
+    * meth : string
+        The name of the method (usually ``'jacobian'``).
+    * method : string
+        ``'reuse'`` or ``'broyden'``.
+    * refresh : int or None
+        Calculate the exact Jacobian at least every *refresh* parameter
+        vectors. If None, will only do so when ``refresh`` is called.
+    * maxsize, maxbytes : int or None
+        The cache settings of :class:`~fatiando.inversion.base.CachedMethod`.
+        Only the last Jacobian is kept while approximating, but these are
+        kept so that the cache can be restored with the same settings (see
+        :meth:`~fatiando.inversion.misfit.Misfit.set_jacobian_update`).
+
+    References:
+
+    Broyden, C. G. (1965), A class of methods for solving nonlinear
+    simultaneous equations, Mathematics of Computation, 19(92), 577-593,
+    doi:10.1090/S0025-5718-1965-0198670-6.
+
+    Examples:
+
+    >>> import numpy as np
+    >>> class MyClass(object):
+    ...     def __init__(self, method):
+    ...         self.jacobian = ApproximateJacobian(self, 'jacobian',
+    ...                                             method=method, refresh=3)
+    ...     def predicted(self, p):
+    ...         return np.array([p[0]**2, p[0]*p[1]])
+    ...     def jacobian(self, p):
+    ...         return np.array([[2*p[0], 0], [p[1], p[0]]])
+    >>> obj = MyClass('reuse')
+    >>> obj.jacobian(np.array([1., 1.])).tolist()
+    [[2.0, 0.0], [1.0, 1.0]]
+    >>> obj.jacobian(np.array([1., 2.])).tolist()
+    [[2.0, 0.0], [1.0, 1.0]]
+    >>> obj.jacobian.refresh()
+    True
+    >>> obj.jacobian(np.array([1., 2.])).tolist()
+    [[2.0, 0.0], [2.0, 1.0]]
+    >>> obj.jacobian.misses, obj.jacobian.updates
+    (2, 1)
+
+    The Broyden update reproduces the change in the predicted data:
+
+    >>> obj = MyClass('broyden')
+    >>> p1, p2 = np.array([1., 1.]), np.array([1.5, 2.])
+    >>> jac = obj.jacobian(p1)
+    >>> jac = obj.jacobian(p2)
+    >>> np.allclose(jac.dot(p2 - p1), obj.predicted(p2) - obj.predicted(p1))
+    True
+
+    """
+
+    def __init__(self, instance, meth, method='broyden', refresh=None,
+                 maxsize=1, maxbytes=None):
+        assert method in ['reuse', 'broyden'], \
+            "Invalid Jacobian update method '{}'".format(method)
+        super().__init__(instance, meth, maxsize=maxsize, maxbytes=maxbytes)
+        self.method = method
+        self.refresh_every = refresh
+        self.updates = 0
+        self.hard_reset()
+
+    def hard_reset(self):
+        """
+        Delete the cached values.
+        """
+        super().hard_reset()
+        self.p = None
+        self.jac = None
+        self.pred = None
+        self.exact = False
+        self.nupdates = 0
+
+    def cache_stats(self):
+        stats = super().cache_stats()
+        stats['nbytes'] = _nbytes(self.jac)
+        return stats
+
+    cache_stats.__doc__ = CachedMethod.cache_stats.__doc__
+
+    def refresh(self):
+        """
+        Force the calculation of the exact Jacobian on the next call.
+
+        Returns:
+
+        * refreshed : True or False
+            False if the current Jacobian is already the exact one (nothing
+            would change), True otherwise.
+
+        """
+        if self.jac is None or self.exact:
+            return False
+        self.hard_reset()
+        return True
+
+    def __call__(self, p=None):
+        if p is None:
+            p = getattr(self.instance, 'p_')
+        if self.p is not None and np.array_equal(self.p, p):
+            self.hits += 1
+            return self.jac
+        if self.jac is not None and (self.refresh_every is None or
+                                     self.nupdates < self.refresh_every):
+            if self.method == 'broyden':
+                pred = self.instance.predicted(p)
+                dp = p - self.p
+                jac = self.jac
+                if scipy.sparse.issparse(jac):
+                    jac = jac.toarray()
+                change = pred - self.pred - safe_dot(jac, dp)
+                self.jac = jac + np.outer(change, dp)/dp.dot(dp)
+                self.pred = pred
+            self.p = np.array(p, dtype=np.float64)
+            self.exact = False
+            self.nupdates += 1
+            self.updates += 1
+            return self.jac
+        self.misses += 1
+        method = getattr(self.instance.__class__, self.meth)
+        start = default_timer()
+        self.jac = method(self.instance, p)
+        self.time += default_timer() - start
+        self.p = np.array(p, dtype=np.float64)
+        if self.method == 'broyden':
+            self.pred = self.instance.predicted(p)
+        self.exact = True
+        self.nupdates = 0
+        return self.jac
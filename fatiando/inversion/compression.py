@@ -0,0 +1,237 @@
+r"""
+Compressed representations of sensitivity (Jacobian) matrices.
+
+The Jacobians of potential-field problems (e.g., a 3D mesh of prisms) are
+dense and have ``ndata x nparams`` elements. Storing them is often the memory
+ceiling of an inversion. But each row of the Jacobian is a smooth function of
+the position of the parameters in the mesh and can be represented by a few
+wavelet coefficients (Li and Oldenburg, 2003).
+
+* :class:`~fatiando.inversion.compression.WaveletCompressed`: A
+  :class:`scipy.sparse.linalg.LinearOperator` that stores the Jacobian as a
+  sparse matrix of wavelet coefficients. Can be returned by the ``jacobian``
+  method of a :class:`~fatiando.inversion.misfit.Misfit` and used with the
+  iterative solvers (e.g., ``config('cg')``).
+
+**References**
+
+Li, Y., and D. W. Oldenburg (2003), Fast inversion of large-scale magnetic
+data using wavelet transforms and a logarithmic barrier method, Geophysical
+Journal International, 152(2), 251-265, doi:10.1046/j.1365-246X.2003.01766.x.
+
+----
+
+"""
+from __future__ import division, absolute_import
+from future.builtins import super, range, zip
+import numpy
+import scipy.sparse
+from scipy.sparse.linalg import LinearOperator
+
+
+class WaveletCompressed(LinearOperator):
+    r"""
+    A Jacobian matrix compressed in the wavelet domain.
+
+    Each row of the Jacobian is transformed with an orthonormal
+    (multi-dimensional) Haar wavelet transform :math:`\bar{\bar{W}}` over the
+    mesh of parameters. The smallest coefficients are discarded, keeping
+    enough so that the norm of the error in each row is at most *tol* times
+    the norm of the row. The remaining coefficients are stored in a sparse
+    matrix :math:`\bar{\bar{S}} \approx \bar{\bar{J}}\bar{\bar{W}}^T`, so
+    that:
+
+    .. math::
+
+        \bar{\bar{J}}\bar{p} \approx \bar{\bar{S}}\bar{\bar{W}}\bar{p}
+        \qquad
+        \bar{\bar{J}}^T\bar{d} \approx \bar{\bar{W}}^T\bar{\bar{S}}^T\bar{d}
+
+    Both products cost a sparse matrix-vector product plus a wavelet
+    transform. Mesh dimensions that are not powers of 2 are padded with zeros.
+
+    The Jacobian can be given in blocks of rows, so that the full dense
+    matrix never has to be in memory at once.
+
+    Parameters:
+
+    * jacobian : 2d-array or iterable of 2d-arrays
+        The Jacobian matrix or an iterable (e.g., a generator) of consecutive
+        blocks of rows.
+    * shape : tuple of ints
+        The shape of the mesh of parameters (e.g., ``mesh.shape``). The
+        number of parameters must be the product of *shape*. The parameters
+        are assumed to be ordered like ``numpy.ravel`` of an array with this
+        shape.
+    * tol : float
+        The maximum relative error allowed in each row of the Jacobian.
+
+    Examples:
+
+    Compress the sensitivity of points on a plane to a 3D grid of point
+    masses:
+
+    >>> import numpy as np
+    >>> shape = (8, 16, 16)
+    >>> z, y, x = [i.ravel() for i in np.meshgrid(
+    ...     np.linspace(100, 800, 8), np.linspace(0, 1500, 16),
+    ...     np.linspace(0, 1500, 16), indexing='ij')]
+    >>> xp, yp = [i.ravel() for i in np.meshgrid(np.linspace(0, 1500, 20),
+    ...                                          np.linspace(0, 1500, 20))]
+    >>> dist = np.sqrt((xp[:, None] - x)**2 + (yp[:, None] - y)**2 + z**2)
+    >>> jacobian = z/dist**3
+    >>> compressed = WaveletCompressed(jacobian, shape, tol=0.01)
+    >>> compressed.shape
+    (400, 2048)
+    >>> print('{:.2f}'.format(compressed.compression))
+    0.26
+    >>> p = np.random.RandomState(0).uniform(size=2048)
+    >>> error = np.linalg.norm(compressed.matvec(p) - jacobian.dot(p))
+    >>> print(error/np.linalg.norm(jacobian.dot(p)) < 0.01)
+    True
+    >>> d = np.ones(400)
+    >>> error = np.linalg.norm(compressed.rmatvec(d) - jacobian.T.dot(d))
+    >>> print(error/np.linalg.norm(jacobian.T.dot(d)) < 0.01)
+    True
+
+    The Jacobian can also be given in blocks of rows:
+
+    >>> blocks = (jacobian[i:i + 100] for i in range(0, 400, 100))
+    >>> compressed = WaveletCompressed(blocks, shape, tol=0.01)
+    >>> compressed.shape
+    (400, 2048)
+    >>> error = np.linalg.norm(compressed.matvec(p) - jacobian.dot(p))
+    >>> print(error/np.linalg.norm(jacobian.dot(p)) < 0.01)
+    True
+
+    """
+
+    def __init__(self, jacobian, shape, tol=1e-3):
+        self.mesh_shape = tuple(shape)
+        self.tol = tol
+        nparams = int(numpy.prod(self.mesh_shape))
+        # Pad each dimension to a power of 2 so that the transform can go
+        # all the way down to a single coefficient.
+        self.padded_shape = tuple(int(2**numpy.ceil(numpy.log2(max(n, 1))))
+                                  for n in self.mesh_shape)
+        if isinstance(jacobian, numpy.ndarray):
+            jacobian = [jacobian]
+        data, indices, indptr = [], [], [numpy.zeros(1, dtype=numpy.int64)]
+        for block in jacobian:
+            block = numpy.atleast_2d(block)
+            assert block.shape[1] == nparams, \
+                "Jacobian with {} columns for a mesh with {} cells".format(
+                    block.shape[1], nparams)
+            coefs = self._forward(block)
+            keep = _largest(coefs, tol)
+            rows, cols = numpy.nonzero(keep)
+            data.append(coefs[rows, cols])
+            indices.append(cols)
+            counts = numpy.bincount(rows, minlength=block.shape[0])
+            indptr.append(indptr[-1][-1] + numpy.cumsum(counts))
+        assert data, "The Jacobian must have at least one row"
+        indptr = numpy.concatenate(indptr)
+        ndata = indptr.size - 1
+        self.coefs = scipy.sparse.csr_matrix(
+            (numpy.concatenate(data), numpy.concatenate(indices), indptr),
+            shape=(ndata, int(numpy.prod(self.padded_shape))))
+        super().__init__(dtype=self.coefs.dtype, shape=(ndata, nparams))
+
+    @property
+    def compression(self):
+        """
+        The fraction of the elements of the dense Jacobian that are stored.
+        """
+        return self.coefs.nnz/(self.shape[0]*self.shape[1])
+
+    @property
+    def nbytes(self):
+        """
+        The memory used by the compressed matrix (in bytes).
+        """
+        return (self.coefs.data.nbytes + self.coefs.indices.nbytes +
+                self.coefs.indptr.nbytes)
+
+    def _forward(self, rows):
+        """
+        Wavelet transform of the rows of a matrix.
+        """
+        nrows = rows.shape[0]
+        array = numpy.zeros((nrows,) + self.padded_shape, dtype=numpy.float64)
+        index = (slice(None),) + tuple(slice(0, n) for n in self.mesh_shape)
+        array[index] = rows.reshape((nrows,) + self.mesh_shape)
+        for axis in range(1, array.ndim):
+            array = _haar(array, axis)
+        return array.reshape((nrows, -1))
+
+    def _inverse(self, coefs):
+        """
+        Inverse wavelet transform of the rows of a matrix of coefficients.
+        """
+        nrows = coefs.shape[0]
+        array = coefs.reshape((nrows,) + self.padded_shape)
+        for axis in range(1, array.ndim):
+            array = _ihaar(array, axis)
+        index = (slice(None),) + tuple(slice(0, n) for n in self.mesh_shape)
+        return array[index].reshape((nrows, -1))
+
+    def _matvec(self, vector):
+        vector = numpy.asarray(vector, dtype=numpy.float64).ravel()
+        return self.coefs.dot(self._forward(vector[numpy.newaxis, :])[0])
+
+    def _rmatvec(self, vector):
+        vector = numpy.asarray(vector, dtype=numpy.float64).ravel()
+        return self._inverse(self.coefs.T.dot(vector)[numpy.newaxis, :])[0]
+
+    def _matmat(self, matrix):
+        matrix = numpy.asarray(matrix, dtype=numpy.float64)
+        return self.coefs.dot(self._forward(matrix.T).T)
+
+
+def _largest(coefs, tol):
+    """
+    Mask of the largest coefficients in each row so that the norm of the ones
+    left out is at most *tol* times the norm of the row.
+    """
+    energy = coefs**2
+    ordered = numpy.sort(energy, axis=1)
+    cumulative = numpy.cumsum(ordered, axis=1)
+    threshold = (tol**2)*cumulative[:, -1:]
+    # Number of coefficients that can be left out of each row
+    ndrop = numpy.sum(cumulative <= threshold, axis=1)
+    ndrop = numpy.minimum(ndrop, energy.shape[1] - 1)
+    smallest = ordered[numpy.arange(energy.shape[0]), ndrop]
+    return (energy >= smallest[:, numpy.newaxis]) & (energy > 0)
+
+
+def _haar(array, axis):
+    """
+    Multi-level orthonormal Haar transform along an axis (of size 2**n).
+
+    The approximation coefficients of each level are stored in the first half
+    of the current range and the details in the second half.
+    """
+    array = numpy.swapaxes(array, axis, -1).copy()
+    size = array.shape[-1]
+    while size > 1:
+        even, odd = array[..., 0:size:2], array[..., 1:size:2]
+        approx, detail = (even + odd)/numpy.sqrt(2), (even - odd)/numpy.sqrt(2)
+        array[..., :size//2] = approx
+        array[..., size//2:size] = detail
+        size //= 2
+    return numpy.swapaxes(array, axis, -1)
+
+
+def _ihaar(array, axis):
+    """
+    Inverse of :func:`_haar`.
+    """
+    array = numpy.swapaxes(array, axis, -1).copy()
+    size = 2
+    while size <= array.shape[-1]:
+        approx = array[..., :size//2].copy()
+        detail = array[..., size//2:size].copy()
+        array[..., 0:size:2] = (approx + detail)/numpy.sqrt(2)
+        array[..., 1:size:2] = (approx - detail)/numpy.sqrt(2)
+        size *= 2
+    return numpy.swapaxes(array, axis, -1)
@@ -12,17 +12,32 @@ Available classes:
 
 * :class:`~fatiando.inversion.hyper_param.LCurve`: Estimate the regularizing
   parameter using an L-curve analysis.
+* :class:`~fatiando.inversion.hyper_param.GCV`: Estimate the regularizing
+  parameter using Generalized Cross-Validation (with randomized trace
+  estimation).
+* :class:`~fatiando.inversion.hyper_param.DiscrepancyPrinciple`: Estimate the
+  regularizing parameter that fits the data to within the noise level.
 
 ----
 
 """
 from __future__ import division, absolute_import
-from future.builtins import range
+from future.builtins import range, zip, super
 import multiprocessing
 import numpy
+import scipy.linalg
+import scipy.sparse
+from scipy.sparse.linalg import LinearOperator
 
 from ..vis import mpl
+from ..utils import safe_dot
 from .base import OptimizerMixin
+from . import optimization
+
+# Sparse Hessians with more parameters than this aren't converted to dense
+# matrices to be factorized by LCurve (the solutions are calculated
+# separately instead)
+_MAX_DENSE_PARAMS = 5000
 
 
 class LCurve(OptimizerMixin):
@@ -171,6 +186,22 @@ class LCurve(OptimizerMixin):
            [  4.,   4.,   4.,   4.,   4.,   4.,   4.,   4.,   4.,   4.],
            [  4.,   4.,   4.,   4.,   4.,   4.,   4.,   4.,   4.,   4.]])
 
+    For linear problems (linear data misfit and regularization) solved with
+    the default ``'linear'`` method, ``LCurve`` doesn't run a separate
+    inversion for each regularization parameter. Instead, it computes a
+    single generalized eigendecomposition of the pair of Hessian matrices
+    (data misfit and regularization) and obtains every point on the curve
+    from it. This costs about as much as one inversion plus a matrix-vector
+    product per parameter. The ``njobs`` argument is not needed in this case.
+    The optimization information reflects this:
+
+    >>> tomo.stats_['method']
+    'Generalized eigendecomposition'
+
+    Non-linear problems, other optimization methods, or Hessians given as
+    :class:`scipy.sparse.linalg.LinearOperator` fall back to running one
+    inversion per regularization parameter.
+
     ``LCurve`` also has a ``config`` method to configure the optimization
     process for non-linear problems, for example:
 
@@ -266,7 +297,7 @@ class LCurve(OptimizerMixin):
     def __getitem__(self, i):
         return self.objective_[i]
 
-    def fit(self):
+    def fit(self, callback=None):
         """
         Solve for the parameter vector and optimum regularization parameter.
 
@@ -280,6 +311,22 @@ class LCurve(OptimizerMixin):
         The regularization parameter for this corner point if stored in the
         ``regul_param_`` attribute.
 
+        If the data misfit and regularization are linear and the optimization
+        method is ``'linear'`` (the default), all solutions are calculated
+        from a single generalized eigendecomposition of the Hessian matrices
+        instead. This isn't done if the Hessians are LinearOperators, if they
+        are large sparse matrices (that would take too much memory as dense
+        matrices), or if either Hessian is null.
+
+        Parameters:
+
+        * callback : function or None
+            If not None, will be called for each regularization parameter
+            with its index, the estimate and the optimization statistics
+            (``callback(i, p, stats)``). When the inversions are run
+            separately (and not in parallel), it's called as soon as each
+            one finishes. Otherwise, after all are solved.
+
         Returns:
 
         * self
@@ -292,13 +339,20 @@ class LCurve(OptimizerMixin):
         if self.fit_method is not None:
             for solver in solvers:
                 solver.config(self.fit_method, **self.fit_args)
-        if self.njobs > 1:
+        results = None
+        factorize = (self.datamisfit.islinear and self.regul.islinear and
+                     self.fit_method in [None, 'linear'])
+        if factorize:
+            results = self._fit_factorized(solvers)
+        if results is None and self.njobs > 1:
             pool = multiprocessing.Pool(self.njobs)
             results = pool.map(_fit_solver, solvers)
             pool.close()
             pool.join()
+        if results is None:
+            results = _fit_all(solvers, callback)
         else:
-            results = [s.fit() for s in solvers]
+            _report(results, callback)
         self.objectives = results
         self.dnorm = numpy.array(
             [self.datamisfit.value(s.p_) for s in results])
@@ -306,6 +360,73 @@ class LCurve(OptimizerMixin):
         self.select_corner()
         return self
 
+    def _fit_factorized(self, solvers):
+        r"""
+        Solve the linear problems for all regularization parameters at once.
+
+        Uses the generalized eigendecomposition of the data-misfit Hessian
+        :math:`\bar{\bar{H}}_d` and the (scaled) sum
+        :math:`\bar{\bar{B}} = \bar{\bar{H}}_d + s\bar{\bar{H}}_r`:
+
+        .. math::
+
+            \bar{\bar{H}}_d\bar{\bar{V}} =
+            \bar{\bar{B}}\bar{\bar{V}}\bar{\bar{\Lambda}}
+            \qquad
+            \bar{\bar{V}}^T\bar{\bar{B}}\bar{\bar{V}} = \bar{\bar{I}}
+
+        so that :math:`(\bar{\bar{H}}_d + \mu\bar{\bar{H}}_r)^{-1} =
+        \bar{\bar{V}} [\bar{\bar{\Lambda}} + (\mu/s)(\bar{\bar{I}} -
+        \bar{\bar{\Lambda}})]^{-1} \bar{\bar{V}}^T` is diagonal in the
+        same basis for any :math:`\mu`. The scale factor :math:`s` balances
+        the two Hessians.
+
+        Sets ``p_`` and ``stats_`` of the solvers and returns them. Returns
+        None if the Hessians are not matrices, if they are sparse and too
+        large to be converted to dense matrices (more than
+        ``_MAX_DENSE_PARAMS`` parameters), if either is null, or if the
+        problem doesn't have a unique solution.
+        """
+        hess_data = self.datamisfit.hessian(None)
+        hess_regul = self.regul.hessian(None)
+        if (isinstance(hess_data, LinearOperator) or
+                isinstance(hess_regul, LinearOperator)):
+            return None
+        sparse = (scipy.sparse.issparse(hess_data) or
+                  scipy.sparse.issparse(hess_regul))
+        if sparse and hess_data.shape[0] > _MAX_DENSE_PARAMS:
+            return None
+        hess_data, hess_regul = [
+            h.toarray() if scipy.sparse.issparse(h) else numpy.asarray(h)
+            for h in [hess_data, hess_regul]]
+        nparams = hess_data.shape[0]
+        # The regularizing gradient is 0 (scalar) for p = None
+        grad_data = numpy.zeros(nparams) + self.datamisfit.gradient(None)
+        grad_regul = numpy.zeros(nparams) + self.regul.gradient(None)
+        traces = numpy.trace(hess_data), numpy.trace(hess_regul)
+        # Can't balance the Hessians if either is null (the trace of a
+        # positive semi-definite matrix is 0 only if the matrix is)
+        if not (numpy.all(numpy.isfinite(traces)) and min(traces) > 0):
+            return None
+        scale = traces[0]/traces[1]
+        try:
+            eigvals, eigvecs = scipy.linalg.eigh(
+                hess_data, hess_data + scale*hess_regul)
+        except (numpy.linalg.LinAlgError, ValueError):
+            return None
+        eigvals = numpy.clip(eigvals, 0, 1)
+        grad_data = eigvecs.T.dot(grad_data)
+        grad_regul = eigvecs.T.dot(grad_regul)
+        for solver, mu in zip(solvers, self.regul_params):
+            ratio = mu/scale
+            p = -eigvecs.dot((grad_data + mu*grad_regul) /
+                             (eigvals + ratio*(1 - eigvals)))
+            solver.p_ = p
+            for obj in solver:
+                obj.p_ = p
+            solver.stats_ = dict(method='Generalized eigendecomposition')
+        return solvers
+
     def _scale_curve(self):
         """
         Puts the data-misfit and regularizing function values in the range
@@ -414,8 +535,594 @@ class LCurve(OptimizerMixin):
         mpl.ylabel('Regularization')
 
 
+class _RegulParamSelector(OptimizerMixin):
+    """
+    Base class for selecting the regularization parameter from a score.
+
+    Runs the inversion for each regularization parameter and keeps the one
+    with the best score (calculated by the ``_score`` method of the child
+    classes). Linear problems are solved with the Conjugate Gradient method
+    by default (see :func:`~fatiando.inversion.optimization.cg`) so that only
+    products with the Hessian are needed.
+    """
+
+    def __init__(self, datamisfit, regul, regul_params, tol, maxit):
+        self.regul_params = regul_params
+        self.datamisfit = datamisfit
+        self.regul = regul
+        self.tol = tol
+        self.maxit = maxit
+        self.objectives = None
+        self.fit_method = None
+        self.fit_args = None
+        self.best_ = None
+
+    def _run_fit_first(self):
+        """
+        Check if a solution was found by running fit.
+        Will raise an ``AssertionError`` if not.
+        """
+        assert self.best_ is not None, \
+            'No optimal solution found. Run "fit" first.'
+
+    @property
+    def regul_param_(self):
+        """
+        The regularization parameter corresponding to the best estimate.
+        """
+        self._run_fit_first()
+        return self.regul_params[self.best_]
+
+    @property
+    def objective_(self):
+        """
+        The objective function corresponding to the best estimate.
+        """
+        self._run_fit_first()
+        return self.objectives[self.best_]
+
+    @property
+    def stats_(self):
+        """
+        The optimization information for the best solution found.
+        """
+        return self.objective_.stats_
+
+    @property
+    def p_(self):
+        """
+        The estimated parameter vector obtained from the best regularization
+        parameter.
+        """
+        return self.objective_.p_
+
+    def fmt_estimate(self, p):
+        """
+        Return the ``estimate_`` attribute of the optimal solution.
+        """
+        return self.objective_.estimate_
+
+    def __getitem__(self, i):
+        return self.objective_[i]
+
+    def _solve(self, callback):
+        """
+        Run the inversion for every regularization parameter.
+
+        Linear problems with the default configuration are solved for all
+        regularization parameters from a single bidiagonalization (see
+        ``_solve_bidiagonal``), which also gives the squared norms of the
+        residuals and the traces of the influence matrices. These are
+        returned (None otherwise).
+        """
+        if self.datamisfit.islinear:
+            self.datamisfit.jacobian('null')
+        solvers = [
+            self.datamisfit + mu * self.regul for mu in self.regul_params]
+        if self.fit_method is None and solvers[0].islinear:
+            results = self._solve_bidiagonal(solvers)
+            if results is not None:
+                self.objectives = solvers
+                _report(solvers, callback)
+                return results
+        for solver in solvers:
+            if self.fit_method is not None:
+                solver.config(self.fit_method, **self.fit_args)
+            elif solver.islinear:
+                solver.config('cg', tol=self.tol, maxit=self.maxit)
+        self.objectives = _fit_all(solvers, callback)
+        return None
+
+    def _solve_bidiagonal(self, solvers):
+        r"""
+        Solve the linear problems for all regularization parameters at once.
+
+        Runs the (generalized) Golub-Kahan bidiagonalization of the Jacobian
+        :math:`\bar{\bar{J}}` starting from the data :math:`\bar{d}`
+        (Paige and Saunders, 1982):
+
+        .. math::
+
+            \bar{\bar{J}}\bar{\bar{V}}_k =
+            \bar{\bar{U}}_{k+1}\bar{\bar{B}}_k
+            \qquad
+            \bar{d} = \beta_1\bar{\bar{U}}_{k+1}\bar{e}_1
+
+        in which :math:`\bar{\bar{B}}_k` is lower bidiagonal, the columns of
+        :math:`\bar{\bar{V}}_k` are orthonormal and the columns of
+        :math:`\bar{\bar{U}}_{k+1}` are orthonormal with respect to the
+        data weights. The solutions are sought in the span of
+        :math:`\bar{\bar{V}}_k`, where the problem for each
+        :math:`\mu` is only :math:`k \times k`. Each iteration costs one
+        product with the Jacobian, its transpose, and the regularization
+        Hessian, shared by all regularization parameters. The iterations stop
+        when the gradient of the objective function of every regularization
+        parameter is smaller than *tol* times the gradient at the origin.
+
+        Sets ``p_`` and ``stats_`` of the solvers. Returns the squared norms
+        of the (weighted) residuals and the traces of the (projected)
+        influence matrices. Returns None if the regularization has a non-null
+        gradient at the origin.
+        """
+        misfit = self.datamisfit
+        scale = 2*misfit.regul_param
+        hess_regul = self.regul.hessian(None)
+        if numpy.any(numpy.zeros(misfit.nparams) + self.regul.gradient(None)):
+            return None
+        jacobian = misfit.jacobian(None)
+        weights = misfit.weights
+        mus = numpy.asarray(self.regul_params, dtype=numpy.float64)
+        maxit = self.maxit
+        if maxit is None:
+            maxit = min(misfit.ndata, misfit.nparams)
+
+        def weighted(u):
+            if weights is None:
+                return u
+            return numpy.ravel(safe_dot(weights, u))
+
+        def normalize(vector, basis, wbasis, inner=weighted):
+            # Full reorthogonalization (twice is enough)
+            for _ in range(2):
+                vector = vector - basis.dot(wbasis.T.dot(vector))
+            wvector = inner(vector)
+            norm = numpy.sqrt(max(vector.dot(wvector), 0))
+            if norm > 0:
+                vector, wvector = vector/norm, wvector/norm
+            return norm, vector, wvector
+
+        data = numpy.asarray(misfit.data, dtype=numpy.float64).ravel()
+        beta, u, wu = normalize(data, numpy.zeros((data.size, 0)),
+                                numpy.zeros((data.size, 0)))
+        first = beta
+        alpha, v, _ = normalize(
+            numpy.ravel(safe_dot(jacobian.T, wu)),
+            numpy.zeros((misfit.nparams, 0)), numpy.zeros((misfit.nparams, 0)),
+            inner=numpy.copy)
+        us, wus, vs, hvs = [u], [wu], [v], [numpy.ravel(safe_dot(hess_regul,
+                                                                 v))]
+        alphas, betas = [alpha], []
+        gradnorm = scale*first*alpha
+        iterations = 0
+        while True:
+            iterations += 1
+            U, WU = numpy.transpose(us), numpy.transpose(wus)
+            beta, u, wu = normalize(
+                numpy.ravel(safe_dot(jacobian, vs[-1])) - alphas[-1]*us[-1],
+                U, WU)
+            betas.append(beta)
+            us.append(u)
+            wus.append(wu)
+            V = numpy.transpose(vs)
+            alpha, v, _ = normalize(
+                numpy.ravel(safe_dot(jacobian.T, wu)) - beta*vs[-1], V, V,
+                inner=numpy.copy)
+            alphas.append(alpha)
+            k = len(vs)
+            # B_k is (k + 1) x k and J^T W U_{k+1} = V_{k+1} L^T, in which L
+            # is B_k with an extra column
+            bidiag = numpy.zeros((k + 1, k + 1))
+            bidiag[numpy.arange(k + 1), numpy.arange(k + 1)] = alphas
+            bidiag[numpy.arange(1, k + 1), numpy.arange(k)] = betas
+            B = bidiag[:, :k]
+            HV = numpy.transpose(hvs)
+            projected = V.T.dot(HV)
+            rhs = numpy.zeros(k + 1)
+            rhs[0] = first
+            ys = [numpy.linalg.solve(scale*B.T.dot(B) + mu*projected,
+                                     scale*B.T.dot(rhs))
+                  for mu in mus]
+            done = (beta == 0 or alpha == 0 or k >= maxit)
+            if not done:
+                Vnext = numpy.hstack([V, v[:, numpy.newaxis]])
+                grads = [scale*Vnext.dot(bidiag.T.dot(rhs - B.dot(y))) -
+                         mu*HV.dot(y) for y, mu in zip(ys, mus)]
+                done = all(numpy.linalg.norm(g) <= self.tol*gradnorm
+                           for g in grads)
+            if done:
+                break
+            vs.append(v)
+            hvs.append(numpy.ravel(safe_dot(hess_regul, v)))
+        dnorm, trace = [], []
+        for solver, y, mu in zip(solvers, ys, mus):
+            p = V.dot(y)
+            solver.p_ = p
+            for obj in solver:
+                obj.p_ = p
+            solver.stats_ = dict(method='Golub-Kahan bidiagonalization',
+                                 iterations=iterations)
+            dnorm.append(numpy.sum((rhs - B.dot(y))**2))
+            influence = scale*B.dot(numpy.linalg.solve(
+                scale*B.T.dot(B) + mu*projected, B.T))
+            trace.append(numpy.trace(influence))
+        return numpy.array(dnorm), numpy.array(trace)
+
+    def _residual_norm(self, p):
+        """
+        The squared norm of the (weighted) residual vector.
+        """
+        residuals = self.datamisfit.residuals(p)
+        if self.datamisfit.weights is None:
+            return numpy.sum(residuals**2)
+        return residuals.dot(safe_dot(self.datamisfit.weights, residuals))
+
+
+class GCV(_RegulParamSelector):
+    r"""
+    Use Generalized Cross-Validation to estimate the regularization parameter.
+
+    Runs the inversion using several specified regularization parameters and
+    keeps the one that minimizes the GCV function (Golub et al., 1979):
+
+    .. math::
+
+        V(\mu) = \frac{N \|\bar{r}_\mu\|^2}
+                        {[N - \mathrm{tr}(\bar{\bar{A}}_\mu)]^2}
+
+    in which :math:`\bar{r}_\mu` is the (weighted) residual vector of the
+    solution with regularization parameter :math:`\mu` and
+    :math:`\bar{\bar{A}}_\mu` is the influence matrix (the one that maps the
+    observed data into the predicted data).
+
+    The influence matrix is never calculated. Its trace is estimated with
+    the randomized method of Hutchinson (1990): the average of
+    :math:`\bar{z}^T\bar{\bar{A}}_\mu\bar{z}` over *nprobes* random
+    vectors with elements :math:`\pm 1`. Each term requires one
+    Conjugate Gradient solve with the Hessian, so choosing the regularization
+    of large problems costs a handful of matrix-vector products per
+    regularization parameter.
+
+    For non-linear problems, the influence matrix is calculated from the
+    Jacobian at the estimate.
+
+    This class behaves as :class:`~fatiando.inversion.base.Misfit`.
+    To use it, simply call ``fit`` and optionally ``config``.
+    The estimate will be stored in ``estimate_`` and ``p_``.
+    The estimated regularization parameter will be stored in ``regul_param_``.
+    The values of the GCV function and the estimated traces are stored in the
+    ``gcv`` and ``trace`` attributes.
+
+    Parameters:
+
+    * datamisfit : :class:`~fatiando.inversion.misfit.Misfit`
+        The data misfit instance for the inverse problem.
+    * regul : A class from :mod:`fatiando.inversion.regularization`
+        The regularizing function.
+    * regul_params : list
+        The values of the regularization parameter that will be tested.
+    * nprobes : int
+        The number of random vectors used to estimate the trace.
+    * tol : float
+        Convergence criterion for the bidiagonalization and the Conjugate
+        Gradient solves (relative norm of the gradient).
+    * maxit : int or None
+        The maximum number of iterations. If None, will use the number of
+        parameters (or data, if smaller).
+    * seed : None or int
+        Seed for the random number generator used for the trace estimation.
+
+    References:
+
+    Chung, J., J. G. Nagy, and D. P. O'Leary (2008), A weighted-GCV method
+    for Lanczos-hybrid regularization, Electronic Transactions on Numerical
+    Analysis, 28, 149-167.
+
+    Golub, G. H., M. Heath, and G. Wahba (1979), Generalized Cross-Validation
+    as a method for choosing a good ridge parameter, Technometrics, 21(2),
+    215-223, doi:10.1080/00401706.1979.10489751.
+
+    Hutchinson, M. F. (1990), A stochastic estimator of the trace of the
+    influence matrix for laplacian smoothing splines, Communications in
+    Statistics - Simulation and Computation, 19(2), 433-450,
+    doi:10.1080/03610919008812866.
+
+    Paige, C. C., and M. A. Saunders (1982), LSQR: An algorithm for sparse
+    linear equations and sparse least squares, ACM Transactions on
+    Mathematical Software, 8(1), 43-71, doi:10.1145/355984.355989.
+
+    Examples:
+
+    We'll estimate a smooth function from noisy and blurred samples. The
+    forward problem is a convolution with a Gaussian:
+
+    >>> import numpy as np
+    >>> from future.builtins import super
+    >>> from fatiando.inversion import Misfit, Smoothness1D, GCV
+    >>> from fatiando import utils
+    >>> class Blur(Misfit):
+    ...     def __init__(self, x, data):
+    ...         super().__init__(data=data, nparams=x.size, islinear=True)
+    ...         self.kernel = np.exp(-(x[:, None] - x)**2/0.001)
+    ...     def predicted(self, p):
+    ...         return self.kernel.dot(p)
+    ...     def jacobian(self, p):
+    ...         return self.kernel
+    >>> x = np.linspace(0, 1, 100)
+    >>> true = np.sin(2*np.pi*x)
+    >>> data = utils.contaminate(Blur(x, 0*x).predicted(true), 0.1, seed=0)
+    >>> regul_params = [10**i for i in range(-6, 3)]
+    >>> gcv = GCV(Blur(x, data), Smoothness1D(x.size), regul_params, seed=0)
+    >>> _ = gcv.fit()
+    >>> gcv.regul_param_
+    10
+    >>> print(np.abs(gcv.estimate_ - true).max() < 0.2)
+    True
+
+    The solutions and traces match the ones calculated with dense matrices:
+
+    >>> kernel = gcv.datamisfit.kernel
+    >>> hessian = 2*kernel.T.dot(kernel) + 10*gcv.regul.hessian(None)
+    >>> exact = np.linalg.solve(hessian, 2*kernel.T.dot(data))
+    >>> print(np.allclose(gcv.estimate_, exact, rtol=1e-3, atol=1e-3))
+    True
+    >>> trace = np.trace(2*kernel.dot(np.linalg.solve(hessian, kernel.T)))
+    >>> print(np.allclose(gcv.trace[gcv.best_], trace))
+    True
+
+    All solutions come from a single bidiagonalization. Configuring a solver
+    with ``config`` runs each inversion separately and estimates the traces
+    with random vectors instead:
+
+    >>> gcv.stats_['method']
+    'Golub-Kahan bidiagonalization'
+    >>> _ = gcv.config('linear').fit()
+    >>> gcv.regul_param_
+    10
+
+    """
+
+    def __init__(self, datamisfit, regul, regul_params, nprobes=10,
+                 tol=1e-5, maxit=None, seed=None):
+        super().__init__(datamisfit, regul, regul_params, tol, maxit)
+        self.nprobes = nprobes
+        self.seed = seed
+        self.gcv = None
+        self.trace = None
+
+    def fit(self, callback=None):
+        """
+        Solve for the parameter vector and optimum regularization parameter.
+
+        Runs the inversion for each regularization parameter, estimates the
+        GCV function for each, and keeps the one with the smallest value.
+
+        Parameters:
+
+        * callback : function or None
+            If not None, will be called for each regularization parameter
+            with its index, the estimate and the optimization statistics
+            (``callback(i, p, stats)``). When the inversions are run
+            separately (and not in parallel), it's called as soon as each
+            one finishes. Otherwise, after all are solved.
+
+        Returns:
+
+        * self
+
+        """
+        results = self._solve(callback)
+        ndata = self.datamisfit.ndata
+        if results is not None:
+            dnorm, self.trace = results
+        else:
+            # Use the same random vectors for all regularization parameters
+            # so that the estimated traces are consistent
+            probes = numpy.random.RandomState(self.seed).choice(
+                [-1., 1.], size=(self.nprobes, ndata))
+            self.trace = numpy.array([self._trace(s, probes)
+                                      for s in self.objectives])
+            dnorm = numpy.array([self._residual_norm(s.p_)
+                                 for s in self.objectives])
+        self.gcv = ndata*dnorm/(ndata - self.trace)**2
+        self.best_ = int(numpy.argmin(self.gcv))
+        return self
+
+    def _trace(self, solver, probes):
+        r"""
+        Estimate the trace of the influence matrix of a solution.
+
+        The influence matrix is :math:`2c\bar{\bar{J}}\bar{\bar{H}}^{-1}
+        \bar{\bar{J}}^T\bar{\bar{W}}`, in which :math:`c` is the
+        ``regul_param`` of the data misfit and :math:`\bar{\bar{H}}` is the
+        Hessian of the full objective function.
+        """
+        jacobian = self.datamisfit.jacobian(solver.p_)
+        hessian = solver.hessian(solver.p_)
+        weights = self.datamisfit.weights
+        estimates = []
+        for probe in probes:
+            left = safe_dot(jacobian.T, probe)
+            if weights is None:
+                right = left
+            else:
+                right = safe_dot(jacobian.T, safe_dot(weights, probe))
+            for _, solution, _ in optimization.cg(hessian, -right,
+                                                  tol=self.tol,
+                                                  maxit=self.maxit):
+                continue
+            estimates.append(left.dot(solution))
+        return 2*self.datamisfit.regul_param*numpy.mean(estimates)
+
+
+class DiscrepancyPrinciple(_RegulParamSelector):
+    r"""
+    Use the discrepancy principle to estimate the regularization parameter.
+
+    Runs the inversion using several specified regularization parameters and
+    keeps the largest one that fits the data to within the noise level
+    (Morozov, 1966):
+
+    .. math::
+
+        \|\bar{r}_\mu\|^2 \leq \tau^2 N \sigma^2
+
+    in which :math:`\bar{r}_\mu` is the (weighted) residual vector of the
+    solution with regularization parameter :math:`\mu`, :math:`N` is the
+    number of data, :math:`\sigma` is the standard deviation of the noise,
+    and :math:`\tau \geq 1` is a safety factor. If no parameter satisfies the
+    criterion, will use the one with the smallest residuals.
+
+    By default, linear problems are solved for all regularization parameters
+    from a single Golub-Kahan bidiagonalization of the Jacobian (see
+    :class:`~fatiando.inversion.hyper_param.GCV`).
+
+    This class behaves as :class:`~fatiando.inversion.base.Misfit`.
+    To use it, simply call ``fit`` and optionally ``config``.
+    The estimate will be stored in ``estimate_`` and ``p_``.
+    The estimated regularization parameter will be stored in ``regul_param_``.
+    The squared norms of the residuals are stored in the ``dnorm`` attribute.
+
+    Parameters:
+
+    * datamisfit : :class:`~fatiando.inversion.misfit.Misfit`
+        The data misfit instance for the inverse problem.
+    * regul : A class from :mod:`fatiando.inversion.regularization`
+        The regularizing function.
+    * regul_params : list
+        The values of the regularization parameter that will be tested.
+    * noise : float
+        The standard deviation of the noise in the data. If the data misfit
+        has weights, this should be the standard deviation of the weighted
+        noise (e.g., 1 if the weights are the inverse of the variances).
+    * tau : float
+        The safety factor.
+    * tol : float
+        Convergence criterion for the bidiagonalization and the Conjugate
+        Gradient solves (relative norm of the gradient).
+    * maxit : int or None
+        The maximum number of iterations. If None, will use the number of
+        parameters (or data, if smaller).
+
+    References:
+
+    Morozov, V. A. (1966), On the solution of functional equations by the
+    method of regularization, Soviet Mathematics Doklady, 7, 414-417.
+
+    Examples:
+
+    Using the same blurring problem of
+    :class:`~fatiando.inversion.hyper_param.GCV`:
+
+    >>> import numpy as np
+    >>> from future.builtins import super
+    >>> from fatiando.inversion import Misfit, Smoothness1D
+    >>> from fatiando.inversion import DiscrepancyPrinciple
+    >>> from fatiando import utils
+    >>> class Blur(Misfit):
+    ...     def __init__(self, x, data):
+    ...         super().__init__(data=data, nparams=x.size, islinear=True)
+    ...         self.kernel = np.exp(-(x[:, None] - x)**2/0.001)
+    ...     def predicted(self, p):
+    ...         return self.kernel.dot(p)
+    ...     def jacobian(self, p):
+    ...         return self.kernel
+    >>> x = np.linspace(0, 1, 100)
+    >>> true = np.sin(2*np.pi*x)
+    >>> data = utils.contaminate(Blur(x, 0*x).predicted(true), 0.1, seed=0)
+    >>> regul_params = [10**i for i in range(-6, 3)]
+    >>> solver = DiscrepancyPrinciple(Blur(x, data), Smoothness1D(x.size),
+    ...                               regul_params, noise=0.1)
+    >>> _ = solver.fit()
+    >>> solver.regul_param_
+    10
+    >>> print(np.abs(solver.estimate_ - true).max() < 0.2)
+    True
+    >>> kernel = solver.datamisfit.kernel
+    >>> hessian = 2*kernel.T.dot(kernel) + 10*solver.regul.hessian(None)
+    >>> exact = np.linalg.solve(hessian, 2*kernel.T.dot(data))
+    >>> dnorm = np.sum((data - kernel.dot(exact))**2)
+    >>> print(np.allclose(solver.dnorm[solver.best_], dnorm))
+    True
+
+    """
+
+    def __init__(self, datamisfit, regul, regul_params, noise, tau=1.,
+                 tol=1e-5, maxit=None):
+        super().__init__(datamisfit, regul, regul_params, tol, maxit)
+        self.noise = noise
+        self.tau = tau
+        self.dnorm = None
+
+    def fit(self, callback=None):
+        """
+        Solve for the parameter vector and optimum regularization parameter.
+
+        Runs the inversion for each regularization parameter and keeps the
+        largest one that satisfies the discrepancy principle.
+
+        Parameters:
+
+        * callback : function or None
+            If not None, will be called for each regularization parameter
+            with its index, the estimate and the optimization statistics
+            (``callback(i, p, stats)``). When the inversions are run
+            separately (and not in parallel), it's called as soon as each
+            one finishes. Otherwise, after all are solved.
+
+        Returns:
+
+        * self
+
+        """
+        results = self._solve(callback)
+        if results is not None:
+            self.dnorm = results[0]
+        else:
+            self.dnorm = numpy.array([self._residual_norm(s.p_)
+                                      for s in self.objectives])
+        target = self.tau**2*self.datamisfit.ndata*self.noise**2
+        fits = numpy.nonzero(self.dnorm <= target)[0]
+        if fits.size == 0:
+            self.best_ = int(numpy.argmin(self.dnorm))
+        else:
+            params = numpy.asarray(self.regul_params)
+            self.best_ = int(fits[numpy.argmax(params[fits])])
+        return self
+
+
 def _fit_solver(solver):
     """
     Call ``fit`` on the solver. Needed for multiprocessing.
     """
     return solver.fit()
+
+
+def _fit_all(solvers, callback):
+    """
+    Call ``fit`` on each solver and the callback as soon as each finishes.
+    """
+    results = []
+    for i, solver in enumerate(solvers):
+        results.append(solver.fit())
+        if callback is not None:
+            callback(i, solver.p_, solver.stats_)
+    return results
+
+
+def _report(solvers, callback):
+    """
+    Call the callback for solvers that have already been fitted.
+    """
+    if callback is not None:
+        for i, solver in enumerate(solvers):
+            callback(i, solver.p_, solver.stats_)
@@ -19,11 +19,13 @@ from __future__ import division, absolute_import
 import copy
 from abc import abstractmethod
 import numpy as np
+import scipy.linalg
 import scipy.sparse
+from scipy.sparse.linalg import LinearOperator
 
-from ..utils import safe_dot
+from ..utils import safe_dot, LinearOperatorSum
 from .base import (OptimizerMixin, OperatorMixin, CachedMethod,
-                   CachedMethodPermanent)
+                   CachedMethodPermanent, ApproximateJacobian)
 
 
 class Misfit(OptimizerMixin, OperatorMixin):
@@ -59,6 +61,14 @@ class Misfit(OptimizerMixin, OperatorMixin):
     solving the same problem with different methods or using an iterative
     method doesn't have the penalty of recalculating the Jacobian.
 
+    The Jacobian can also be a :class:`scipy.sparse.linalg.LinearOperator`
+    (something that knows how to multiply the Jacobian, and its transpose, by
+    a vector). In that case, the Hessian will also be a ``LinearOperator``
+    and only solvers that need products with the Hessian can be used (like
+    ``config('cg')``, which the default ``config('linear')`` switches to).
+    This allows for fast forward operators (FFT based, compressed, etc)
+    without ever building the Jacobian matrix.
+
     .. warning::
 
         When subclassing, be careful not to set the following attributes:
@@ -79,6 +89,39 @@ class Misfit(OptimizerMixin, OperatorMixin):
         Whether or not to cache the output of some methods to avoid recomputing
         matrices and vectors when passed the same input parameter vector.
 
+    Examples:
+
+    A linear problem with the Jacobian given as a matrix or as a
+    ``LinearOperator`` (with data weights and smoothness regularization):
+
+    >>> import numpy as np
+    >>> from scipy.sparse.linalg import aslinearoperator
+    >>> from fatiando.inversion import Smoothness1D
+    >>> class Linear(Misfit):
+    ...     def __init__(self, matrix, data, operator):
+    ...         super().__init__(data=data, nparams=matrix.shape[1],
+    ...                          islinear=True)
+    ...         self.matrix = matrix
+    ...         self.operator = operator
+    ...     def predicted(self, p):
+    ...         return self.matrix.dot(p)
+    ...     def jacobian(self, p):
+    ...         if self.operator:
+    ...             return aslinearoperator(self.matrix)
+    ...         return self.matrix
+    >>> random = np.random.RandomState(0)
+    >>> matrix = random.normal(size=(30, 10))
+    >>> data = matrix.dot(np.linspace(0, 1, 10))
+    >>> weights = random.uniform(1, 2, size=30)
+    >>> dense = Linear(matrix, data, operator=False).set_weights(weights)
+    >>> operator = Linear(matrix, data, operator=True).set_weights(weights)
+    >>> dense = (dense + 0.1*Smoothness1D(10)).fit()
+    >>> operator = (operator + 0.1*Smoothness1D(10)).fit()
+    >>> print(np.allclose(dense.p_, operator.p_, rtol=1e-4))
+    True
+    >>> operator.stats_['method']
+    'Conjugate Gradient'
+
     """
 
     def __init__(self, data, nparams, islinear, cache=True):
@@ -113,6 +156,95 @@ class Misfit(OptimizerMixin, OperatorMixin):
                 getattr(obj, name).instance = obj
         return obj
 
+    def set_cache(self, maxsize=1, maxbytes=None):
+        """
+        Configure the cache of the predicted data and Jacobian matrix.
+
+        By default, only the values for the last parameter vector are kept.
+        Keeping a few more avoids recomputing them when the optimization
+        method goes back to a previous estimate (like the rejected steps in
+        Levemberg-Marquardt). Use ``cache_info()`` of the cached methods (like
+        ``misfit.predicted.cache_info()``) to see how well the cache is doing.
+
+        Does nothing to the Jacobian of linear problems, which is only
+        calculated once. Deletes any values cached previously. The Jacobian
+        update method configured with
+        :meth:`~fatiando.inversion.misfit.Misfit.set_jacobian_update` (if
+        any) is kept.
+
+        Parameters:
+
+        * maxsize : int or None
+            The maximum number of values to keep for each method. If None,
+            won't limit the number of values.
+        * maxbytes : int or None
+            The maximum memory (in bytes) used by the cached values of each
+            method. If None, won't limit the memory.
+
+        Returns:
+
+        * self
+
+        """
+        self.predicted = CachedMethod(self, 'predicted', maxsize=maxsize,
+                                      maxbytes=maxbytes)
+        if self.islinear:
+            return self
+        if isinstance(self.jacobian, ApproximateJacobian):
+            self.jacobian = ApproximateJacobian(
+                self, 'jacobian', method=self.jacobian.method,
+                refresh=self.jacobian.refresh_every, maxsize=maxsize,
+                maxbytes=maxbytes)
+        else:
+            self.jacobian = CachedMethod(self, 'jacobian', maxsize=maxsize,
+                                         maxbytes=maxbytes)
+        return self
+
+    def set_jacobian_update(self, method='broyden', refresh=None):
+        """
+        Avoid calculating the Jacobian matrix at every iteration.
+
+        For non-linear problems, the gradient descent methods (``'newton'``
+        and ``'levmarq'``) calculate the Jacobian at every iteration. This can
+        be the most expensive part of the inversion (e.g., when it is
+        calculated by finite differences). Instead, the Jacobian can be
+        reused from previous iterations (``method='reuse'``) or updated with
+        Broyden's rank-one formula (``method='broyden'``) using only the
+        predicted data. The exact Jacobian is calculated again when a step is
+        rejected and, optionally, every *refresh* iterations.
+
+        See :class:`~fatiando.inversion.base.ApproximateJacobian`. The number
+        of exact Jacobians calculated is in ``misfit.jacobian.misses``.
+
+        Has no effect on linear problems, where the Jacobian is only
+        calculated once. The cache settings of
+        :meth:`~fatiando.inversion.misfit.Misfit.set_cache` are kept.
+
+        Parameters:
+
+        * method : string or None
+            ``'reuse'``, ``'broyden'``, or None to always calculate the exact
+            Jacobian.
+        * refresh : int or None
+            Calculate the exact Jacobian at least every *refresh* iterations.
+            If None, will only do so when a step is rejected.
+
+        Returns:
+
+        * self
+
+        """
+        if self.islinear:
+            return self
+        settings = dict(maxsize=getattr(self.jacobian, 'maxsize', 1),
+                        maxbytes=getattr(self.jacobian, 'maxbytes', None))
+        if method is None:
+            self.jacobian = CachedMethod(self, 'jacobian', **settings)
+        else:
+            self.jacobian = ApproximateJacobian(
+                self, 'jacobian', method=method, refresh=refresh, **settings)
+        return self
+
     def set_weights(self, weights):
         r"""
         Set the data weights.
@@ -147,6 +279,45 @@ class Misfit(OptimizerMixin, OperatorMixin):
         self.hessian.hard_reset()
         return self
 
+    def _least_squares(self):
+        r"""
+        The Jacobian and residuals of the equivalent least-squares system.
+
+        For linear problems, the misfit is
+        :math:`\|\bar{\bar{A}}\bar{p} - \bar{b}\|^2` with
+        :math:`\bar{\bar{A}} = \sqrt{c}\bar{\bar{U}}\bar{\bar{J}}` and
+        :math:`\bar{b} = \sqrt{c}\bar{\bar{U}}\bar{d}^o`, in which
+        :math:`c` is the ``regul_param`` and
+        :math:`\bar{\bar{U}}^T\bar{\bar{U}}` are the weights. Used by the
+        ``'lsqr'`` optimization method so that it doesn't need the Hessian.
+
+        Returns:
+
+        * matrices, vectors : lists
+            The blocks of the matrix :math:`\bar{\bar{A}}` and the vector
+            :math:`\bar{b}` (a single block for a Misfit). None if the
+            problem is non-linear.
+
+        """
+        if not self.islinear:
+            return None
+        jacobian = self.jacobian(None)
+        residuals = np.asarray(self.data, dtype=np.float64).ravel()
+        factor = None
+        if self.weights is not None:
+            factor = _weights_factor(self.weights)
+        if self.regul_param != 1:
+            scale = np.sqrt(self.regul_param)
+            if factor is None:
+                factor = scipy.sparse.diags(
+                    np.full(self.ndata, scale), 0, format='csr')
+            else:
+                factor = scale*factor
+        if factor is not None:
+            jacobian = safe_dot(factor, jacobian)
+            residuals = np.ravel(safe_dot(factor, residuals))
+        return [jacobian], [residuals]
+
     def residuals(self, p=None):
         """
         Calculate the residuals vector (observed - predicted data).
@@ -243,16 +414,21 @@ class Misfit(OptimizerMixin, OperatorMixin):
 
         Returns:
 
-        * hessian : 2d-array
-            The Hessian matrix
+        * hessian : 2d-array or LinearOperator
+            The Hessian matrix. A
+            :class:`scipy.sparse.linalg.LinearOperator` if the Jacobian is
+            one.
 
         """
         jacobian = self.jacobian(p)
         if self.weights is None:
             hessian = safe_dot(jacobian.T, jacobian)
         else:
-            hessian = safe_dot(jacobian.T, self.weights*jacobian)
-        hessian *= 2*self.regul_param
+            hessian = safe_dot(jacobian.T, safe_dot(self.weights, jacobian))
+        if isinstance(hessian, LinearOperator):
+            hessian = LinearOperatorSum([hessian], 2*self.regul_param)
+        else:
+            hessian *= 2*self.regul_param
         return hessian
 
     def gradient(self, p):
@@ -292,3 +468,20 @@ class Misfit(OptimizerMixin, OperatorMixin):
             grad = np.array(grad).ravel()
         grad *= -2*self.regul_param
         return grad
+
+
+def _weights_factor(weights):
+    """
+    A matrix U so that U.T*U is the weight matrix.
+
+    The square root of diagonal weights (sparse). The Cholesky factor of other
+    weight matrices.
+    """
+    if scipy.sparse.issparse(weights):
+        diag = weights.diagonal()
+        offdiagonal = scipy.sparse.csr_matrix(
+            weights - scipy.sparse.diags(diag, 0))
+        if offdiagonal.count_nonzero() == 0:
+            return scipy.sparse.diags(np.sqrt(diag), 0, format='csr')
+        weights = weights.toarray()
+    return scipy.linalg.cholesky(np.asarray(weights))
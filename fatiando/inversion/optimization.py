@@ -18,6 +18,12 @@ loop, like so::
 **Gradient descent**
 
 * :func:`~fatiando.inversion.optimization.linear`: Solver for a linear problem
+* :func:`~fatiando.inversion.optimization.cg`: Conjugate Gradient solver for a
+  linear problem (doesn't need the Hessian matrix, only its product with a
+  vector)
+* :func:`~fatiando.inversion.optimization.lsqr` and
+  :func:`~fatiando.inversion.optimization.minres`: Other Krylov subspace
+  solvers for linear problems (LSQR and MINRES from :mod:`scipy.sparse.linalg`)
 * :func:`~fatiando.inversion.optimization.newton`: Newton's method
 * :func:`~fatiando.inversion.optimization.levmarq`: Levemberg-Marquardt
   algorithm
@@ -30,6 +36,18 @@ loop, like so::
 
 **References**
 
+Hestenes, M. R., and E. Stiefel (1952), Methods of conjugate gradients for
+solving linear systems, Journal of Research of the National Bureau of
+Standards, 49(6), 409-436, doi:10.6028/jres.049.044.
+
+Paige, C. C., and M. A. Saunders (1975), Solution of sparse indefinite
+systems of linear equations, SIAM Journal on Numerical Analysis, 12(4),
+617-629, doi:10.1137/0712047.
+
+Paige, C. C., and M. A. Saunders (1982), LSQR: An algorithm for sparse linear
+equations and sparse least squares, ACM Transactions on Mathematical
+Software, 8(1), 43-71, doi:10.1145/355984.355989.
+
 Socha, K., and M. Dorigo (2008), Ant colony optimization for continuous
 domains, European Journal of Operational Research, 185(3), 1155-1173,
 doi:10.1016/j.ejor.2006.06.046.
@@ -39,13 +57,17 @@ doi:10.1016/j.ejor.2006.06.046.
 
 """
 from __future__ import division, absolute_import
-from future.builtins import range
+from future.builtins import range, map
 import copy
 import warnings
+import multiprocessing
+import multiprocessing.pool
 import numpy
+import scipy.special
 import scipy.sparse
+import scipy.sparse.linalg
 
-from ..utils import safe_solve, safe_diagonal, safe_dot
+from ..utils import safe_solve, safe_diagonal, safe_dot, LinearOperatorSum
 
 
 def linear(hessian, gradient, precondition=True):
@@ -64,7 +86,7 @@ def linear(hessian, gradient, precondition=True):
 
     Parameters:
 
-    * hessian : 2d-array
+    * hessian : 2d-array, sparse matrix or LinearOperator
         The Hessian matrix of the objective function.
     * gradient : 1d-array
         The gradient vector of the objective function.
@@ -84,7 +106,17 @@ def linear(hessian, gradient, precondition=True):
     Linear solvers have only a single step, so ``i`` will be 0 and ``stats``
     will only have the method name.
 
+    If *hessian* is a :class:`scipy.sparse.linalg.LinearOperator`, it can't be
+    factorized and the system is solved with
+    :func:`~fatiando.inversion.optimization.cg` instead (with its default
+    arguments). In that case, ``stats`` will be the ones from ``cg``.
+
     """
+    if isinstance(hessian, scipy.sparse.linalg.LinearOperator):
+        for i, p, stats in cg(hessian, gradient, precondition=precondition):
+            continue
+        yield 0, p, stats
+        return
     if precondition:
         diag = numpy.abs(safe_diagonal(hessian))
         diag[diag < 10 ** -10] = 10 ** -10
@@ -95,8 +127,485 @@ def linear(hessian, gradient, precondition=True):
     yield 0, p, dict(method="Linear solver")
 
 
+def cg(hessian, gradient, initial=None, maxit=None, tol=10**-5,
+       precondition=True):
+    r"""
+    Solve a linear problem using the Conjugate Gradient method.
+
+    Finds the same parameter vector as
+    :func:`~fatiando.inversion.optimization.linear` (the solution of
+    :math:`\bar{\bar{H}} \bar{p} = -\bar{g}`) but never factorizes or
+    inverts the Hessian matrix. The method only needs the product of the
+    Hessian with a vector (Hestenes and Stiefel, 1952). So *hessian* can be a
+    dense or sparse matrix or a matrix-free
+    :class:`scipy.sparse.linalg.LinearOperator`.
+
+    The iterations stop when the norm of the residual vector
+    :math:`\bar{r}^k = -\bar{g} - \bar{\bar{H}}\bar{p}^k` falls below
+    *tol* times the norm of the gradient.
+
+    Parameters:
+
+    * hessian : 2d-array, sparse matrix or LinearOperator
+        The Hessian matrix of the objective function.
+    * gradient : 1d-array
+        The gradient vector of the objective function.
+    * initial : 1d-array or None
+        The initial estimate. If None, will start from a null vector.
+    * maxit : int or None
+        The maximum number of iterations allowed. If None, will use the number
+        of parameters.
+    * tol : float
+        The convergence criterion. The lower it is, the more steps are
+        permitted.
+    * precondition : True or False
+        If True, will use Jacobi (diagonal) preconditioning. Ignored if the
+        diagonal of a LinearOperator *hessian* can't be calculated (see
+        :func:`~fatiando.utils.safe_diagonal`).
+
+    Yields:
+
+    * i, estimate, stats:
+        * i : int
+            The current iteration number
+        * estimate : 1d-array
+            The current estimated parameter vector
+        * stats : dict
+            Statistics about the optimization so far. Keys:
+
+            * method : str
+                The name of the optimization method
+            * iterations : int
+                The total number of iterations so far
+            * residual : list
+                Norm of the residual vector (divided by the norm of the
+                gradient) per iteration. First value corresponds to the
+                initial estimate.
+
+    Examples:
+
+    >>> import numpy
+    >>> hessian = numpy.array([[4., 1.], [1., 3.]])
+    >>> gradient = numpy.array([-1., -2.])
+    >>> for i, p, stats in cg(hessian, gradient):
+    ...     continue
+    >>> print(', '.join('{:.4f}'.format(i) for i in p))
+    0.0909, 0.6364
+    >>> stats['iterations']
+    2
+
+    """
+    stats = dict(method="Conjugate Gradient",
+                 iterations=0,
+                 residual=[])
+    iterations = _conjugate_gradient(hessian, gradient, initial, maxit, tol,
+                                     precondition)
+    for iteration, p, residual in iterations:
+        stats['residual'].append(residual)
+        if iteration < 0:
+            if residual <= tol:
+                yield 0, p, copy.deepcopy(stats)
+            continue
+        stats['iterations'] += 1
+        yield iteration, p, copy.deepcopy(stats)
+    if stats['residual'][-1] > tol:
+        warnings.warn(
+            'Exited because maximum iterations reached. ' +
+            'Might not have achieved convergence. ' +
+            'Try inscreasing the maximum number of iterations allowed.',
+            RuntimeWarning)
+
+
+def _conjugate_gradient(hessian, gradient, initial, maxit, tol, precondition):
+    """
+    The (preconditioned) Conjugate Gradient iterations.
+
+    Yields the iteration number, estimate and relative residual norm. The
+    first item is the initial estimate with iteration number -1.
+    """
+    minus_gradient = -numpy.asarray(gradient, dtype=numpy.float64).ravel()
+    nparams = minus_gradient.size
+    if maxit is None:
+        maxit = nparams
+    if initial is None:
+        p = numpy.zeros(nparams)
+        residual = minus_gradient.copy()
+    else:
+        p = numpy.array(initial, dtype=numpy.float64)
+        residual = minus_gradient - _matvec(hessian, p)
+    scale = _jacobi(hessian, precondition)
+    if scale is None:
+        scale = numpy.ones(nparams)
+    gradnorm = numpy.linalg.norm(minus_gradient)
+    if gradnorm == 0:
+        gradnorm = 1
+    resnorm = numpy.linalg.norm(residual)/gradnorm
+    yield -1, p, resnorm
+    if resnorm <= tol:
+        return
+    precond_res = scale*residual
+    res_dot = residual.dot(precond_res)
+    direction = precond_res.copy()
+    for iteration in range(maxit):
+        hess_dir = _matvec(hessian, direction)
+        alpha = res_dot/direction.dot(hess_dir)
+        p = p + alpha*direction
+        residual -= alpha*hess_dir
+        resnorm = numpy.linalg.norm(residual)/gradnorm
+        yield iteration, p, resnorm
+        if resnorm <= tol:
+            break
+        precond_res = scale*residual
+        new_res_dot = residual.dot(precond_res)
+        direction = precond_res + (new_res_dot/res_dot)*direction
+        res_dot = new_res_dot
+
+
+def lsqr(jacobian, residuals, maxit=None, tol=10**-5, precondition=True):
+    r"""
+    Solve a linear least-squares problem using the LSQR algorithm.
+
+    Minimizes :math:`\|\bar{\bar{J}}\bar{p} - \bar{r}\|^2` with
+    :func:`scipy.sparse.linalg.lsqr` (Paige and Saunders, 1982). Works with
+    the Jacobian directly instead of the Hessian of the normal equations, so
+    the condition number isn't squared. Like
+    :func:`~fatiando.inversion.optimization.cg`, only needs products of the
+    Jacobian (and its transpose) with vectors. Use this if the problem is
+    badly conditioned.
+
+    The Jacobian of a regularized problem is the Jacobian of the data misfit
+    stacked on top of the regularization matrix. These can be passed as lists
+    of blocks that are never stacked in memory. Any linear system
+    :math:`\bar{\bar{H}} \bar{p} = -\bar{g}` can also be solved (in the
+    least-squares sense) by passing the Hessian and minus the gradient.
+
+    Parameters:
+
+    * jacobian : 2d-array, sparse matrix, LinearOperator or list
+        The (weighted) Jacobian matrix or a list of the blocks of the matrix
+        (stacked vertically).
+    * residuals : 1d-array or list
+        The (weighted) residual vector or a list of its parts (one for each
+        block of the Jacobian).
+    * maxit : int or None
+        The maximum number of iterations allowed. If None, will use twice the
+        number of parameters.
+    * tol : float
+        The convergence criterion (relative tolerance of the residuals).
+    * precondition : True or False
+        If True, will scale the columns of the Jacobian by the inverse of
+        their norms (only if no block is a LinearOperator).
+
+    Yields:
+
+    * i, estimate, stats:
+        * i : int
+            The current iteration number
+        * estimate : 1d-array
+            The estimated parameter vector
+        * stats : dict
+            Statistics about the optimization. Keys:
+
+            * method : str
+                The name of the optimization method
+            * iterations : int
+                The total number of iterations
+            * residual : list
+                Norm of the gradient of the final estimate divided by the norm
+                of the gradient at the origin.
+
+    The solver runs to the end before yielding, so there is a single step and
+    ``i`` will be 0.
+
+    Examples:
+
+    >>> import numpy
+    >>> jacobian = numpy.array([[1., 0.], [1., 1.], [1., 2.]])
+    >>> residuals = numpy.array([1., 2., 4.])
+    >>> for i, p, stats in lsqr(jacobian, residuals):
+    ...     continue
+    >>> print(', '.join('{:.4f}'.format(i) for i in p))
+    0.8333, 1.5000
+
+    Adding damping as a second block:
+
+    >>> damping = 0.1*numpy.identity(2)
+    >>> for i, p, stats in lsqr([jacobian, damping], [residuals, [0, 0]]):
+    ...     continue
+    >>> hessian = jacobian.T.dot(jacobian) + damping.T.dot(damping)
+    >>> exact = numpy.linalg.solve(hessian, jacobian.T.dot(residuals))
+    >>> print(numpy.allclose(p, exact))
+    True
+
+    """
+    if not isinstance(jacobian, (list, tuple)):
+        jacobian, residuals = [jacobian], [residuals]
+    residuals = numpy.hstack([numpy.ravel(r) for r in residuals])
+    residuals = residuals.astype(numpy.float64)
+    operator = _stack(jacobian)
+    nparams = operator.shape[1]
+    if maxit is None:
+        maxit = 2*nparams
+    scale = None
+    if precondition:
+        scale = _column_scale(jacobian)
+    if scale is not None:
+        operator = operator*scipy.sparse.linalg.aslinearoperator(
+            scipy.sparse.diags(scale, 0))
+    result = scipy.sparse.linalg.lsqr(operator, residuals, atol=tol,
+                                      btol=tol, iter_lim=maxit)
+    p, istop, iterations = result[:3]
+    if scale is not None:
+        p = scale*p
+    unscaled = _stack(jacobian)
+    gradnorm = numpy.linalg.norm(unscaled.rmatvec(residuals))
+    if gradnorm == 0:
+        gradnorm = 1
+    gradient = unscaled.rmatvec(residuals - unscaled.matvec(p))
+    stats = dict(method="LSQR",
+                 iterations=iterations,
+                 residual=[numpy.linalg.norm(gradient)/gradnorm])
+    if istop == 7:
+        warnings.warn(
+            'Exited because maximum iterations reached. ' +
+            'Might not have achieved convergence. ' +
+            'Try inscreasing the maximum number of iterations allowed.',
+            RuntimeWarning)
+    yield 0, p, stats
+
+
+def _stack(blocks):
+    """
+    A LinearOperator for a list of matrices stacked vertically.
+
+    The blocks are not copied.
+    """
+    operators = [_as_operator(block) for block in blocks]
+    if len(operators) == 1:
+        return operators[0]
+    splits = numpy.cumsum([op.shape[0] for op in operators])[:-1]
+    nparams = operators[0].shape[1]
+
+    def matvec(vector):
+        return numpy.hstack([_matvec(op, vector) for op in operators])
+
+    def rmatvec(vector):
+        parts = numpy.split(numpy.ravel(vector), splits)
+        return sum(numpy.ravel(op.rmatvec(part))
+                   for op, part in zip(operators, parts))
+
+    return scipy.sparse.linalg.LinearOperator(
+        (splits[-1] + operators[-1].shape[0], nparams), matvec=matvec,
+        rmatvec=rmatvec, dtype=numpy.float64)
+
+
+def _column_scale(blocks):
+    """
+    The inverse of the norms of the columns of a matrix stacked from blocks.
+
+    Returns None if any block is a LinearOperator or all columns are null.
+    """
+    squared = 0
+    for block in blocks:
+        if _is_operator(block):
+            return None
+        if scipy.sparse.issparse(block):
+            block = scipy.sparse.csr_matrix(block)
+            squared = squared + numpy.ravel(block.multiply(block).sum(axis=0))
+        else:
+            block = numpy.asarray(block, dtype=numpy.float64)
+            squared = squared + numpy.einsum('ij,ij->j', block, block)
+    norms = numpy.sqrt(squared)
+    tiny = 10 ** -10*norms.max()
+    if tiny == 0:
+        return None
+    norms[norms < tiny] = tiny
+    return 1/norms
+
+
+def minres(hessian, gradient, maxit=None, tol=10**-5, precondition=True):
+    r"""
+    Solve a linear problem using the MINRES algorithm.
+
+    Solves :math:`\bar{\bar{H}} \bar{p} = -\bar{g}` with
+    :func:`scipy.sparse.linalg.minres` (Paige and Saunders, 1975). The Hessian
+    must be symmetric but can be indefinite. Like
+    :func:`~fatiando.inversion.optimization.cg`, only needs products of the
+    Hessian with vectors.
+
+    Parameters:
+
+    * hessian : 2d-array, sparse matrix or LinearOperator
+        The Hessian matrix of the objective function.
+    * gradient : 1d-array
+        The gradient vector of the objective function.
+    * maxit : int or None
+        The maximum number of iterations allowed. If None, will use 5 times
+        the number of parameters.
+    * tol : float
+        The convergence criterion (relative tolerance of the residuals).
+    * precondition : True or False
+        If True, will use symmetric Jacobi (diagonal) preconditioning.
+
+    Yields:
+
+    * i, estimate, stats:
+        * i : int
+            The current iteration number
+        * estimate : 1d-array
+            The estimated parameter vector
+        * stats : dict
+            Statistics about the optimization. Keys:
+
+            * method : str
+                The name of the optimization method
+            * iterations : int
+                The total number of iterations
+            * residual : list
+                Norm of the residual vector (divided by the norm of the
+                gradient) of the final estimate.
+
+    The solver runs to the end before yielding, so there is a single step and
+    ``i`` will be 0.
+
+    Examples:
+
+    >>> import numpy
+    >>> hessian = numpy.array([[4., 1.], [1., 3.]])
+    >>> gradient = numpy.array([-1., -2.])
+    >>> for i, p, stats in minres(hessian, gradient):
+    ...     continue
+    >>> print(', '.join('{:.4f}'.format(i) for i in p))
+    0.0909, 0.6364
+
+    """
+    minus_gradient = -numpy.asarray(gradient, dtype=numpy.float64).ravel()
+    nparams = minus_gradient.size
+    if maxit is None:
+        maxit = 5*nparams
+    operator = _as_operator(hessian)
+    rhs = minus_gradient
+    # Use symmetric Jacobi scaling to keep the system symmetric
+    scale = _jacobi(hessian, precondition)
+    if scale is not None:
+        scale = numpy.sqrt(scale)
+        scaling = scipy.sparse.linalg.aslinearoperator(
+            scipy.sparse.diags(scale, 0))
+        operator = scaling*operator*scaling
+        rhs = scale*rhs
+    # The stopping criteria of MINRES aren't invariant to the scale of the
+    # system, so normalize the right-hand side
+    rhsnorm = numpy.linalg.norm(rhs)
+    if rhsnorm == 0:
+        rhsnorm = 1
+    stats = dict(method="MINRES",
+                 iterations=0,
+                 residual=[])
+
+    def count(p):
+        stats['iterations'] += 1
+
+    p, info = scipy.sparse.linalg.minres(operator, rhs/rhsnorm, tol=tol,
+                                         maxiter=maxit, callback=count)
+    p = rhsnorm*p
+    if scale is not None:
+        p = scale*p
+    stats['residual'].append(
+        _relative_residual(hessian, minus_gradient, p))
+    if info > 0:
+        warnings.warn(
+            'Exited because maximum iterations reached. ' +
+            'Might not have achieved convergence. ' +
+            'Try inscreasing the maximum number of iterations allowed.',
+            RuntimeWarning)
+    yield 0, p, stats
+
+
+def _as_operator(matrix):
+    """
+    Convert a dense or sparse matrix to a
+    :class:`scipy.sparse.linalg.LinearOperator`.
+
+    Dense matrices are converted to arrays first so that the products are 1d.
+    """
+    if isinstance(matrix, numpy.matrix):
+        matrix = numpy.asarray(matrix)
+    return scipy.sparse.linalg.aslinearoperator(matrix)
+
+
+def _jacobi(hessian, precondition):
+    """
+    The inverse of the absolute value of the diagonal of the Hessian.
+
+    Returns None if *precondition* is False or if the diagonal can't be
+    calculated.
+    """
+    if not precondition:
+        return None
+    diag = safe_diagonal(hessian)
+    if diag is None:
+        return None
+    diag = numpy.abs(numpy.asarray(diag, dtype=numpy.float64).ravel())
+    # Relative to the largest element because the Hessians of some problems
+    # (gravity, for example) have tiny elements
+    tiny = 10 ** -10*diag.max()
+    if tiny == 0:
+        return None
+    diag[diag < tiny] = tiny
+    return 1/diag
+
+
+def _relative_residual(hessian, minus_gradient, p):
+    """
+    Norm of the residuals of the linear system divided by the norm of the
+    gradient.
+    """
+    gradnorm = numpy.linalg.norm(minus_gradient)
+    if gradnorm == 0:
+        gradnorm = 1
+    residual = minus_gradient - _matvec(hessian, p)
+    return numpy.linalg.norm(residual)/gradnorm
+
+
+def _matvec(matrix, vector):
+    """
+    Multiply a matrix (dense, sparse or LinearOperator) by a vector.
+
+    Always returns a 1d-array.
+    """
+    return numpy.asarray(safe_dot(matrix, vector)).ravel()
+
+
+def _inner_solve(hessian, minus_gradient, tol, maxit, precondition):
+    """
+    Inexact solution of the linear system of a Newton-type step using the
+    Conjugate Gradient method.
+    """
+    for _, p, _ in _conjugate_gradient(hessian, -minus_gradient, None, maxit,
+                                       tol, precondition):
+        continue
+    return p
+
+
+def _damped(hessian, damping):
+    """
+    Add a sparse damping matrix to a Hessian that can be a LinearOperator.
+    """
+    if _is_operator(hessian):
+        return LinearOperatorSum([hessian, damping])
+    return hessian + damping
+
+
+def _is_operator(matrix):
+    """
+    Check if a matrix is a :class:`scipy.sparse.linalg.LinearOperator`.
+    """
+    return isinstance(matrix, scipy.sparse.linalg.LinearOperator)
+
+
 def newton(hessian, gradient, value, initial, maxit=30, tol=10 ** -5,
-           precondition=True):
+           precondition=True, inner='direct', inner_tol=0.1, inner_maxit=None,
+           refresh=None):
     r"""
     Minimize an objective function using Newton's method.
 
@@ -112,6 +621,14 @@ def newton(hessian, gradient, value, initial, maxit=30, tol=10 ** -5,
     :math:`\bar{g}` is the gradient vector of :math:`\phi`. Both are evaluated
     at the previous estimate :math:`\bar{p}^k`.
 
+    The linear system can be solved inexactly with a few Conjugate Gradient
+    iterations (``inner='cg'``) instead of a direct solver. This is always the
+    case if the Hessian is a :class:`scipy.sparse.linalg.LinearOperator`.
+
+    If the Hessian and gradient use an approximate Jacobian (see
+    :class:`~fatiando.inversion.base.ApproximateJacobian`), pass a *refresh*
+    function so that a step that increases the objective function is tried
+    again with the exact Jacobian.
 
     Parameters:
 
@@ -133,8 +650,21 @@ def newton(hessian, gradient, value, initial, maxit=30, tol=10 ** -5,
         permitted.
     * precondition : True or False
         If True, will use Jacobi preconditioning.
-
-    Returns:
+    * inner : string
+        How to solve the linear system of each step. ``'direct'`` uses
+        :func:`~fatiando.utils.safe_solve`. ``'cg'`` uses the Conjugate
+        Gradient method (see :func:`~fatiando.inversion.optimization.cg`).
+    * inner_tol : float
+        The convergence criterion of the Conjugate Gradient inner solves. The
+        solves don't have to be accurate when far from the minimum.
+    * inner_maxit : int or None
+        The maximum number of Conjugate Gradient iterations per inner solve.
+        If None, will use the number of parameters.
+    * refresh : function or None
+        Called without arguments when a step increases the objective
+        function. Should return True if the next calls to *hessian* and
+        *gradient* will be more accurate (e.g., using the exact Jacobian
+        instead of an approximation). If so, the step is calculated again.
 
     Yields:
 
@@ -162,16 +692,14 @@ def newton(hessian, gradient, value, initial, maxit=30, tol=10 ** -5,
     misfit = value(p)
     stats['objective'].append(misfit)
     for iteration in range(maxit):
-        hess = hessian(p)
-        grad = gradient(p)
-        if precondition:
-            diag = numpy.abs(safe_diagonal(hess))
-            diag[diag < 10 ** -10] = 10 ** -10
-            precond = scipy.sparse.diags(1. / diag, 0).tocsr()
-            hess = safe_dot(precond, hess)
-            grad = safe_dot(precond, grad)
-        p = p + safe_solve(hess, -grad)
-        newmisfit = value(p)
+        newp = p + _newton_step(hessian(p), gradient(p), precondition, inner,
+                                inner_tol, inner_maxit)
+        newmisfit = value(newp)
+        if newmisfit > misfit and refresh is not None and refresh():
+            newp = p + _newton_step(hessian(p), gradient(p), precondition,
+                                    inner, inner_tol, inner_maxit)
+            newmisfit = value(newp)
+        p = newp
         stats['objective'].append(newmisfit)
         stats['iterations'] += 1
         yield iteration, p, copy.deepcopy(stats)
@@ -186,11 +714,37 @@ def newton(hessian, gradient, value, initial, maxit=30, tol=10 ** -5,
             RuntimeWarning)
 
 
+def _newton_step(hess, grad, precondition, inner, inner_tol, inner_maxit):
+    """
+    Solve the linear system of a Newton step.
+    """
+    if inner == 'cg' or _is_operator(hess):
+        return _inner_solve(hess, -grad, inner_tol, inner_maxit, precondition)
+    if precondition:
+        diag = numpy.abs(safe_diagonal(hess))
+        diag[diag < 10 ** -10] = 10 ** -10
+        precond = scipy.sparse.diags(1. / diag, 0).tocsr()
+        hess = safe_dot(precond, hess)
+        grad = safe_dot(precond, grad)
+    return safe_solve(hess, -grad)
+
+
 def levmarq(hessian, gradient, value, initial, maxit=30, maxsteps=20, lamb=10,
-            dlamb=2, tol=10**-5, precondition=True):
+            dlamb=2, tol=10**-5, precondition=True, inner='direct',
+            inner_tol=0.1, inner_maxit=None, refresh=None):
     r"""
     Minimize an objective function using the Levemberg-Marquardt algorithm.
 
+    The linear system of each step can be solved inexactly with a few
+    Conjugate Gradient iterations (``inner='cg'``) instead of a direct solver.
+    This is always the case if the Hessian is a
+    :class:`scipy.sparse.linalg.LinearOperator`.
+
+    If the Hessian and gradient use an approximate Jacobian (see
+    :class:`~fatiando.inversion.base.ApproximateJacobian`), pass a *refresh*
+    function so that the first rejected step of an iteration is tried again
+    with the exact Jacobian before increasing the step regularization.
+
     Parameters:
 
     * hessian : function
@@ -218,6 +772,21 @@ def levmarq(hessian, gradient, value, initial, maxit=30, maxsteps=20, lamb=10,
         permitted.
     * precondition : True or False
         If True, will use Jacobi preconditioning.
+    * inner : string
+        How to solve the linear system of each step. ``'direct'`` uses
+        :func:`~fatiando.utils.safe_solve`. ``'cg'`` uses the Conjugate
+        Gradient method (see :func:`~fatiando.inversion.optimization.cg`).
+    * inner_tol : float
+        The convergence criterion of the Conjugate Gradient inner solves. The
+        solves don't have to be accurate when far from the minimum.
+    * inner_maxit : int or None
+        The maximum number of Conjugate Gradient iterations per inner solve.
+        If None, will use the number of parameters.
+    * refresh : function or None
+        Called without arguments when a step is rejected. Should return True
+        if the next calls to *hessian* and *gradient* will be more accurate
+        (e.g., using the exact Jacobian instead of an approximation). If so,
+        the linear system is built again.
 
     Yields:
 
@@ -252,21 +821,26 @@ def levmarq(hessian, gradient, value, initial, maxit=30, maxsteps=20, lamb=10,
     stats['step_attempts'].append(0)
     stats['step_size'].append(lamb)
     for iteration in range(maxit):
-        hess = hessian(p)
-        minus_gradient = -gradient(p)
-        if precondition:
-            diag = numpy.abs(safe_diagonal(hess))
-            diag[diag < 10 ** -10] = 10 ** -10
-            precond = scipy.sparse.diags(1. / diag, 0).tocsr()
-            hess = safe_dot(precond, hess)
-            minus_gradient = safe_dot(precond, minus_gradient)
+        hess, minus_gradient, diag, iterative = _levmarq_system(
+            hessian(p), gradient(p), precondition, inner)
         stagnation = True
-        diag = scipy.sparse.diags(safe_diagonal(hess), 0).tocsr()
+        refreshed = False
         for step in range(maxsteps):
-            newp = p + safe_solve(hess + lamb * diag, minus_gradient)
+            if iterative:
+                newp = p + _inner_solve(_damped(hess, lamb*diag),
+                                        minus_gradient, inner_tol,
+                                        inner_maxit, precondition)
+            else:
+                newp = p + safe_solve(hess + lamb * diag, minus_gradient)
             newmisfit = value(newp)
             if newmisfit >= misfit:
-                if lamb < 10 ** 15:
+                if (refresh is not None and not refreshed and refresh()):
+                    # The step was calculated with an approximate Jacobian.
+                    # Try again with the exact one before changing lamb.
+                    refreshed = True
+                    hess, minus_gradient, diag, iterative = _levmarq_system(
+                        hessian(p), gradient(p), precondition, inner)
+                elif lamb < 10 ** 15:
                     lamb = lamb*dlamb
             else:
                 if lamb > 10 ** -15:
@@ -303,6 +877,28 @@ def levmarq(hessian, gradient, value, initial, maxit=30, maxsteps=20, lamb=10,
             RuntimeWarning)
 
 
+def _levmarq_system(hess, gradient, precondition, inner):
+    """
+    Build the (preconditioned) linear system of a Levemberg-Marquardt step.
+
+    Returns the Hessian, the minus gradient, the sparse diagonal matrix used
+    for the step regularization, and whether to solve iteratively.
+    """
+    minus_gradient = -gradient
+    iterative = inner == 'cg' or _is_operator(hess)
+    if precondition and not iterative:
+        diag = numpy.abs(safe_diagonal(hess))
+        diag[diag < 10 ** -10] = 10 ** -10
+        precond = scipy.sparse.diags(1. / diag, 0).tocsr()
+        hess = safe_dot(precond, hess)
+        minus_gradient = safe_dot(precond, minus_gradient)
+    hess_diag = safe_diagonal(hess)
+    if hess_diag is None:
+        hess_diag = numpy.ones(minus_gradient.size)
+    diag = scipy.sparse.diags(hess_diag, 0).tocsr()
+    return hess, minus_gradient, diag, iterative
+
+
 def steepest(gradient, value, initial, maxit=1000, linesearch=True,
              maxsteps=30, beta=0.1, tol=10**-5):
     r"""
@@ -449,13 +1045,19 @@ def steepest(gradient, value, initial, maxit=1000, linesearch=True,
 
 
 def acor(value, bounds, nparams, nants=None, archive_size=None, maxit=1000,
-         diverse=0.5, evap=0.85, seed=None):
+         diverse=0.5, evap=0.85, seed=None, njobs=1, threads=False):
     """
     Minimize the objective function using ACO-R.
 
     ACO-R stands for Ant Colony Optimization for Continuous Domains (Socha and
     Dorigo, 2008).
 
+    All ants of an iteration are generated at once from the solution archive
+    (sampling from normal distributions truncated to the bounds) and then
+    placed in the archive. The objective function can be evaluated for the
+    ants in parallel (using *njobs* processes or threads). Use this when the
+    objective function is expensive (e.g., a costly forward model).
+
     Parameters:
 
     * value : function
@@ -484,6 +1086,15 @@ def acor(value, bounds, nparams, nants=None, archive_size=None, maxit=1000,
         search is.
     * seed : None or int
         Seed for the random number generator.
+    * njobs : int
+        Number of processes (or threads) used to evaluate the objective
+        function. If 1, will evaluate sequentially. With processes, *value*
+        must be picklable.
+    * threads : True or False
+        If True, will use threads instead of processes when ``njobs > 1``.
+        Threads avoid copying the objective function to other processes and
+        are a good option if it spends its time in code that releases the GIL
+        (like numpy or compiled extensions).
 
     Yields:
 
@@ -503,6 +1114,28 @@ def acor(value, bounds, nparams, nants=None, archive_size=None, maxit=1000,
                 Value of the objective function corresponding to the best
                 estimate per iteration.
 
+    Examples:
+
+    Minimize the norm of a vector (the minimum is the null vector):
+
+    >>> import numpy
+    >>> for i, p, stats in acor(numpy.linalg.norm, bounds=[-1, 2], nparams=3,
+    ...                         maxit=300, seed=0):
+    ...     continue
+    >>> print(numpy.allclose(p, 0, atol=1e-4))
+    True
+    >>> stats['iterations']
+    300
+
+    The ants are evaluated in the same order in a pool of processes (or
+    threads), so the result is the same for the same seed:
+
+    >>> for i, pool_p, stats in acor(numpy.linalg.norm, bounds=[-1, 2],
+    ...                              nparams=3, maxit=300, seed=0, njobs=2):
+    ...     continue
+    >>> print(numpy.array_equal(p, pool_p))
+    True
+
     """
     stats = dict(method="Ant Colony Optimization for Continuous Domains",
                  iterations=0,
@@ -514,59 +1147,103 @@ def acor(value, bounds, nparams, nants=None, archive_size=None, maxit=1000,
     if archive_size is None:
         archive_size = 10 * nants
     # Check is giving bounds for each parameter or one for all
-    bounds = numpy.array(bounds)
+    bounds = numpy.array(bounds, dtype=numpy.float64)
     if bounds.size == 2:
-        low, high = bounds
-        archive = numpy.random.uniform(low, high, (archive_size, nparams))
+        low = numpy.full(nparams, bounds[0])
+        high = numpy.full(nparams, bounds[1])
     else:
-        archive = numpy.empty((archive_size, nparams))
-        bounds = bounds.reshape((nparams, 2))
-        for i, bound in enumerate(bounds):
-            low, high = bound
-            archive[:, i] = numpy.random.uniform(low, high, archive_size)
-    # Compute the inital pheromone trail based on the objetive function value
-    trail = numpy.fromiter((value(p) for p in archive), dtype=numpy.float)
-    # Sort the archive of initial random solutions
-    order = numpy.argsort(trail)
-    archive = [archive[i] for i in order]
-    trail = trail[order].tolist()
-    stats['objective'].append(trail[0])
-    # Compute the weights (probabilities) of the solutions in the archive
-    amp = 1. / (diverse * archive_size * numpy.sqrt(2 * numpy.pi))
-    variance = 2 * diverse ** 2 * archive_size ** 2
-    weights = amp * numpy.exp(-numpy.arange(archive_size) ** 2 / variance)
-    weights /= numpy.sum(weights)
-    for iteration in range(maxit):
-        for k in range(nants):
-            # Sample the propabilities to produce new estimates
-            ant = numpy.empty(nparams, dtype=numpy.float)
-            # 1. Choose a pdf from the archive
-            pdf = numpy.searchsorted(
-                numpy.cumsum(weights),
-                numpy.random.uniform())
-            for i in range(nparams):
-                # 2. Get the mean and stddev of the chosen pdf
-                mean = archive[pdf][i]
-                std = (evap / (archive_size - 1)) * numpy.sum(
-                    abs(p[i] - archive[pdf][i]) for p in archive)
-                # 3. Sample the pdf until the samples are in bounds
-                for atempt in range(100):
-                    ant[i] = numpy.random.normal(mean, std)
-                    if bounds.size == 2:
-                        low, high = bounds
-                    else:
-                        low, high = bounds[i]
-                    if ant[i] >= low and ant[i] <= high:
-                        break
-            pheromone = value(ant)
-            # Place the new estimate in the archive
-            place = numpy.searchsorted(trail, pheromone)
-            if place == archive_size:
-                continue
-            trail.insert(place, pheromone)
-            trail.pop()
-            archive.insert(place, ant)
-            archive.pop()
-        stats['objective'].append(trail[0])
-        stats['iterations'] += 1
-        yield iteration, archive[0], copy.deepcopy(stats)
+        low, high = bounds.reshape((nparams, 2)).T
+    archive = numpy.random.uniform(low, high, (archive_size, nparams))
+    if njobs > 1:
+        if threads:
+            pool = multiprocessing.pool.ThreadPool(njobs)
+        else:
+            pool = multiprocessing.Pool(njobs)
+        evaluate = pool.map
+    else:
+        pool = None
+        evaluate = map
+    try:
+        # Compute the inital pheromone trail based on the objetive function
+        # value
+        trail = numpy.fromiter(evaluate(value, archive), dtype=numpy.float64)
+        # Sort the archive of initial random solutions
+        order = numpy.argsort(trail, kind='mergesort')
+        archive, trail = archive[order], trail[order]
+        stats['objective'].append(float(trail[0]))
+        # Compute the weights (probabilities) of the solutions in the archive
+        amp = 1. / (diverse * archive_size * numpy.sqrt(2 * numpy.pi))
+        variance = 2 * diverse ** 2 * archive_size ** 2
+        weights = amp * numpy.exp(-numpy.arange(archive_size) ** 2 / variance)
+        weights /= numpy.sum(weights)
+        cumulative = numpy.cumsum(weights)
+        for iteration in range(maxit):
+            # 1. Choose a pdf from the archive for each ant
+            pdfs = numpy.searchsorted(
+                cumulative, numpy.random.uniform(size=nants))
+            pdfs = numpy.minimum(pdfs, archive_size - 1)
+            # 2. Get the mean and stddev of the chosen pdfs
+            means = archive[pdfs]
+            stds = (evap / (archive_size - 1)) * _absolute_deviations(
+                archive, pdfs)
+            # 3. Sample the pdfs truncated to the bounds
+            ants = _truncated_normal(means, stds, low, high)
+            pheromone = numpy.fromiter(evaluate(value, ants),
+                                       dtype=numpy.float64)
+            # Place the new estimates in the archive and keep the best
+            order = numpy.argsort(numpy.concatenate([trail, pheromone]),
+                                  kind='mergesort')[:archive_size]
+            archive = numpy.concatenate([archive, ants])[order]
+            trail = numpy.concatenate([trail, pheromone])[order]
+            stats['objective'].append(float(trail[0]))
+            stats['iterations'] += 1
+            yield iteration, archive[0].copy(), copy.deepcopy(stats)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def _absolute_deviations(archive, rows):
+    """
+    Sum of the absolute differences between the given rows of the archive and
+    all of its rows (for each parameter).
+
+    Uses the sorted columns of the archive and their cumulative sums, so the
+    memory used is proportional to the size of the archive instead of the
+    size of the archive times the number of rows.
+    """
+    size, nparams = archive.shape
+    columns = numpy.arange(nparams)
+    order = numpy.argsort(archive, axis=0, kind='mergesort')
+    prefix = numpy.zeros((size + 1, nparams))
+    numpy.cumsum(archive[order, columns], axis=0, out=prefix[1:])
+    # Position of each element of the archive in its sorted column
+    rank = numpy.empty_like(order)
+    rank[order, columns] = numpy.arange(size)[:, numpy.newaxis]
+    rank = rank[rows]
+    values = archive[rows]
+    # The elements before the row in the sorted column are smaller and the
+    # ones after are larger
+    deviations = (prefix[-1] - 2*prefix[rank, columns] +
+                  values*(2*rank - size))
+    return numpy.maximum(deviations, 0)
+
+
+def _truncated_normal(means, stds, low, high):
+    """
+    Sample normal distributions truncated to [low, high].
+
+    Uses the inverse of the cumulative distribution function so that all
+    samples are drawn at once. The arrays are broadcast against each other.
+    """
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        lower = scipy.special.ndtr((low - means)/stds)
+        upper = scipy.special.ndtr((high - means)/stds)
+        uniform = numpy.random.uniform(size=numpy.shape(means))
+        samples = means + stds*scipy.special.ndtri(
+            lower + uniform*(upper - lower))
+    # Null standard deviations (or numerical problems in the tails) produce
+    # NaN or inf. Use the mean for those.
+    samples = numpy.where(numpy.isfinite(samples), samples, means)
+    return numpy.clip(samples, low, high)
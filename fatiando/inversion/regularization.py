@@ -192,6 +192,17 @@ class Damping(Regularization):
         """
         return self.regul_param*numpy.linalg.norm(p)**2
 
+    def _least_squares(self):
+        """
+        The matrix and vector of the equivalent least-squares system.
+
+        Used by the ``'lsqr'`` optimization method (see
+        :meth:`fatiando.inversion.misfit.Misfit._least_squares`).
+        """
+        matrix = numpy.sqrt(self.regul_param)*scipy.sparse.identity(
+            self.nparams, format='csr')
+        return [matrix], [numpy.zeros(self.nparams)]
+
 
 class Smoothness(Regularization):
     r"""
@@ -224,7 +235,7 @@ class Smoothness(Regularization):
 
     Parameters:
 
-    * fdmat : 2d-array or sparse matrix
+    * fdmat : 2d-array, sparse matrix or LinearOperator
         The finite difference matrix
 
     Examples:
@@ -323,6 +334,16 @@ class Smoothness(Regularization):
         # Need to divide by 2 because the hessian is 2*R.T*R
         return self.regul_param*safe_dot(p.T, safe_dot(self.hessian(p), p))/2
 
+    def _least_squares(self):
+        """
+        The matrix and vector of the equivalent least-squares system.
+
+        Used by the ``'lsqr'`` optimization method (see
+        :meth:`fatiando.inversion.misfit.Misfit._least_squares`).
+        """
+        matrix = numpy.sqrt(self.regul_param)*self.fdmat
+        return [matrix], [numpy.zeros(self.fdmat.shape[0])]
+
 
 class Smoothness1D(Smoothness):
     """
@@ -475,7 +496,7 @@ class TotalVariation(Regularization):
         is, the closer total variation is to
         :class:`~fatiando.inversion.regularization.Smoothness`. Should be a
         small, positive value.
-    * fdmat : 2d-array or sparse matrix
+    * fdmat : 2d-array, sparse matrix or LinearOperator
         The finite difference matrix
 
     """
@@ -523,7 +544,8 @@ class TotalVariation(Regularization):
         derivs = safe_dot(self.fdmat, p)
         q = self.beta/((derivs**2 + self.beta)**1.5)
         q_matrix = scipy.sparse.diags(q, 0).tocsr()
-        return self.regul_param*safe_dot(self.fdmat.T, q_matrix*self.fdmat)
+        return self.regul_param*safe_dot(self.fdmat.T,
+                                         safe_dot(q_matrix, self.fdmat))
 
     def gradient(self, p):
         """
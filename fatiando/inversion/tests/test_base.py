@@ -0,0 +1,170 @@
+from __future__ import division, absolute_import
+from future.builtins import super
+import copy
+import numpy.testing as npt
+import numpy as np
+import scipy.sparse
+
+from ..base import CachedMethod, CachedMethodPermanent
+from .. import Misfit, Damping, Smoothness1D, Smoothness2D
+from .test_optimization import Linear
+
+
+class Counter(object):
+    "Counts how many times the cached method is actually run"
+
+    def __init__(self, **kwargs):
+        self.runs = 0
+        self.square = CachedMethod(self, 'square', **kwargs)
+
+    def square(self, p):
+        self.runs += 1
+        return p**2
+
+
+class Quadratic(Misfit):
+    "Non-linear test problem"
+
+    def __init__(self):
+        super().__init__(data=np.ones(5), nparams=1, islinear=False)
+        self.x = np.linspace(0, 1, 5)
+
+    def predicted(self, p):
+        return p[0]**2*self.x
+
+    def jacobian(self, p):
+        return np.transpose([2*p[0]*self.x])
+
+
+def test_cached_method_lru():
+    "CachedMethod discards the least recently used values first"
+    obj = Counter(maxsize=2)
+    a, b, c = np.ones(10), 2*np.ones(10), 3*np.ones(10)
+    obj.square(a)
+    obj.square(b)
+    obj.square(a)
+    # b is now the least recently used
+    obj.square(c)
+    assert obj.runs == 3
+    obj.square(a)
+    obj.square(c)
+    assert obj.runs == 3
+    obj.square(b)
+    assert obj.runs == 4
+    info = obj.square.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (3, 4, 2)
+    assert info.nbytes == 2*a.nbytes
+    obj.square.evict(b)
+    obj.square.evict(b)
+    assert obj.square.cache_info().currsize == 1
+    assert obj.square.cache_info().nbytes == a.nbytes
+
+
+def test_cached_method_maxbytes():
+    "CachedMethod keeps the values under the memory budget"
+    obj = Counter(maxsize=None, maxbytes=250)
+    for i in range(5):
+        obj.square(i*np.ones(10))
+    info = obj.square.cache_info()
+    assert info.currsize == 3
+    assert info.nbytes == 240
+    # Values larger than the budget are still returned and cached alone
+    obj = Counter(maxsize=None, maxbytes=10)
+    obj.square(np.ones(10))
+    assert obj.square.cache_info().currsize == 1
+
+
+def test_cached_method_copy():
+    "Copies of a CachedMethod don't share the cache"
+    obj = Counter(maxsize=None)
+    obj.square(np.ones(3))
+    other = copy.copy(obj.square)
+    other.hard_reset()
+    assert obj.square.cache_info().currsize == 1
+    obj.square(np.zeros(3))
+    assert other.cache_info().currsize == 0
+
+
+def test_misfit_set_cache():
+    "Misfit.set_cache configures predicted and the non-linear Jacobian"
+    misfit = Quadratic().set_cache(maxsize=3)
+    for i in range(4):
+        misfit.predicted(np.array([i]))
+        misfit.jacobian(np.array([i]))
+    for method in [misfit.predicted, misfit.jacobian]:
+        assert method.maxsize == 3
+        assert method.cache_info().currsize == 3
+    misfit.predicted(np.array([1]))
+    assert misfit.predicted.cache_info().hits == 1
+    other = misfit.copy()
+    other.predicted(np.array([10]))
+    assert misfit.predicted.cache_info().misses == 4
+
+
+def test_fit_profile_phases():
+    "The profile separates predicted, jacobian and the linear solves"
+    random = np.random.RandomState(0)
+    matrix = random.uniform(size=(30, 12))
+    solver = Linear(matrix, random.uniform(size=30)) + Smoothness1D(12)
+    solver.config('newton', initial=np.zeros(12), maxit=3).fit()
+    phases = solver.profile_['phases']
+    assert sorted(phases) == ['gradient', 'hessian', 'jacobian', 'predicted',
+                              'solve', 'value']
+    assert phases['predicted']['calls'] > 0
+    assert phases['jacobian']['calls'] > 0
+    assert phases['solve']['calls'] == solver.stats_['iterations']
+    total = sum(phase['time'] for phase in phases.values())
+    npt.assert_allclose(total, solver.profile_['total'])
+    assert all(phase['time'] >= 0 for phase in phases.values())
+    # The timers are removed after fit
+    assert isinstance(solver[0].predicted, CachedMethod)
+    assert isinstance(solver[0].jacobian, CachedMethodPermanent)
+
+
+def test_multiobjective_hessian_not_overwritten():
+    "Hessians returned by MultiObjective aren't changed by later calls"
+    random = np.random.RandomState(0)
+    matrix = random.uniform(size=(30, 12))
+    data = random.uniform(size=30)
+    for regul in [Smoothness1D(12), Smoothness1D(12) + Damping(12)]:
+        solver = Linear(matrix, data) + 0.5*regul
+        first = solver.hessian(None)
+        kept = np.array(first)
+        solver[0].set_weights(random.uniform(1, 2, 30))
+        second = solver.hessian(None)
+        npt.assert_allclose(first, kept)
+        assert not np.allclose(second, kept)
+        dense = 2*matrix.T.dot(solver[0].weights.toarray()).dot(matrix)
+        for obj in solver[1:]:
+            dense = dense + obj.hessian(None).toarray()
+        npt.assert_allclose(second, dense)
+
+
+def test_multiobjective_sparse_hessian():
+    "Sums of sparse Hessians are sparse, correct and not overwritten"
+    shape = (6, 5)
+    nparams = shape[0]*shape[1]
+    solver = Smoothness2D(shape) + 0.1*Damping(nparams)
+    true = (Smoothness2D(shape).hessian(None) +
+            0.1*Damping(nparams).hessian(None)).toarray()
+    first = solver.hessian(None)
+    second = solver.hessian(None)
+    assert scipy.sparse.issparse(first)
+    assert first.data is not second.data
+    npt.assert_allclose(first.toarray(), true)
+    second.data *= 2
+    npt.assert_allclose(first.toarray(), true)
+    npt.assert_allclose(solver.hessian(None).toarray(), true)
+    # A component with a different structure (and duplicate elements)
+    # triggers a new structure
+    solver = 2*(Smoothness2D(shape) + 0.1*Damping(nparams))
+    npt.assert_allclose(solver.hessian(None).toarray(), 2*true)
+    rows = np.array([0, 0, 3])
+    coo = scipy.sparse.coo_matrix((np.ones(3), (rows, rows)),
+                                  shape=(nparams, nparams))
+    solver[1].hessian = lambda p: coo
+    extra = np.zeros((nparams, nparams))
+    extra[0, 0], extra[3, 3] = 2, 1
+    npt.assert_allclose(solver.hessian(None).toarray(),
+                        2*(Smoothness2D(shape).hessian(None).toarray() +
+                           extra))
@@ -0,0 +1,72 @@
+from __future__ import division, absolute_import
+from future.builtins import super
+import numpy.testing as npt
+import numpy as np
+from pytest import raises
+
+from .. import Misfit, Damping
+from ..compression import WaveletCompressed
+from .test_optimization import Linear
+
+
+class Compressed(Misfit):
+    "Linear problem with a wavelet compressed Jacobian"
+
+    def __init__(self, matrix, data, shape):
+        super().__init__(data=data, nparams=matrix.shape[1], islinear=True)
+        self.operator = WaveletCompressed(matrix, shape, tol=0)
+
+    def predicted(self, p):
+        return self.operator.matvec(p)
+
+    def jacobian(self, p):
+        return self.operator
+
+
+def _jacobian(shape, ndata=15):
+    "A random Jacobian for a mesh with the given shape"
+    random = np.random.RandomState(0)
+    return random.uniform(-1, 1, size=(ndata, int(np.prod(shape))))
+
+
+def test_wavelet_compressed_exact():
+    "WaveletCompressed with tol=0 is exact for shapes that aren't powers of 2"
+    shape = (3, 5, 6)
+    jacobian = _jacobian(shape)
+    compressed = WaveletCompressed(jacobian, shape, tol=0)
+    assert compressed.shape == jacobian.shape
+    assert compressed.padded_shape == (4, 8, 8)
+    random = np.random.RandomState(1)
+    p = random.uniform(-1, 1, jacobian.shape[1])
+    d = random.uniform(-1, 1, jacobian.shape[0])
+    m = random.uniform(-1, 1, (jacobian.shape[1], 4))
+    npt.assert_allclose(compressed.matvec(p), jacobian.dot(p))
+    npt.assert_allclose(compressed.rmatvec(d), jacobian.T.dot(d))
+    npt.assert_allclose(compressed.matmat(m), jacobian.dot(m))
+
+
+def test_wavelet_compressed_blocks():
+    "WaveletCompressed gives the same matrix with blocks of rows"
+    shape = (5, 7)
+    jacobian = _jacobian(shape, ndata=23)
+    dense = WaveletCompressed(jacobian, shape, tol=0.1)
+    blocks = (jacobian[i:i + 5] for i in range(0, 23, 5))
+    blocked = WaveletCompressed(blocks, shape, tol=0.1)
+    assert blocked.shape == dense.shape
+    npt.assert_allclose(blocked.coefs.toarray(), dense.coefs.toarray())
+    with raises(AssertionError):
+        WaveletCompressed(iter([]), shape)
+
+
+def test_wavelet_compressed_misfit():
+    "A Misfit with a WaveletCompressed Jacobian solves with cg and lsqr"
+    shape = (4, 5)
+    jacobian = _jacobian(shape, ndata=30)
+    data = jacobian.dot(np.random.RandomState(1).uniform(-1, 1, 20))
+    exact = (Linear(jacobian, data) +
+             1e-3*Damping(20)).config('linear').fit().p_
+    for method in ['cg', 'lsqr']:
+        solver = Compressed(jacobian, data, shape) + 1e-3*Damping(20)
+        solver.config(method, tol=1e-12, maxit=100).fit()
+        npt.assert_allclose(solver.p_, exact, rtol=1e-6, atol=1e-8,
+                            err_msg=method)
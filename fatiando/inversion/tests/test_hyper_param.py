@@ -0,0 +1,127 @@
+from __future__ import division, absolute_import, print_function
+from future.builtins import super
+import numpy.testing as npt
+import numpy as np
+
+from .. import hyper_param
+from .. import (Misfit, Damping, Smoothness1D, GCV, DiscrepancyPrinciple,
+                LCurve)
+
+
+class Blur(Misfit):
+    "Linear test problem: blur with a Gaussian kernel"
+
+    def __init__(self, data, nparams):
+        super().__init__(data=data, nparams=nparams, islinear=True)
+        x = np.linspace(0, 1, nparams)
+        xd = np.linspace(0, 1, data.size)
+        self.kernel = np.exp(-(xd[:, None] - x)**2/0.002)
+
+    def predicted(self, p):
+        return self.kernel.dot(p)
+
+    def jacobian(self, p):
+        return self.kernel
+
+
+def _dense(misfit, regul, mu):
+    "Solution, weighted residual norm and influence trace with dense matrices"
+    kernel, weights = misfit.kernel, misfit.weights.toarray()
+    hessian = 2*kernel.T.dot(weights).dot(kernel) + mu*regul.hessian(None)
+    p = np.linalg.solve(hessian, 2*kernel.T.dot(weights).dot(misfit.data))
+    residuals = misfit.data - kernel.dot(p)
+    influence = 2*kernel.dot(np.linalg.solve(hessian,
+                                             kernel.T.dot(weights)))
+    return p, residuals.dot(weights).dot(residuals), np.trace(influence)
+
+
+def test_gcv_bidiagonal_matches_dense():
+    "GCV from a single bidiagonalization matches dense weighted solutions"
+    nparams = 40
+    true = np.sin(2*np.pi*np.linspace(0, 1, nparams))
+    weights = np.random.RandomState(0).uniform(0.5, 2, 60)
+    data = Blur(np.zeros(60), nparams).predicted(true)
+    data += np.random.RandomState(1).normal(0, 0.05, 60)
+    regul_params = [1e-3, 1e-2, 1e-1, 1, 10]
+    for regul in [Damping(nparams), Smoothness1D(nparams)]:
+        gcv = GCV(Blur(data, nparams).set_weights(weights), regul,
+                  regul_params, tol=1e-10).fit()
+        assert gcv.stats_['method'] == 'Golub-Kahan bidiagonalization'
+        # The traces are projected onto the Krylov subspace. They are exact
+        # only if the bidiagonalization runs to completion (tol=0).
+        full = GCV(Blur(data, nparams).set_weights(weights), regul,
+                   regul_params, tol=0).fit()
+        for i, mu in enumerate(regul_params):
+            p, dnorm, exact = _dense(gcv.datamisfit, regul, mu)
+            npt.assert_allclose(gcv.objectives[i].p_, p, rtol=1e-5,
+                                atol=1e-6)
+            npt.assert_allclose(gcv.trace[i], exact, rtol=1e-2)
+            npt.assert_allclose(full.trace[i], exact, rtol=1e-8)
+        disc = DiscrepancyPrinciple(Blur(data, nparams).set_weights(weights),
+                                    regul, regul_params, noise=0.05,
+                                    tol=1e-10).fit()
+        dnorm = [_dense(disc.datamisfit, regul, mu)[1] for mu in regul_params]
+        npt.assert_allclose(disc.dnorm, dnorm, rtol=1e-5)
+
+
+def test_regul_param_callback():
+    "The callback is called once for each regularization parameter"
+    nparams = 20
+    data = Blur(np.zeros(30), nparams).predicted(np.ones(nparams))
+    regul_params = [1e-2, 1e-1, 1]
+    for method in [None, 'linear']:
+        for selector in [GCV(Blur(data, nparams), Damping(nparams),
+                             regul_params, seed=0),
+                         DiscrepancyPrinciple(Blur(data, nparams),
+                                              Damping(nparams), regul_params,
+                                              noise=0.1),
+                         LCurve(Blur(data, nparams), Damping(nparams),
+                                regul_params)]:
+            if method is not None:
+                selector.config(method)
+            calls = []
+            selector.fit(callback=lambda i, p, stats: calls.append((i, p)))
+            assert [i for i, _ in calls] == [0, 1, 2]
+            for (i, p), solver in zip(calls, selector.objectives):
+                npt.assert_allclose(p, solver.p_)
+
+
+def test_lcurve_factorized_matches_separate():
+    "LCurve from one eigendecomposition gives the same as separate solves"
+    nparams = 30
+    true = np.sin(2*np.pi*np.linspace(0, 1, nparams))
+    data = Blur(np.zeros(50), nparams).predicted(true)
+    data += np.random.RandomState(0).normal(0, 0.05, 50)
+    weights = np.random.RandomState(1).uniform(0.5, 2, 50)
+    regul_params = [10**i for i in range(-4, 3)]
+    for regul in [Damping(nparams), Smoothness1D(nparams)]:
+        misfit = Blur(data, nparams).set_weights(weights)
+        lcurve = LCurve(misfit, regul, regul_params).fit()
+        assert lcurve.stats_['method'] == 'Generalized eigendecomposition'
+        for mu, solver in zip(regul_params, lcurve.objectives):
+            separate = (Blur(data, nparams).set_weights(weights) +
+                        mu*regul).config('linear').fit()
+            npt.assert_allclose(solver.p_, separate.p_, rtol=1e-6,
+                                atol=1e-8)
+            npt.assert_allclose(misfit.value(solver.p_),
+                                misfit.value(separate.p_), rtol=1e-8)
+
+
+def test_lcurve_factorized_fallback(monkeypatch):
+    "LCurve solves separately if the Hessians can't be factorized"
+    nparams = 20
+    data = Blur(np.zeros(30), nparams).predicted(np.ones(nparams))
+    regul_params = [0.1, 1, 10]
+    # Null regularization
+    lcurve = LCurve(Blur(data, nparams), 0*Damping(nparams),
+                    regul_params).fit()
+    assert lcurve.stats_['method'] != 'Generalized eigendecomposition'
+    assert np.all(np.isfinite(lcurve.p_))
+    # Sparse Hessians too large to make dense
+    monkeypatch.setattr(hyper_param, '_MAX_DENSE_PARAMS', nparams - 1)
+    lcurve = LCurve(Blur(data, nparams), Damping(nparams),
+                    regul_params).fit()
+    assert lcurve.stats_['method'] != 'Generalized eigendecomposition'
+    for mu, solver in zip(regul_params, lcurve.objectives):
+        separate = (Blur(data, nparams) + mu*Damping(nparams)).fit()
+        npt.assert_allclose(solver.p_, separate.p_)
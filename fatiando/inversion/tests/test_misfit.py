@@ -0,0 +1,61 @@
+from __future__ import division, absolute_import, print_function
+from future.builtins import super
+import numpy.testing as npt
+import numpy as np
+
+from .. import Misfit
+from ..base import CachedMethod, ApproximateJacobian
+
+
+class Decay(Misfit):
+    "Non-linear test problem: fit the sum of two exponential decays"
+
+    def __init__(self, t, data):
+        super().__init__(data=data, nparams=4, islinear=False)
+        self.t = t
+
+    def predicted(self, p):
+        return p[0]*np.exp(-p[1]*self.t) + p[2]*np.exp(-p[3]*self.t)
+
+    def jacobian(self, p):
+        t = self.t
+        return np.transpose([np.exp(-p[1]*t), -p[0]*t*np.exp(-p[1]*t),
+                             np.exp(-p[3]*t), -p[2]*t*np.exp(-p[3]*t)])
+
+
+def test_levmarq_jacobian_update():
+    "levmarq converges with fewer exact Jacobians if they are updated"
+    t = np.linspace(0, 5, 100)
+    true = np.array([2, 3, 1, 0.5])
+    data = Decay(t, np.zeros(t.size)).predicted(true)
+    initial = np.array([1.5, 2, 1.5, 0.8])
+    exact = Decay(t, data).config('levmarq', initial=initial).fit()
+    npt.assert_allclose(exact.p_, true, rtol=1e-5)
+    nexact = exact.jacobian.misses
+    for method in ['reuse', 'broyden']:
+        for refresh in [None, 3]:
+            solver = Decay(t, data).set_jacobian_update(method, refresh)
+            solver.config('levmarq', initial=initial, maxit=100).fit()
+            npt.assert_allclose(solver.p_, true, rtol=1e-5,
+                                err_msg='{} {}'.format(method, refresh))
+            assert solver.jacobian.misses < nexact, (method, refresh)
+            assert solver.jacobian.updates > 0
+
+
+def test_cache_settings_kept():
+    "set_cache and set_jacobian_update don't undo each other"
+    misfit = Decay(np.linspace(0, 1, 5), np.zeros(5))
+    misfit.set_cache(maxsize=3, maxbytes=1000)
+    misfit.set_jacobian_update('broyden', refresh=2)
+    assert isinstance(misfit.jacobian, ApproximateJacobian)
+    assert misfit.jacobian.maxsize == 3
+    assert misfit.jacobian.maxbytes == 1000
+    misfit.set_cache(maxsize=4)
+    assert isinstance(misfit.jacobian, ApproximateJacobian)
+    assert misfit.jacobian.method == 'broyden'
+    assert misfit.jacobian.refresh_every == 2
+    assert misfit.jacobian.maxsize == 4
+    assert misfit.predicted.maxsize == 4
+    misfit.set_jacobian_update(None)
+    assert type(misfit.jacobian) is CachedMethod
+    assert misfit.jacobian.maxsize == 4
@@ -0,0 +1,101 @@
+from __future__ import division, absolute_import, print_function
+from future.builtins import super
+import numpy.testing as npt
+import numpy as np
+from scipy.sparse.linalg import aslinearoperator
+
+from .. import Misfit, Damping, Smoothness1D
+from ..optimization import acor, _absolute_deviations
+
+
+class Linear(Misfit):
+    "Linear test problem with an optional matrix-free Jacobian"
+
+    def __init__(self, matrix, data, operator=False):
+        super().__init__(data=data, nparams=matrix.shape[1], islinear=True)
+        self.matrix = matrix
+        self.operator = operator
+
+    def predicted(self, p):
+        return self.matrix.dot(p)
+
+    def jacobian(self, p):
+        if self.operator:
+            return aslinearoperator(self.matrix)
+        return self.matrix
+
+
+def _problem(operator=False, weights=True):
+    "A regularized linear problem and its solution with dense matrices"
+    random = np.random.RandomState(0)
+    matrix = random.uniform(-1, 1, size=(50, 20))
+    data = matrix.dot(random.uniform(-1, 1, 20)) + random.normal(0, 0.1, 50)
+    misfit, dense = Linear(matrix, data, operator), Linear(matrix, data)
+    if weights:
+        misfit.set_weights(random.uniform(0.5, 2, 50))
+        dense.set_weights(misfit.weights)
+    solver = 10*misfit + Smoothness1D(20) + 0.1*Damping(20)
+    exact = 10*dense + Smoothness1D(20) + 0.1*Damping(20)
+    return solver, exact.config('linear').fit().p_
+
+
+def test_krylov_solvers_match_linear():
+    "cg, lsqr and minres give the same solution as the direct solver"
+    for operator in [False, True]:
+        for method in ['cg', 'lsqr', 'minres']:
+            solver, exact = _problem(operator=operator)
+            solver.config(method, tol=1e-10).fit()
+            npt.assert_allclose(solver.p_, exact, rtol=1e-6, atol=1e-8,
+                                err_msg='{} {}'.format(method, operator))
+
+
+def test_lsqr_uses_the_jacobian():
+    "lsqr solves the stacked system instead of the normal equations"
+    for weights in [False, True]:
+        solver, exact = _problem(weights=weights)
+        # Break the Hessian to make sure it isn't used
+        solver[0].hessian = None
+        solver[1].hessian = None
+        solver[2].hessian = None
+        solver.config('lsqr', tol=1e-12).fit()
+        npt.assert_allclose(solver.p_, exact, rtol=1e-8, atol=1e-10)
+        assert solver.stats_['method'] == 'LSQR'
+        assert solver.stats_['residual'][0] < 1e-8
+
+
+def test_newton_levmarq_inner_cg():
+    "newton and levmarq with Conjugate Gradient inner solves converge"
+    for method in ['newton', 'levmarq']:
+        for operator in [False, True]:
+            solver, exact = _problem(operator=operator)
+            solver.config(method, initial=np.zeros(20), inner='cg',
+                          inner_tol=1e-10, tol=1e-12).fit()
+            npt.assert_allclose(solver.p_, exact, rtol=1e-6, atol=1e-8,
+                                err_msg='{} {}'.format(method, operator))
+
+
+def test_acor_absolute_deviations():
+    "_absolute_deviations matches the sum over the whole archive"
+    random = np.random.RandomState(0)
+    archive = random.uniform(-1, 1, size=(30, 4))
+    # Repeated values must also work
+    archive[10] = archive[3]
+    archive[20, 1] = archive[5, 1]
+    rows = random.randint(0, 30, size=12)
+    true = np.array([np.sum(np.abs(archive[row] - archive), axis=0)
+                     for row in rows])
+    npt.assert_allclose(_absolute_deviations(archive, rows), true)
+
+
+def test_acor_pool_same_result():
+    "acor gives the same result with a pool of processes or threads"
+    results = []
+    for njobs, threads in [(1, False), (2, False), (2, True)]:
+        for i, p, stats in acor(np.linalg.norm, bounds=[-1, 2], nparams=3,
+                                maxit=50, seed=0, njobs=njobs,
+                                threads=threads):
+            continue
+        results.append((p, stats['objective']))
+    for p, objective in results[1:]:
+        npt.assert_array_equal(p, results[0][0])
+        npt.assert_array_equal(objective, results[0][1])
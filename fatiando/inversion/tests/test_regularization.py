@@ -0,0 +1,20 @@
+from __future__ import division, absolute_import
+import numpy.testing as npt
+import numpy as np
+from scipy.sparse.linalg import aslinearoperator
+
+from .. import Smoothness, TotalVariation
+
+
+def test_linear_operator_fdmat():
+    "Smoothness and TotalVariation accept a LinearOperator fdmat"
+    random = np.random.RandomState(0)
+    fdmat = random.uniform(-1, 1, size=(15, 10))
+    p = random.uniform(-1, 1, 10)
+    v = random.uniform(-1, 1, 10)
+    for reg in [Smoothness, lambda m: TotalVariation(1e-5, m)]:
+        dense, operator = reg(fdmat), reg(aslinearoperator(fdmat))
+        npt.assert_allclose(operator.value(p), dense.value(p))
+        npt.assert_allclose(operator.gradient(p), dense.gradient(p))
+        npt.assert_allclose(operator.hessian(p).dot(v),
+                            dense.hessian(p).dot(v))
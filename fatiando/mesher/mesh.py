@@ -296,10 +296,13 @@ class PointGrid(object):
         """
         self.props[prop] = values
 
-    def split(self, shape):
+    def split(self, shape, overlap=0):
         """
         Divide the grid into subgrids.
 
+        Subgrids can overlap their neighbors by a number of grid points (for
+        moving window processing).
+
         .. note::
 
             Remember that x is the North-South direction and y is East-West.
@@ -308,6 +311,10 @@ class PointGrid(object):
 
         * shape : tuple = (nx, ny)
             Number of subgrids along the x and y directions, respectively.
+        * overlap : int
+            Number of grid points that each subgrid extends into its neighbors
+            on every side. Subgrids on the border of the grid are not extended
+            beyond it.
 
         Returns:
 
@@ -356,6 +363,17 @@ class PointGrid(object):
             array([ 600.,  900.])
             array([  700.,  1000.])
             array([  800.,  1100.])
+            >>> grids = g.split((2, 3), overlap=1)
+            >>> for s in grids:
+            ...     s.props['bla']
+            array([1, 2, 4, 5, 7, 8])
+            array([1, 2, 3, 4, 5, 6, 7, 8, 9])
+            array([2, 3, 5, 6, 8, 9])
+            array([ 4,  5,  7,  8, 10, 11])
+            array([ 4,  5,  6,  7,  8,  9, 10, 11, 12])
+            array([ 5,  6,  8,  9, 11, 12])
+            >>> grids[0].shape
+            (3, 2)
 
         """
         nx, ny = shape
@@ -367,20 +385,23 @@ class PointGrid(object):
         xs = np.linspace(x1, x2, totalx)
         ys = np.linspace(y1, y2, totaly)
         mx, my = (totalx//nx, totaly//ny)
-        dx, dy = self.dx*(mx - 1), self.dy*(my - 1)
         subs = []
-        for i, xstart in enumerate(xs[::mx]):
-            for j, ystart in enumerate(ys[::my]):
-                area = [xstart, xstart + dx, ystart, ystart + dy]
+        for i in range(nx):
+            xi1 = max(i*mx - overlap, 0)
+            xi2 = min((i + 1)*mx + overlap, totalx)
+            for j in range(ny):
+                yj1 = max(j*my - overlap, 0)
+                yj2 = min((j + 1)*my + overlap, totaly)
+                area = [xs[xi1], xs[xi1] + self.dx*(xi2 - xi1 - 1),
+                        ys[yj1], ys[yj1] + self.dy*(yj2 - yj1 - 1)]
                 props = {}
                 for p in self.props:
                     pmatrix = np.reshape(self.props[p], self.shape)
-                    props[p] = pmatrix[i*mx:(i + 1)*mx,
-                                       j*my:(j + 1)*my].ravel()
+                    props[p] = pmatrix[xi1:xi2, yj1:yj2].ravel()
                 zmatrix = np.reshape(self.z, self.shape)
-                zs = zmatrix[i*mx:(i + 1)*mx,
-                             j*my:(j + 1)*my].ravel()
-                subs.append(PointGrid(area, zs, (mx, my), props))
+                zs = zmatrix[xi1:xi2, yj1:yj2].ravel()
+                subs.append(PointGrid(area, zs, (xi2 - xi1, yj2 - yj1),
+                                      props))
         return subs
 
     def copy(self):
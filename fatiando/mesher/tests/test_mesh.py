@@ -81,6 +81,26 @@ def test_split():
         npt.assert_allclose(grid.z, true)
 
 
+def test_split_overlap():
+    "split with overlap extends the subgrids into their neighbors"
+    area = [-1000., 1000., -2000., 0.]
+    shape = (20, 12)
+    zp = 100*np.arange(shape[0]*shape[1])
+    g = PointGrid(area, zp, shape)
+    g.addprop('bla', np.arange(g.size))
+    cores = g.split((4, 3))
+    grids = g.split((4, 3), overlap=2)
+    shapes = [(7, 6), (7, 8), (7, 6), (9, 6), (9, 8), (9, 6),
+              (9, 6), (9, 8), (9, 6), (7, 6), (7, 8), (7, 6)]
+    for grid, core, true in zip(grids, cores, shapes):
+        assert grid.shape == true
+        assert set(core.props['bla']).issubset(grid.props['bla'])
+        index = np.searchsorted(g.props['bla'], grid.props['bla'])
+        npt.assert_allclose(grid.x, g.x[index])
+        npt.assert_allclose(grid.y, g.y[index])
+        npt.assert_allclose(grid.z, g.z[index])
+
+
 def test_fails_invalid_index():
     "Indexing should fail for an invalid index"
     area, z, shape = [0, 10, 2, 6], 200, (2, 3)
@@ -78,6 +78,9 @@ def safe_dot(a, b):
 
     If *a* and *b* are dense, will use :func:`numpy.dot`. If either is sparse
     (from :mod:`scipy.sparse`) will use the multiplication operator (i.e., \*).
+    If *a* is a :class:`scipy.sparse.linalg.LinearOperator`, will use its
+    ``dot`` method. If only *b* is a ``LinearOperator``, the result is also a
+    ``LinearOperator``.
 
     Parameters:
 
@@ -90,6 +93,10 @@ def safe_dot(a, b):
         The dot product of *a* and *b*
 
     """
+    if isinstance(a, scipy.sparse.linalg.LinearOperator):
+        return a.dot(b)
+    if isinstance(b, scipy.sparse.linalg.LinearOperator):
+        return scipy.sparse.linalg.aslinearoperator(a).dot(b)
     if scipy.sparse.issparse(a) or scipy.sparse.issparse(b):
         return a * b
     else:
@@ -100,23 +107,98 @@ def safe_diagonal(matrix):
     """
     Get the diagonal of a matrix using the appropriate method.
 
+    If *matrix* is a :class:`scipy.sparse.linalg.LinearOperator`, the diagonal
+    can only be calculated if the operator has a ``diagonal`` method (like
+    :class:`~fatiando.utils.LinearOperatorSum`). Otherwise, will return None.
+
     Parameters:
 
-    * matrix : 2d-array, matrix, sparse matrix
+    * matrix : 2d-array, matrix, sparse matrix or LinearOperator
         The matrix...
 
     Returns:
 
-    * diag : 1d-array
+    * diag : 1d-array or None
         A numpy array with the diagonal of the matrix
 
     """
+    if isinstance(matrix, scipy.sparse.linalg.LinearOperator):
+        if hasattr(matrix, 'diagonal'):
+            return matrix.diagonal()
+        return None
     if scipy.sparse.issparse(matrix):
         return numpy.array(matrix.diagonal())
     else:
         return numpy.diagonal(matrix).copy()
 
 
+class LinearOperatorSum(scipy.sparse.linalg.LinearOperator):
+    """
+    A scaled sum of matrices and LinearOperators that knows its diagonal.
+
+    Behaves as a :class:`scipy.sparse.linalg.LinearOperator` equal to
+    ``scale*(terms[0] + terms[1] + ...)``. The terms are kept as they are so
+    that :func:`~fatiando.utils.safe_diagonal` can calculate the diagonal of
+    the sum (if it can calculate the diagonal of every term).
+
+    Parameters:
+
+    * terms : list
+        The matrices (dense or sparse) and LinearOperators that are summed.
+        All must have the same shape.
+    * scale : float
+        A scalar that multiplies the sum.
+
+    Examples:
+
+    >>> import numpy
+    >>> import scipy.sparse
+    >>> from scipy.sparse.linalg import aslinearoperator
+    >>> dense = numpy.array([[1., 2.], [3., 4.]])
+    >>> total = LinearOperatorSum([dense, scipy.sparse.identity(2)], scale=2)
+    >>> print(total.dot(numpy.ones(2)))
+    [ 8. 16.]
+    >>> print(safe_diagonal(total))
+    [ 4. 10.]
+
+    The diagonal is unknown if a term is a LinearOperator without a
+    ``diagonal`` method:
+
+    >>> total = LinearOperatorSum([aslinearoperator(dense),
+    ...                            scipy.sparse.identity(2)])
+    >>> print(safe_diagonal(total))
+    None
+
+    """
+
+    def __init__(self, terms, scale=1):
+        terms = list(terms)
+        dtype = numpy.result_type(*[numpy.dtype(t.dtype) for t in terms])
+        super(LinearOperatorSum, self).__init__(dtype, terms[0].shape)
+        self.terms = terms
+        self.scale = scale
+
+    def _matvec(self, vector):
+        result = sum(numpy.ravel(safe_dot(t, vector)) for t in self.terms)
+        return self.scale*result
+
+    def _rmatvec(self, vector):
+        result = sum(numpy.ravel(safe_dot(t.T, vector)) for t in self.terms)
+        return numpy.conj(self.scale)*result
+
+    def _transpose(self):
+        return LinearOperatorSum([t.T for t in self.terms], self.scale)
+
+    def diagonal(self):
+        """
+        The diagonal of the sum (or None if it can't be calculated).
+        """
+        diags = [safe_diagonal(t) for t in self.terms]
+        if any(diag is None for diag in diags):
+            return None
+        return self.scale*sum(numpy.ravel(diag) for diag in diags)
+
+
 def sph2cart(lon, lat, height):
     """
     Convert spherical coordinates to Cartesian geocentric coordinates.